@@ -9,20 +9,33 @@ panel is also available through the API, allowing you to script the complex
 actions that your situation requires.
 """
 
+import hashlib
 import os
+import time
+from collections import namedtuple
+
 import requests
+
+from poseidon.parallel import RateLimiter, imap_unordered
+from poseidon.zone import (DEFAULT_TTL, HOSTNAME_TYPES, export_zone,
+                           parse_zone)
+
 try:
     import simplejson as json
     JSON_ERROR = json.JSONDecodeError
 except ImportError:
+    import json
     JSON_ERROR = Exception
 
 API_VERSION = 'v2'
 API_URL = 'https://api.digitalocean.com'
+PER_PAGE = 200 # maximum page size allowed by the API
+
+RECORD_FIELDS = ('type', 'name', 'data', 'priority', 'port', 'weight',
+                 'flags', 'tag')
 
 
 """
-TODO: refactor for multipage results
 TODO: unit tests for Images, ImageActions, and DomainRecords
 """
 
@@ -58,16 +71,52 @@ class RestAPI(object):
         -----
         kwargs contain request parameters to be sent as request data
         """
+        data, _ = self._send(kind, resource, url_components, {}, kwargs)
+        return data
+
+    def send_conditional_request(self, resource, url_components, etag=None,
+                                 **kwargs):
+        """
+        Send a get request that is answered with 304 Not Modified if the
+        resource still matches the given ETag
+
+        Parameters
+        ----------
+        resource: str
+        url_components: list or tuple to be appended to the request URL
+        etag: str, optional
+            ETag returned by a previous call
+
+        Returns
+        -------
+        (data, etag): data is None if the resource was not modified
+        """
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        return self._send('get', resource, url_components, headers, kwargs)
+
+    def _send(self, kind, resource, url_components, extra_headers, params):
         url = self.format_request_url(resource, *url_components)
         meth = getattr(requests, kind)
         headers = self.get_request_headers()
-        req_data = self.format_parameters(**kwargs)
-        response = meth(url, headers=headers, data=req_data)
+        headers.update(extra_headers)
+        req_data = self.format_parameters(**params)
+        if kind in ('get', 'head'):
+            response = meth(url, headers=headers, params=req_data)
+        elif _nested(params):
+            # lists of objects cannot be form encoded
+            headers['Content-Type'] = 'application/json'
+            response = meth(url, headers=headers, data=json.dumps(params))
+        else:
+            response = meth(url, headers=headers, data=req_data)
+        if response.status_code == 304:
+            return None, extra_headers.get('If-None-Match')
         data = self.get_response(response)
         if response.status_code >= 300:
             msg = data.pop('message', 'API request returned error')
             raise APIError(msg, response.status_code, **data)
-        return data
+        return data, response.headers.get('ETag')
 
     def get_response(self, resp):
         """
@@ -164,6 +213,15 @@ class Resource(object):
         return self.api.send_request(kind, self.resource_path, url_components,
                                      **kwargs)
 
+    def send_conditional_request(self, url_components=(), etag=None,
+                                 **kwargs):
+        """
+        Send get request for this resource, returns (data, etag) where data
+        is None if the resource still matches etag
+        """
+        return self.api.send_conditional_request(
+            self.resource_path, url_components, etag, **kwargs)
+
     def get(self, url_components=(), **kwargs):
         """
         Send get request
@@ -202,13 +260,84 @@ class ResourceCollection(Resource):
     listed
     """
 
+    cache = None
+    key_field = 'id'
+
     def list(self, url_components=()):
         """
         Send list request for all members of a collection
         """
-        resp = self.get(url_components)
+        if self.cache is not None and not url_components:
+            return self.cache.fetch(self.result_key, self._list)
+        return self._list(url_components)
+
+    def _list(self, url_components=()):
+        resp = Resource.get(self, url_components)
         return resp.get(self.result_key, [])
 
+    def iterate(self, url_components=(), per_page=PER_PAGE, **kwargs):
+        """
+        Lazily yield all members of the collection, following pagination
+        links so that only one page is held in memory at a time
+
+        Parameters
+        ----------
+        per_page: int, default 200
+            number of members requested per round-trip
+
+        Notes
+        -----
+        kwargs contain additional query parameters (e.g., private=true)
+        """
+        page = 1
+        while True:
+            resp = Resource.get(self, url_components, page=page,
+                                per_page=per_page, **kwargs)
+            for item in resp.get(self.result_key) or []:
+                yield item
+            if not _has_next(resp):
+                break
+            page += 1
+
+    def _invalidate(self):
+        """
+        Drop cached listing after this collection has been modified
+        """
+        if self.cache is not None:
+            self.cache.invalidate(self.result_key)
+
+    def watch(self, interval=10, url_components=(), initial=False,
+              per_page=PER_PAGE):
+        """
+        Poll the collection forever and yield an Added, Removed or Changed
+        event for every member that appeared, disappeared or was modified
+        since the previous poll
+
+        Parameters
+        ----------
+        interval: float, default 10
+            seconds to sleep between polls
+        initial: bool, default False
+            If True then yield Added for every member present at the first
+            poll, otherwise the first poll only establishes the baseline
+        per_page: int, default 200
+
+        Example
+        -------
+        for event in client.droplets.watch(interval=5):
+            if isinstance(event, Changed):
+                print(event.key, event.new['status'])
+        """
+        watcher = CollectionWatcher(self, url_components, per_page)
+        events = watcher.poll()
+        while True:
+            if initial:
+                for event in events:
+                    yield event
+            initial = True
+            time.sleep(interval)
+            events = watcher.poll()
+
     @property
     def result_key(self):
         """
@@ -226,6 +355,84 @@ class ResourceCollection(Resource):
 
 
 
+Added = namedtuple('Added', ['key', 'record'])
+Removed = namedtuple('Removed', ['key', 'record'])
+Changed = namedtuple('Changed', ['key', 'old', 'new'])
+
+
+class CollectionWatcher(object):
+    """
+    Tracks a collection between polls using per-page conditional requests
+    and a digest of every member
+    """
+
+    def __init__(self, collection, url_components=(), per_page=PER_PAGE):
+        self.collection = collection
+        self.url_components = url_components
+        self.per_page = per_page
+        # per page: (etag, [(key, digest, record)], has_next)
+        self.pages = []
+        self.members = {}
+
+    def poll(self):
+        """
+        Fetch the collection and return list of events since the last poll
+        """
+        modified = False
+        pages = []
+        page = 1
+        while True:
+            etag = None
+            if page <= len(self.pages):
+                etag = self.pages[page - 1][0]
+            data, new_etag = self.collection.send_conditional_request(
+                self.url_components, etag, page=page, per_page=self.per_page)
+            if data is None:
+                pages.append(self.pages[page - 1])
+            else:
+                modified = True
+                pages.append((new_etag, self._entries(data),
+                              _has_next(data)))
+            if not pages[-1][2]:
+                break
+            page += 1
+        modified = modified or len(pages) != len(self.pages)
+        self.pages = pages
+        if not modified:
+            return []
+        return self._diff()
+
+    def _entries(self, data):
+        key_field = self.collection.key_field
+        return [(rec[key_field], _digest(rec), rec)
+                for rec in data.get(self.collection.result_key) or []]
+
+    def _diff(self):
+        previous, members, events = self.members, {}, []
+        for entries in (p[1] for p in self.pages):
+            for key, digest, record in entries:
+                members[key] = (digest, record)
+                old = previous.pop(key, None)
+                if old is None:
+                    events.append(Added(key, record))
+                elif old[0] != digest:
+                    events.append(Changed(key, old[1], record))
+        for key, (_, record) in previous.items():
+            events.append(Removed(key, record))
+        self.members = members
+        return events
+
+
+def _digest(record):
+    dump = json.dumps(record, sort_keys=True)
+    return hashlib.md5(dump.encode('utf-8')).digest()
+
+
+def _has_next(data):
+    links = data.get('links') or {}
+    return bool((links.get('pages') or {}).get('next'))
+
+
 class MutableCollection(ResourceCollection):
     """
     A special type of ResourceCollection whose individual units can be
@@ -233,14 +440,14 @@ class MutableCollection(ResourceCollection):
     """
 
     def delete(self, id):
-        return super(MutableCollection, self).delete((id,))
+        resp = super(MutableCollection, self).delete((id,))
+        self._invalidate()
+        return resp
 
     def update(self, id, **kwargs):
-        return self.put((id,), **kwargs)
-
-    def list(self, url_components=()):
-        resp = super(MutableCollection, self).get(url_components)
-        return resp.get(self.result_key, [])
+        resp = self.put((id,), **kwargs)
+        self._invalidate()
+        return resp
 
     def get(self, id, **kwargs):
         """
@@ -308,6 +515,31 @@ class Images(MutableCollection):
         info = super(Images, self).get(id)
         return ImageActions(self.api, parent=self, **info)
 
+    def by_name(self, name, private=True, region=None):
+        """
+        Retrieve an image by name (return first if duplicated)
+
+        Parameters
+        ----------
+        name: str
+            image name
+        private: bool, default True
+            If True then only search the account's snapshots and backups
+        region: str, optional
+            only match images available in this region
+
+        Returns
+        -------
+        image: dict
+        """
+        params = {'private': 'true'} if private else {}
+        for image in self.iterate(**params):
+            if image['name'] != name:
+                continue
+            if region is None or region in image.get('regions', ()):
+                return image
+        raise KeyError("Could not find image with name %s" % name)
+
 
 
 class Keys(MutableCollection):
@@ -328,8 +560,9 @@ class Keys(MutableCollection):
         return super(Keys, self).update(id, name=name)
 
     def create(self, name, public_key):
-        return (self.post(name=name, public_key=public_key)
-                .get(self.singular, None))
+        resp = self.post(name=name, public_key=public_key)
+        self._invalidate()
+        return resp.get(self.singular, None)
 
 
 
@@ -344,6 +577,7 @@ class Domains(MutableCollection):
     """
 
     resource_path = 'domains'
+    key_field = 'name'
 
     def create(self, name, ip_address):
         """
@@ -359,7 +593,7 @@ class Domains(MutableCollection):
         return (self.post(name=name, ip_address=ip_address)
                 .get(self.singular, None))
 
-    def records(self, name):
+    def records(self, name, validate=False):
         """
         Get a list of all domain records for the given domain name
 
@@ -367,9 +601,80 @@ class Domains(MutableCollection):
         ----------
         name: str
             domain name
+        validate: bool, default False
+            If True then check that the domain exists first (costs an extra
+            request), otherwise a missing domain raises APIError on first use
+        """
+        if validate and not self.get(name):
+            return None
+        return DomainRecords(self.api, name)
+
+    def export_zone(self, name, fp=None, ttl=DEFAULT_TTL):
+        """
+        Export the records of a domain as BIND zone file text. Records are
+        fetched page by page so memory use does not grow with the zone
+
+        Parameters
+        ----------
+        name: str
+            domain name
+        fp: file-like, optional
+            If given then lines are written to it, otherwise a generator of
+            lines is returned
+        ttl: int, default 1800
+            value for the $TTL directive
         """
-        if self.get(name):
-            return DomainRecords(self.api, name)
+        lines = export_zone(self.records(name).iterate(), name, ttl)
+        if fp is None:
+            return lines
+        for line in lines:
+            fp.write(line)
+
+    def import_zone(self, name, lines, ignore_types=('SOA', 'NS'),
+                    workers=8, limiter=None):
+        """
+        Create the records of a BIND zone file in the given domain. The zone
+        is parsed lazily and records are created concurrently
+
+        Parameters
+        ----------
+        name: str
+            domain name, used as origin unless the zone sets $ORIGIN
+        lines: iterable of str
+            e.g., an open zone file
+        ignore_types: tuple of str, default ('SOA', 'NS')
+            record types that are skipped (DigitalOcean manages these)
+        workers: int, default 8
+            number of requests sent concurrently
+        limiter: poseidon.parallel.RateLimiter, optional
+            shared limiter for API requests, defaults to the API rate limit
+
+        Returns
+        -------
+        (created, errors): number of records created and list of
+            (record, exception) for records that failed
+
+        Notes
+        -----
+        Records are created unconditionally, use DomainRecords.reconcile to
+        apply a zone to a domain that already has records
+        """
+        records = self.records(name)
+        if limiter is None:
+            limiter = RateLimiter()
+        wanted = (r for r in parse_zone(lines, origin=name)
+                  if r['type'] not in ignore_types)
+
+        def create(fields):
+            return limiter.call(records.create, **fields)
+
+        created, errors = 0, []
+        for fields, _, error in imap_unordered(create, wanted, workers):
+            if error is None:
+                created += 1
+            else:
+                errors.append((fields, error))
+        return created, errors
 
     def update(self, id, **kwargs):
         """
@@ -413,12 +718,12 @@ class DomainRecords(MutableCollection):
         return super(DomainRecords, self).update(id, name=name)[self.singular]
 
     def create(self, type, name=None, data=None, priority=None,
-               port=None, weight=None):
+               port=None, weight=None, flags=None, tag=None, ttl=None):
         """
         Parameters
         ----------
         type: str
-            {A, AAAA, CNAME, MX, TXT, SRV, NS}
+            {A, AAAA, CNAME, MX, TXT, SRV, NS, CAA}
         name: str
             Name of the record
         data: object, type-dependent
@@ -429,14 +734,20 @@ class DomainRecords(MutableCollection):
             type == 'TXT' : txt contents
             type == 'SRV' : target host name to direct requests for the service
             type == 'NS' :  name server that is authoritative for the domain
+            type == 'CAA' : certificate authority allowed to issue
         priority:
         port:
         weight:
+        flags, tag:
+            CAA flags (e.g., 0) and tag (issue, issuewild or iodef)
+        ttl: int, optional
+            seconds resolvers may cache the record
         """
         if type == 'A' and name is None:
             name = self.domain
         return self.post(type=type, name=name, data=data, priority=priority,
-                         port=port, weight=weight)[self.singular]
+                         port=port, weight=weight, flags=flags, tag=tag,
+                         ttl=ttl)[self.singular]
 
     def get(self, id, **kwargs):
         """
@@ -444,6 +755,201 @@ class DomainRecords(MutableCollection):
         """
         return super(DomainRecords, self).get(id, **kwargs)
 
+    def reconcile(self, desired, delete=True, ignore_types=('SOA', 'NS'),
+                  dry_run=False, workers=8, limiter=None):
+        """
+        Make the records of this domain match the desired record set using
+        the minimal number of create, update and delete requests
+
+        Parameters
+        ----------
+        desired: iterable of dict
+            records with keys type, name and data and optionally priority,
+            port, weight, flags and tag. A name of None or '@' refers to the
+            domain itself
+        delete: bool, default True
+            If True then existing records that are not desired are deleted
+        ignore_types: tuple of str, default ('SOA', 'NS')
+            record types that are never created, updated or deleted
+        dry_run: bool, default False
+            If True then compute the changes without applying them
+        workers: int, default 8
+            number of requests sent concurrently
+        limiter: poseidon.parallel.RateLimiter, optional
+            shared limiter for API requests, defaults to the API rate limit
+
+        Returns
+        -------
+        report: ReconcileReport
+
+        Notes
+        -----
+        Existing records are matched on all fields first. Leftover records
+        with the same type and name are then paired up and updated in place
+        rather than deleted and recreated. A domain that already matches
+        costs only the paginated listing.
+        """
+        current = [r for r in self.iterate() if r['type'] not in ignore_types]
+        wanted = [r for r in desired if r['type'] not in ignore_types]
+        report = ReconcileReport(*self._diff_records(current, wanted, delete))
+        if dry_run or not report.changes:
+            return report
+
+        if limiter is None:
+            limiter = RateLimiter()
+
+        def apply(change):
+            op, record, fields = change
+            if op == 'create':
+                return limiter.call(self.create, **fields)
+            elif op == 'update':
+                return limiter.call(self.update, record['id'], **fields)
+            return limiter.call(self.delete, record['id'])
+
+        changes = ([('create', None, f) for f in report.created] +
+                   [('update', r, f) for r, f in report.updated] +
+                   [('delete', r, None) for r in report.deleted])
+        for change, _, error in imap_unordered(apply, changes, workers):
+            if error is not None:
+                report.errors.append((change, error))
+        return report
+
+    def _diff_records(self, current, wanted, delete):
+        """
+        Returns (created, updated, deleted, unchanged) where created is a list
+        of field dicts, updated a list of (existing record, field dicts) and
+        deleted a list of existing records
+        """
+        existing = {}
+        for rec in current:
+            existing.setdefault(self._record_key(rec), []).append(rec)
+
+        unmatched = []
+        unchanged = 0
+        for rec in wanted:
+            fields = self._record_fields(rec)
+            matches = existing.get(self._record_key(fields))
+            if matches:
+                matches.pop()
+                unchanged += 1
+            else:
+                unmatched.append(fields)
+
+        # pair leftovers of the same type and name as in-place updates
+        leftover = {}
+        for recs in existing.values():
+            for rec in recs:
+                leftover.setdefault((rec['type'], self._record_name(rec)),
+                                    []).append(rec)
+        created, updated = [], []
+        for fields in unmatched:
+            candidates = leftover.get((fields['type'], fields['name']))
+            if candidates:
+                updated.append((candidates.pop(), fields))
+            else:
+                created.append(fields)
+        deleted = []
+        if delete:
+            deleted = [r for recs in leftover.values() for r in recs]
+        return created, updated, deleted, unchanged
+
+    def _record_name(self, record):
+        name = record.get('name')
+        if name is None or name in ('@', self.domain, self.domain + '.'):
+            return '@'
+        suffix = '.' + self.domain
+        if name.endswith('.'):
+            name = name[:-1]
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+        return name
+
+    def _record_fields(self, record):
+        fields = dict((k, record.get(k)) for k in RECORD_FIELDS)
+        fields['name'] = self._record_name(record)
+        data = fields['data']
+        if fields['type'] in HOSTNAME_TYPES and data not in (None, '@'):
+            fields['data'] = data.rstrip('.')
+        return fields
+
+    def _record_key(self, record):
+        fields = self._record_fields(record)
+        return tuple(fields[k] for k in RECORD_FIELDS)
+
+
+
+class ReconcileReport(object):
+    """
+    Result of DomainRecords.reconcile
+    """
+
+    def __init__(self, created, updated, deleted, unchanged):
+        self.created = created
+        self.updated = updated
+        self.deleted = deleted
+        self.unchanged = unchanged
+        self.errors = []
+
+    @property
+    def changes(self):
+        return len(self.created) + len(self.updated) + len(self.deleted)
+
+    def __repr__(self):
+        return ('ReconcileReport(created=%d, updated=%d, deleted=%d, '
+                'unchanged=%d, errors=%d)' %
+                (len(self.created), len(self.updated), len(self.deleted),
+                 self.unchanged, len(self.errors)))
+
+
+
+class Tags(MutableCollection):
+    """
+    Tags are labels that can be applied to droplets to group them. Droplets
+    can be listed by tag with Droplets.by_tag
+    """
+
+    resource_path = 'tags'
+    key_field = 'name'
+
+    def create(self, name):
+        """
+        Create a tag, returns the existing tag if it is already there
+        """
+        try:
+            resp = self.post(name=name)
+        except APIError as e:
+            if e.status_code != 422:
+                raise
+            return self.get(name)
+        self._invalidate()
+        return resp.get(self.singular, None)
+
+    def tag(self, name, droplet_ids):
+        """
+        Apply tag name to the given droplets
+        """
+        return self.post((name, 'resources'),
+                         resources=_droplet_resources(droplet_ids))
+
+    def untag(self, name, droplet_ids):
+        """
+        Remove tag name from the given droplets
+        """
+        return Resource.delete(self, (name, 'resources'),
+                               resources=_droplet_resources(droplet_ids))
+
+
+def _droplet_resources(droplet_ids):
+    if not isinstance(droplet_ids, (list, tuple)):
+        droplet_ids = [droplet_ids]
+    return [{'resource_id': str(id), 'resource_type': 'droplet'}
+            for id in droplet_ids]
+
+
+def _nested(params):
+    return any(isinstance(v, (list, tuple)) and v and isinstance(v[0], dict)
+               for v in params.values())
+
 
 
 # ----------------------------------------------------------------------
@@ -460,6 +966,7 @@ class Regions(ResourceCollection):
     that there are multiple datacenters available within that area.
     """
     resource_path = 'regions'
+    key_field = 'slug'
 
 
 
@@ -475,6 +982,7 @@ class Sizes(ResourceCollection):
     and the regions that the size is available in.
     """
     resource_path = 'sizes'
+    key_field = 'slug'
 
 
 
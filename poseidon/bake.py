@@ -0,0 +1,201 @@
+"""
+Content addressed bake cache. A recipe of provisioning steps on top of a
+base image is hashed, and the hash names a snapshot of a droplet that ran
+those steps. The first build provisions a builder droplet and snapshots it,
+later builds launch straight from the snapshot. Recipes can be split into
+layers, so recipes sharing a prefix also share its snapshot
+"""
+from __future__ import absolute_import
+
+import hashlib
+import threading
+import uuid
+
+from poseidon.batch import StepRecorder
+from poseidon.provision import provision
+
+SNAPSHOT_PREFIX = 'poseidon-bake-'
+
+
+class Recipe(StepRecorder):
+    """
+    Provisioning steps recorded with the same helpers as Batch (apt, pip,
+    pip_r, git, curl, chdir, wait). Only the commands are hashed, so files they
+    read on the droplet (e.g., a requirements file) are not part of the key
+
+    Example
+    -------
+    recipe = Recipe('ubuntu-14-04-x64')
+    recipe.apt('git python-pip python-dev').layer()
+    recipe.git(username='changhiskhan', repo='hello_world')
+    recipe.chdir('hello_world')
+    recipe.pip_r('requirements.txt')
+    """
+
+    def __init__(self, image, pwd=None):
+        """
+        Parameters
+        ----------
+        image: int or str
+            id or slug of the base image
+        pwd: str, optional
+            directory the first step runs in
+        """
+        super(Recipe, self).__init__(pwd)
+        self.image = image
+        self.boundaries = []
+
+    def layer(self):
+        """
+        End the current layer, the steps so far get their own snapshot
+        """
+        if self.steps and self.steps_in_layers() < len(self.steps):
+            self.boundaries.append(len(self.steps))
+        return self
+
+    def steps_in_layers(self):
+        return self.boundaries[-1] if self.boundaries else 0
+
+    def layers(self):
+        """
+        Returns
+        -------
+        list of (key, steps), one per layer. Each key hashes the base image
+            and every step up to the end of its layer
+        """
+        ends = list(self.boundaries)
+        if self.steps_in_layers() < len(self.steps):
+            ends.append(len(self.steps))
+        digest = hashlib.sha1(str(self.image))
+        layers, start = [], 0
+        for end in ends:
+            for name, cmd, pwd in self.steps[start:end]:
+                digest.update('\0%s\0%s\0%s' % (name, cmd, pwd or ''))
+            layers.append((digest.hexdigest()[:16], self.steps[start:end]))
+            start = end
+        return layers
+
+    @property
+    def key(self):
+        layers = self.layers()
+        if not layers:
+            return None
+        return layers[-1][0]
+
+
+class BakeCache(object):
+    """
+    Snapshots of baked recipes in one region
+
+    Example
+    -------
+    cache = BakeCache(client, 'nyc3', '1gb', ssh_keys=[key_id])
+    droplet = cache.create(recipe, 'web1')
+    # or launch many from the same snapshot
+    specs = [dict(name='web%d' % i, region='nyc3', size='1gb',
+                  image=cache.image(recipe), ssh_keys=[key_id])
+             for i in range(10)]
+    """
+
+    def __init__(self, client, region, size, ssh_keys=None,
+                 prefix=SNAPSHOT_PREFIX, timeout=600):
+        """
+        Parameters
+        ----------
+        client: Client
+        region: str
+            snapshots are taken and used in this region
+        size: str
+            size slug of builder droplets
+        ssh_keys: list, optional
+            keys builder droplets are created with
+        prefix: str, default 'poseidon-bake-'
+            snapshots are named prefix + recipe key
+        timeout: float, default 600
+            seconds a builder may take to become active and reachable
+        """
+        self.client = client
+        self.region = region
+        self.size = size
+        self.ssh_keys = ssh_keys
+        self.prefix = prefix
+        self.timeout = timeout
+        self._lock = threading.Lock()
+
+    def snapshot_name(self, key):
+        return self.prefix + key
+
+    def lookup(self, key):
+        """
+        Snapshot baked for a key in this cache's region or None
+        """
+        try:
+            return self.client.images.by_name(self.snapshot_name(key),
+                                              region=self.region)
+        except KeyError:
+            return None
+
+    def image(self, recipe):
+        """
+        Id of the snapshot for the recipe, baking the layers that are not
+        cached yet on top of the newest one that is
+        """
+        layers = recipe.layers()
+        if not layers:
+            return recipe.image
+        with self._lock:
+            cached, base = 0, recipe.image
+            for i in range(len(layers), 0, -1):
+                snapshot = self.lookup(layers[i - 1][0])
+                if snapshot is not None:
+                    cached, base = i, snapshot['id']
+                    break
+            if cached == len(layers):
+                return base
+            self._bake(base, layers[cached:])
+            snapshot = self.lookup(layers[-1][0])
+        if snapshot is None:
+            raise ValueError('snapshot %s not found after baking' %
+                             self.snapshot_name(layers[-1][0]))
+        return snapshot['id']
+
+    def create(self, recipe, name, **kwargs):
+        """
+        Create a droplet from the recipe's snapshot, see Droplets.create
+        """
+        kwargs.setdefault('ssh_keys', self.ssh_keys)
+        return self.client.droplets.create(name, self.region, self.size,
+                                           self.image(recipe), **kwargs)
+
+    def _bake(self, image, layers):
+        spec = dict(name='%sbuilder-%s' % (self.prefix, uuid.uuid4().hex[:8]),
+                    region=self.region, size=self.size, image=image,
+                    ssh_keys=self.ssh_keys)
+        job = next(provision(self.client.droplets, [spec],
+                             timeout=self.timeout, pool=False))
+        droplet = job.value.droplet
+        try:
+            if not job.ok:
+                raise job.error
+            ssh = job.value.ssh
+            for i, (key, steps) in enumerate(layers):
+                if i:
+                    droplet.power_on()
+                    ssh = droplet.connect(pool=False)
+                    ssh.wait_ready(self.timeout)
+                batch = ssh.batch()
+                batch.steps = list(steps)
+                batch.run()
+                ssh.close()
+                self._power_off(droplet)
+                droplet.take_snapshot(self.snapshot_name(key))
+        finally:
+            if droplet is not None:
+                droplet.delete(wait=False)
+
+    def _power_off(self, droplet):
+        # a clean shutdown flushes the file system before the snapshot
+        droplet.shutdown()
+        droplet.refresh()
+        if getattr(droplet, 'status', None) != 'off':
+            droplet.power_off()
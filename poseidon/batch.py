@@ -0,0 +1,209 @@
+"""
+Record SSHClient provisioning helpers and run them as one remote script so
+that provisioning costs a single exec instead of a round-trip per step
+"""
+from __future__ import absolute_import
+
+import base64
+import os
+import uuid
+
+from poseidon.ssh import (
+    CommandError, apt_command, curl_command, git_command, pip_command,
+    pip_r_command)
+
+STEP_MARKER = '__poseidon_step'
+
+
+class StepResult(object):
+    """
+    Outcome of one step of a batch
+    """
+
+    def __init__(self, index, name, cmd, pwd, exit_status=None, stdout='',
+                 stderr='', elapsed=None):
+        self.index = index
+        self.name = name
+        self.cmd = cmd
+        self.pwd = pwd
+        self.exit_status = exit_status
+        self.stdout = stdout
+        self.stderr = stderr
+        self.elapsed = elapsed
+
+    @property
+    def skipped(self):
+        return self.exit_status is None
+
+    @property
+    def ok(self):
+        return self.exit_status == 0
+
+    def __repr__(self):
+        return 'StepResult(%d, %r, exit_status=%r, elapsed=%r)' % (
+            self.index, self.name, self.exit_status, self.elapsed)
+
+
+class BatchError(CommandError):
+    """
+    Error raised when a step of a batch fails
+    """
+
+    def __init__(self, message, exit_status, stderr='', results=None):
+        super(BatchError, self).__init__(message, exit_status, stderr)
+        self.results = results
+
+
+class StepRecorder(object):
+    """
+    Records calls to the SSHClient provisioning helpers as
+    (name, command, directory) steps
+    """
+
+    def __init__(self, pwd=None):
+        """
+        Parameters
+        ----------
+        pwd: str, optional
+            directory the first step runs in
+        """
+        self.pwd = pwd
+        self.steps = []
+
+    def add(self, cmd, name=None):
+        """
+        Record an arbitrary shell command run in the current directory
+        """
+        if name is None:
+            name = cmd.split(' ', 1)[0]
+        self.steps.append((name, cmd, self.pwd))
+        return self
+
+    def wait(self, cmd):
+        return self.add(cmd)
+
+    def apt(self, package_names):
+        return self.add(apt_command(package_names), 'apt')
+
+    def pip(self, package_names):
+        return self.add(pip_command(package_names), 'pip')
+
+    def pip_r(self, requirements):
+        return self.add(pip_r_command(requirements), 'pip_r')
+
+    def curl(self, url, **kwargs):
+        return self.add(curl_command(url, **kwargs), 'curl')
+
+    def git(self, username, repo, alias=None, token=None):
+        if alias is None:
+            alias = repo
+        cmd = 'mkdir -p %s && cd %s && %s' % (
+            alias, alias, git_command(username, repo, token))
+        return self.add(cmd, 'git')
+
+    def chdir(self, new_pwd, relative=True):
+        """
+        Change directory for the following steps (costs no step)
+        """
+        if new_pwd and self.pwd and relative:
+            new_pwd = os.path.join(self.pwd, new_pwd)
+        self.pwd = new_pwd
+        return self
+
+
+class Batch(StepRecorder):
+    """
+    Recorder with the same provisioning helpers as SSHClient. Calls are
+    compiled into a bash script that is sent over stdin and run in a single
+    exec, with each step's exit status, timing and output reported back
+    """
+
+    def __init__(self, client, keep_going=False):
+        """
+        Parameters
+        ----------
+        client: SSHClient
+        keep_going: bool, default False
+            If True then later steps run even if an earlier one failed
+        """
+        super(Batch, self).__init__(client.pwd)
+        self.client = client
+        self.keep_going = keep_going
+        self.results = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.run()
+
+    def script(self, marker=STEP_MARKER):
+        """
+        Compile recorded steps into a bash script. For each step the script
+        prints a header line with the step index, exit status and start and
+        end times, followed by its stdout and stderr base64 encoded on one
+        line each
+        """
+        lines = ['__d=$(mktemp -d)', "trap 'rm -rf \"$__d\"' EXIT"]
+        for i, (name, cmd, pwd) in enumerate(self.steps):
+            cd = 'cd %s && ' % pwd if pwd else ''
+            lines.extend([
+                '__s=$(date +%s.%N)',
+                '( %s%s\n) > "$__d/o" 2> "$__d/e" < /dev/null' % (cd, cmd),
+                '__rc=$?',
+                "printf '%s %d %%d %%s %%s\\n' $__rc $__s $(date +%%s.%%N)" %
+                (marker, i),
+                'base64 -w0 < "$__d/o"; echo',
+                'base64 -w0 < "$__d/e"; echo',
+            ])
+            if not self.keep_going:
+                lines.append('[ $__rc -eq 0 ] || exit $__rc')
+        return '\n'.join(lines) + '\n'
+
+    def run(self, raise_on_error=True):
+        """
+        Upload and run the script, returning a StepResult per step. Steps
+        after a failure are reported as skipped unless keep_going is set
+
+        Parameters
+        ----------
+        raise_on_error: bool, default True
+            If True then raise BatchError if any step failed
+        """
+        marker = '%s_%s' % (STEP_MARKER, uuid.uuid4().hex)
+        command = self.client.execute('bash -s', lines=False)
+        command.write(self.script(marker))
+        command.close_stdin()
+        stdout, stderr = [], []
+        command.wait(stdout=stdout.append, stderr=stderr.append)
+        self.results = self._parse(''.join(stdout), marker)
+
+        failed = [r for r in self.results if not r.ok and not r.skipped]
+        if failed and raise_on_error:
+            step = failed[0]
+            raise BatchError('step %d (%s) exited with status %d: %s' %
+                             (step.index, step.name, step.exit_status,
+                              step.stderr), step.exit_status, step.stderr,
+                             results=self.results)
+        if raise_on_error and len(failed) == 0 and any(
+                r.skipped for r in self.results):
+            # the script died without reporting a failed step
+            raise BatchError('batch script failed: %s' % ''.join(stderr),
+                             None, ''.join(stderr), results=self.results)
+        return self.results
+
+    def _parse(self, output, marker):
+        results = [StepResult(i, name, cmd, pwd)
+                   for i, (name, cmd, pwd) in enumerate(self.steps)]
+        lines = output.split('\n')
+        for i, line in enumerate(lines):
+            if not line.startswith(marker + ' '):
+                continue
+            index, status, start, end = line.split(' ')[1:5]
+            result = results[int(index)]
+            result.exit_status = int(status)
+            result.elapsed = float(end) - float(start)
+            result.stdout = base64.b64decode(lines[i + 1])
+            result.stderr = base64.b64decode(lines[i + 2])
+        return results
@@ -0,0 +1,207 @@
+"""
+Persistent on-disk cache for the slow-changing DigitalOcean catalogs
+(regions, sizes, images and keys).
+
+Entries are served immediately even when stale and refreshed in a background
+thread, so a new process does not have to wait on the API before doing
+anything useful. Each entry is a single JSON file that is replaced atomically
+so concurrent processes can read it safely.
+"""
+from __future__ import absolute_import
+
+import errno
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+try:
+    import fcntl
+except ImportError:
+    # no cross-process refresh lock on this platform
+    fcntl = None
+
+CACHE_DIR = os.path.join('~', '.poseidon', 'cache')
+
+
+class CatalogCache(object):
+    """
+    Stale-while-revalidate cache keyed by account and API URL
+    """
+
+    def __init__(self, api, path=None, ttl=3600, max_stale=86400,
+                 background=True):
+        """
+        Parameters
+        ----------
+        api: DigitalOceanAPI
+            used to derive the cache key, the API key itself is never stored
+        path: str, optional
+            cache root directory, defaults to ~/.poseidon/cache
+        ttl: int, default 3600
+            seconds after which an entry is considered stale and refreshed
+        max_stale: int, default 86400
+            seconds after which a stale entry is no longer served and the
+            catalog is fetched synchronously instead
+        background: bool, default True
+            If True then stale entries are refreshed in a daemon thread,
+            otherwise they are refreshed before returning
+        """
+        if path is None:
+            path = CACHE_DIR
+        self.path = os.path.join(os.path.expanduser(path), self.key_for(api))
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.background = background
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key_for(api):
+        """
+        Cache key for an account on a given API endpoint
+        """
+        ident = '\0'.join((api.api_key, api.api_url, api.api_version))
+        return hashlib.sha1(ident.encode('utf-8')).hexdigest()[:16]
+
+    def fetch(self, name, loader):
+        """
+        Return cached catalog, calling loader() to (re)populate it
+
+        Parameters
+        ----------
+        name: str
+            catalog name (e.g., regions, sizes)
+        loader: callable
+            no-argument function returning the fresh catalog
+        """
+        entry = self.read(name)
+        if entry is None:
+            return self.refresh(name, loader)
+        age = time.time() - entry['fetched']
+        if age > self.max_stale:
+            return self.refresh(name, loader)
+        if age > self.ttl:
+            if self.background:
+                self._refresh_async(name, loader)
+            else:
+                return self.refresh(name, loader)
+        return entry['data']
+
+    def refresh(self, name, loader):
+        """
+        Fetch catalog from loader and write it to disk
+        """
+        data = loader()
+        self.write(name, data)
+        return data
+
+    def invalidate(self, name):
+        """
+        Remove a cached catalog (e.g., after creating or deleting a key)
+        """
+        try:
+            os.remove(self._file(name))
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    def clear(self):
+        """
+        Remove all cached catalogs for this account
+        """
+        if not os.path.isdir(self.path):
+            return
+        for fname in os.listdir(self.path):
+            if fname.endswith('.json'):
+                self.invalidate(fname[:-len('.json')])
+
+    def read(self, name):
+        """
+        Read cached entry as dict with keys {fetched, data} or None
+        """
+        try:
+            with open(self._file(name), 'r') as fh:
+                entry = json.load(fh)
+        except (IOError, OSError, ValueError):
+            # missing, or corrupted by something other than us
+            return None
+        if not isinstance(entry, dict) or 'fetched' not in entry:
+            return None
+        return entry
+
+    def write(self, name, data):
+        """
+        Atomically replace cached entry so readers never see partial files
+        """
+        self._ensure_dir()
+        fd, tmp = tempfile.mkstemp(prefix='.%s.' % name, dir=self.path)
+        try:
+            with os.fdopen(fd, 'w') as fh:
+                json.dump({'fetched': time.time(), 'data': data}, fh)
+            os.rename(tmp, self._file(name))
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def _refresh_async(self, name, loader):
+        with self._lock:
+            if name in self._refreshing:
+                return
+            self._refreshing.add(name)
+
+        def run():
+            try:
+                lock = self._acquire_file_lock(name)
+                if lock is False:
+                    # another process is already refreshing this catalog
+                    return
+                try:
+                    self.refresh(name, loader)
+                finally:
+                    if lock is not None:
+                        lock.close()
+            except Exception:
+                # stale data is still served, next call will retry
+                pass
+            finally:
+                with self._lock:
+                    self._refreshing.discard(name)
+
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def _acquire_file_lock(self, name):
+        """
+        Returns open lock file, None if locking is unsupported, or False if
+        the lock is held by another process
+        """
+        if fcntl is None:
+            return None
+        self._ensure_dir()
+        fh = open(os.path.join(self.path, '%s.lock' % name), 'a')
+        try:
+            fcntl.flock(fh.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            fh.close()
+            return False
+        return fh
+
+    def _file(self, name):
+        return os.path.join(self.path, '%s.json' % name)
+
+    def _ensure_dir(self):
+        try:
+            os.makedirs(self.path)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
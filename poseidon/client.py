@@ -1,6 +1,7 @@
 from poseidon.api import (
     API_URL, API_VERSION, DigitalOceanAPI, Actions, Domains,
-    Images, Keys, Regions, Sizes)
+    Images, Keys, Regions, Sizes, Tags)
+from poseidon.cache import CatalogCache
 from poseidon.droplet import Droplets
 
 
@@ -20,7 +21,20 @@ class Client(object):
     complex actions that your situation requires.
     """
 
-    def __init__(self, api_key=None, api_url=API_URL, api_version=API_VERSION):
+    def __init__(self, api_key=None, api_url=API_URL, api_version=API_VERSION,
+                 cache=None):
+        """
+        Parameters
+        ----------
+        api_key: str, optional
+            If not supplied uses value of envvar DIGITALOCEAN_API_KEY
+        api_url: str, optional
+        api_version: str, optional
+        cache: bool, str or CatalogCache, optional
+            Persist regions, sizes, images and keys listings on disk and
+            serve them stale-while-revalidate. True uses the default cache
+            directory, a str is used as the cache directory
+        """
         self.api = DigitalOceanAPI(api_key, api_url, api_version)
         self.actions = Actions(self.api)
         self.domains = Domains(self.api)
@@ -29,8 +43,23 @@ class Client(object):
         self.keys = Keys(self.api)
         self.regions = Regions(self.api)
         self.sizes = Sizes(self.api)
+        self.tags = Tags(self.api)
+        self.droplets.images = self.images
+        self.cache = None
+        if cache:
+            self.cache = self._make_cache(cache)
+            for coll in (self.images, self.keys, self.regions, self.sizes):
+                coll.cache = self.cache
 
+    def _make_cache(self, cache):
+        if isinstance(cache, CatalogCache):
+            return cache
+        if isinstance(cache, basestring):
+            return CatalogCache(self.api, path=cache)
+        return CatalogCache(self.api)
 
 
-def connect(api_key=None, api_url=API_URL, api_version=API_VERSION):
-    return Client(api_key, api_url, api_version)
+
+def connect(api_key=None, api_url=API_URL, api_version=API_VERSION,
+            cache=None):
+    return Client(api_key, api_url, api_version, cache=cache)
@@ -0,0 +1,300 @@
+"""
+Run API requests and SSH commands as a graph of tasks. A task starts as
+soon as the tasks it depends on are done, so independent branches (e.g.,
+DNS records and package installs that both only need the droplet) run at
+the same time, with separate concurrency limits for the API and for each
+SSH host
+"""
+from __future__ import absolute_import
+
+import threading
+import time
+
+API = 'api'
+API_WORKERS = 4
+HOST_WORKERS = 2
+
+
+class Task(object):
+    """
+    One node of a Graph. value is what func returned, ready, start and end
+    are seconds since the graph started running
+    """
+
+    def __init__(self, name, func, deps=(), resource=None):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.resource = resource
+        self.reset()
+
+    def reset(self):
+        self.status = 'pending'
+        self.value = None
+        self.error = None
+        self.key = None
+        self.ready = None
+        self.start = None
+        self.end = None
+
+    @property
+    def ok(self):
+        return self.status == 'done'
+
+    @property
+    def elapsed(self):
+        if self.start is None or self.end is None:
+            return None
+        return self.end - self.start
+
+    @property
+    def waited(self):
+        """
+        Seconds spent waiting for a free slot of its resource
+        """
+        if self.ready is None or self.start is None:
+            return None
+        return self.start - self.ready
+
+    def __repr__(self):
+        return 'Task(%r, status=%r, elapsed=%r)' % (self.name, self.status,
+                                                    self.elapsed)
+
+
+class GraphError(Exception):
+    """
+    Error raised when tasks of a graph failed
+    """
+
+    def __init__(self, message, report):
+        super(GraphError, self).__init__(message)
+        self.report = report
+
+
+class Report(object):
+    """
+    Timings of a finished graph run
+    """
+
+    def __init__(self, tasks, elapsed):
+        self.tasks = tasks
+        self.elapsed = elapsed
+
+    def __getitem__(self, name):
+        for task in self.tasks:
+            if task.name == name:
+                return task
+        raise KeyError(name)
+
+    @property
+    def failed(self):
+        return [t for t in self.tasks if t.status == 'failed']
+
+    @property
+    def skipped(self):
+        return [t for t in self.tasks if t.status == 'skipped']
+
+    def critical_path(self):
+        """
+        Chain of tasks that determined the total run time: starting from
+        the task that finished last, each step goes to the dependency that
+        finished last
+        """
+        by_name = dict((t.name, t) for t in self.tasks)
+        ran = [t for t in self.tasks if t.end is not None]
+        if not ran:
+            return []
+        task = max(ran, key=lambda t: t.end)
+        path = [task]
+        while task.deps:
+            task = max((by_name[d] for d in task.deps),
+                       key=lambda t: t.end)
+            path.append(task)
+        return path[::-1]
+
+    def format(self):
+        """
+        Table of tasks in start order, critical path tasks marked with *
+        """
+        critical = set(t.name for t in self.critical_path())
+        width = max([len(t.name) for t in self.tasks] + [4])
+        lines = ['  %-*s %-16s %-8s %8s %8s %8s' % (
+            width, 'task', 'resource', 'status', 'start', 'waited',
+            'elapsed')]
+
+        def seconds(value):
+            return '-' if value is None else '%.2f' % value
+
+        order = sorted(self.tasks, key=lambda t: (t.start is None, t.start))
+        for t in order:
+            lines.append('%s %-*s %-16s %-8s %8s %8s %8s' % (
+                '*' if t.name in critical else ' ', width, t.name,
+                t.key or '-', t.status, seconds(t.start), seconds(t.waited),
+                seconds(t.elapsed)))
+        lines.append('total %.2fs, critical path %s' % (
+            self.elapsed, ' -> '.join(t.name for t in self.critical_path())))
+        return '\n'.join(lines)
+
+    def __str__(self):
+        return self.format()
+
+
+class Graph(object):
+    """
+    Tasks with dependencies. Each task is called with the values of its
+    dependencies, in the order they were declared, and runs on its own
+    thread once they are done. Tasks depending on a failed task are skipped
+
+    Example
+    -------
+    graph = Graph()
+    graph.add('droplet', lambda: client.droplets.create(
+        'web1', 'nyc3', '512mb', 'ubuntu-14-04-x64', ssh_keys=[key_id]),
+        resource=API)
+    graph.add('dns', lambda d: client.domains.create('example.com',
+                                                     d.ip_address),
+              deps=['droplet'], resource=API)
+    graph.add('ssh', lambda d: d.connect(wait=True), deps=['droplet'])
+    graph.add('apt', lambda ssh: ssh.apt('nginx'), deps=['ssh'],
+              resource=lambda ssh: ssh.host)
+    print(graph.run())
+    """
+
+    def __init__(self, api_workers=API_WORKERS, host_workers=HOST_WORKERS,
+                 limits=None, rate=None):
+        """
+        Parameters
+        ----------
+        api_workers: int, default 4
+            tasks with resource API running at the same time
+        host_workers: int, default 2
+            tasks running at the same time on any other resource, typically
+            one SSH host
+        limits: dict, optional
+            resource -> limit overriding the defaults above
+        rate: RateLimiter, optional
+            API tasks wait for a token and are retried on 429 responses
+        """
+        self.api_workers = api_workers
+        self.host_workers = host_workers
+        self.limits = dict(limits or {})
+        self.rate = rate
+        self.tasks = []
+        self._by_name = {}
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, func, deps=(), resource=None):
+        """
+        Add a task. Dependencies must have been added before, so a graph
+        cannot contain cycles
+
+        Parameters
+        ----------
+        name: str
+        func: callable
+            called with the values of deps
+        deps: sequence of str
+            names of tasks this task needs
+        resource: str or callable, optional
+            concurrency limit the task counts against: API for DigitalOcean
+            requests, a host name for SSH steps, or a callable returning one
+            from the values of deps. Unlimited if None
+        """
+        if name in self._by_name:
+            raise ValueError('duplicate task %s' % name)
+        for dep in deps:
+            if dep not in self._by_name:
+                raise ValueError('unknown dependency %s of task %s' %
+                                 (dep, name))
+        task = Task(name, func, deps, resource)
+        self.tasks.append(task)
+        self._by_name[name] = task
+        return task
+
+    def __getitem__(self, name):
+        return self._by_name[name]
+
+    def run(self, raise_on_error=True):
+        """
+        Run every task and return a Report
+
+        Parameters
+        ----------
+        raise_on_error: bool, default True
+            If True then raise GraphError if any task failed
+        """
+        for task in self.tasks:
+            task.reset()
+        self._start = time.time()
+        self._cond = threading.Condition()
+        with self._cond:
+            self._schedule()
+            while any(t.status in ('pending', 'running') for t in self.tasks):
+                # timeout keeps the wait interruptible with Ctrl-C
+                self._cond.wait(0.5)
+        report = Report(list(self.tasks), time.time() - self._start)
+
+        failed = report.failed
+        if failed and raise_on_error:
+            task = failed[0]
+            raise GraphError('task %s failed: %s' % (task.name, task.error),
+                             report)
+        return report
+
+    def _schedule(self):
+        # called with self._cond held
+        changed = True
+        while changed:
+            changed = False
+            for task in self.tasks:
+                if task.status != 'pending':
+                    continue
+                deps = [self._by_name[d] for d in task.deps]
+                if any(d.status in ('failed', 'skipped') for d in deps):
+                    task.status = 'skipped'
+                    changed = True
+                elif all(d.ok for d in deps):
+                    task.status = 'running'
+                    task.ready = time.time() - self._start
+                    thread = threading.Thread(target=self._work,
+                                              args=(task,))
+                    thread.daemon = True
+                    thread.start()
+        self._cond.notify_all()
+
+    def _work(self, task):
+        args = [self._by_name[d].value for d in task.deps]
+        try:
+            task.key = task.resource
+            if callable(task.resource):
+                task.key = task.resource(*args)
+            semaphore = self._semaphore(task.key)
+            if semaphore is not None:
+                semaphore.acquire()
+            try:
+                task.start = time.time() - self._start
+                if task.key == API and self.rate is not None:
+                    task.value = self.rate.call(task.func, *args)
+                else:
+                    task.value = task.func(*args)
+            finally:
+                task.end = time.time() - self._start
+                if semaphore is not None:
+                    semaphore.release()
+        except Exception as e:
+            task.error = e
+        with self._cond:
+            task.status = 'failed' if task.error is not None else 'done'
+            self._schedule()
+
+    def _semaphore(self, key):
+        if key is None:
+            return None
+        with self._lock:
+            if key not in self._semaphores:
+                default = (self.api_workers if key == API
+                           else self.host_workers)
+                self._semaphores[key] = threading.BoundedSemaphore(
+                    self.limits.get(key, default))
+            return self._semaphores[key]
@@ -0,0 +1,159 @@
+"""
+Deploy a local git repository to a droplet by streaming a git bundle over
+SSH. Only commits missing on the droplet are bundled, so re-deploys send
+just the new history and no credentials ever reach the droplet
+"""
+from __future__ import absolute_import
+
+import os
+import subprocess
+import uuid
+from collections import namedtuple
+
+try:
+    from shlex import quote
+except ImportError:
+    from pipes import quote
+
+from poseidon.ssh import CHUNK_SIZE, CommandError
+from poseidon.sync import shell_path
+
+BUNDLE = '.git/poseidon.bundle'
+
+DeployResult = namedtuple('DeployResult', ['revision', 'previous', 'sent'])
+
+
+def _git(repo, *args):
+    return subprocess.check_output(('git', '-C', repo) + args).strip()
+
+
+def resolve(repo, rev):
+    """
+    Commit id for rev in the local repository or None if it is unknown
+    """
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(
+                ['git', '-C', repo, 'rev-parse', '-q', '--verify',
+                 '%s^{commit}' % rev], stderr=devnull).strip()
+    except subprocess.CalledProcessError:
+        return None
+
+
+def merge_base(repo, a, b):
+    try:
+        return _git(repo, 'merge-base', a, b)
+    except subprocess.CalledProcessError:
+        return None
+
+
+def plan(repo, ref, remote_rev):
+    """
+    Decide what to send to a host whose HEAD is remote_rev
+
+    Returns
+    -------
+    (action, revision, basis): action is 'skip' when the host is up to
+        date, 'checkout' when it already has the commit and 'bundle' when
+        commits must be sent, in which case basis is the newest commit the
+        host is known to have (None for a full bundle)
+    """
+    revision = resolve(repo, ref)
+    if revision is None:
+        raise ValueError('%s is not a commit in %s' % (ref, repo))
+    if remote_rev == revision:
+        return 'skip', revision, None
+    basis = None
+    if remote_rev and resolve(repo, remote_rev):
+        # anything reachable from the host's HEAD is already there
+        basis = merge_base(repo, remote_rev, revision)
+    if basis == revision:
+        return 'checkout', revision, None
+    return 'bundle', revision, basis
+
+
+def deploy_script(remote_dir, marker):
+    """
+    Remote side of a deploy: print the current HEAD and a marker line, then
+    read '<action> <commit>' on stdin, followed by the bundle for 'bundle'
+    """
+    return '\n'.join([
+        'set -e',
+        'mkdir -p %s' % shell_path(remote_dir),
+        'cd %s' % shell_path(remote_dir),
+        '[ -d .git ] || git init -q',
+        'git rev-parse -q --verify HEAD || true',
+        'echo %s' % marker,
+        'IFS=" " read -r action rev',
+        '[ "$action" = skip ] && exit 0',
+        'if [ "$action" = bundle ]; then',
+        "    trap 'rm -f %s' EXIT" % BUNDLE,
+        '    cat > %s' % BUNDLE,
+        '    git fetch -q %s' % BUNDLE,
+        'fi',
+        'git -c advice.detachedHead=false checkout -q -f --detach "$rev"',
+    ])
+
+
+def deploy(client, repo, remote_dir, ref='HEAD'):
+    """
+    Check out ref of the local repository in remote_dir on the host. See
+    SSHClient.git_deploy
+    """
+    repo = os.path.expanduser(repo)
+    marker = '__poseidon_deploy_%s' % uuid.uuid4().hex
+    command = client.execute('sh -c %s' % quote(
+        deploy_script(remote_dir, marker)))
+    output = iter(command)
+    previous, stderr = None, []
+    for stream, line in output:
+        if stream == 'stderr':
+            stderr.append(line)
+        elif line == marker:
+            break
+        elif line.strip():
+            previous = line.strip()
+    else:
+        raise CommandError('deploy to %s failed: %s' %
+                           (remote_dir, '\n'.join(stderr)),
+                           command.exit_status, '\n'.join(stderr))
+
+    try:
+        action, revision, basis = plan(repo, ref, previous)
+    except Exception:
+        command.write('skip -\n')
+        command.close_stdin()
+        raise
+    command.write('%s %s\n' % (action, revision))
+    sent = 0
+    try:
+        if action == 'bundle':
+            sent = _send_bundle(command, repo, ref, basis)
+    finally:
+        command.close_stdin()
+
+    for stream, line in output:
+        if stream == 'stderr':
+            stderr.append(line)
+    status = command.exit_status
+    if status != 0:
+        raise CommandError('deploy to %s failed: %s' %
+                           (remote_dir, '\n'.join(stderr)), status,
+                           '\n'.join(stderr))
+    return DeployResult(revision, previous, sent)
+
+
+def _send_bundle(command, repo, ref, basis=None):
+    args = ['git', '-C', repo, 'bundle', 'create', '-', ref]
+    if basis is not None:
+        args.append('^%s' % basis)
+    with open(os.devnull, 'w') as devnull:
+        proc = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=devnull)
+    sent = 0
+    for data in iter(lambda: proc.stdout.read(CHUNK_SIZE), ''):
+        command.write(data)
+        sent += len(data)
+    if proc.wait() != 0:
+        raise ValueError('git bundle create failed for %s in %s' %
+                         (ref, repo))
+    return sent
@@ -16,6 +16,9 @@ class Droplets(MutableCollection):
 
     resource_path = 'droplets'
 
+    # Images collection whose cached listing is dropped after snapshots
+    images = None
+
     def kernels(self, id):
         """
         Return all kernels for a given droplet
@@ -78,7 +81,8 @@ class Droplets(MutableCollection):
         return super(MutableCollection, self).get((id, prop))[prop]
 
     def create(self, name, region, size, image, ssh_keys=None,
-               backups=None, ipv6=None, private_networking=None, wait=True):
+               backups=None, ipv6=None, private_networking=None, wait=True,
+               tags=None):
         """
         Create a new droplet
 
@@ -105,13 +109,15 @@ class Droplets(MutableCollection):
             networking is currently only available in certain regions
         wait: bool, default True
             if True then block until creation is complete
+        tags: list of str, optional
+            names of tags to apply to the Droplet
         """
         if ssh_keys and not isinstance(ssh_keys, (list, tuple)):
             raise TypeError("ssh_keys must be a list")
         resp = self.post(name=name, region=region, size=size, image=image,
                          ssh_keys=ssh_keys,
                          private_networking=private_networking,
-                         backups=backups, ipv6=ipv6)
+                         backups=backups, ipv6=ipv6, tags=tags)
         droplet = self.get(resp[self.singular]['id'])
         if wait:
             droplet.wait()
@@ -119,6 +125,22 @@ class Droplets(MutableCollection):
         droplet = self.get(resp[self.singular]['id'])
         return droplet
 
+    def provision(self, specs, setup=None, **kwargs):
+        """
+        Create many droplets and set each up as soon as it accepts SSH
+        logins, yielding a Job per droplet as it finishes. See
+        poseidon.provision.provision for the options
+
+        Parameters
+        ----------
+        specs: iterable of dict
+            keyword arguments for create
+        setup: callable, optional
+            called with (ssh, droplet) once the droplet is reachable
+        """
+        from poseidon.provision import provision
+        return provision(self, specs, setup=setup, **kwargs)
+
     def get(self, id):
         """
         Retrieve a droplet by id
@@ -156,6 +178,26 @@ class Droplets(MutableCollection):
                 return self.get(d['id'])
         raise KeyError("Could not find droplet with name %s" % name)
 
+    def by_tag(self, tag):
+        """
+        Retrieve all droplets carrying a tag
+
+        Parameters
+        ----------
+        tag: str
+            tag name
+
+        Returns
+        -------
+        droplets: list of DropletActions
+        """
+        return [DropletActions(self.api, self, **info)
+                for info in self.iterate(tag_name=tag)]
+
+    def _invalidate_images(self):
+        if self.images is not None:
+            self.images._invalidate()
+
     def update(self, id, **kwargs):
         """
         A droplet cannot be updated via POST
@@ -411,7 +453,9 @@ class DropletActions(Resource):
         wait: bool, default True
             Whether to block until the pending action is completed
         """
-        return self._action('snapshot', name=name, wait=wait)
+        resp = self._action('snapshot', name=name, wait=wait)
+        self.parent._invalidate_images()
+        return resp
 
     def kernels(self):
         """
@@ -509,7 +553,7 @@ class DropletActions(Resource):
             raise ValueError("No private IP found")
         return ip
 
-    def connect(self, interactive=False):
+    def connect(self, interactive=False, pool=True, wait=False, timeout=300):
         """
         Open SSH connection to droplet
 
@@ -518,7 +562,21 @@ class DropletActions(Resource):
         interactive: bool, default False
             If True then SSH client will prompt for password when necessary
             and also print output to console
-        """
-        from poseidon.ssh import SSHClient
-        rs = SSHClient(self.ip_address, interactive=interactive)
+        pool: bool or SSHPool, default True
+            If True then reuse a connection from the process-wide pool so
+            repeated calls do not redo the TCP connect, key exchange and
+            auth. False opens a dedicated connection
+        wait: bool, default False
+            If True then wait until sshd accepts logins (e.g., for a droplet
+            that was just created) and return a connected client
+        timeout: float, default 300
+            seconds to wait for sshd when wait is True
+        """
+        from poseidon.ssh import SSHClient, default_pool
+        if pool is True:
+            pool = default_pool()
+        rs = SSHClient(self.ip_address, interactive=interactive,
+                       pool=pool or None)
+        if wait:
+            rs.wait_ready(timeout)
         return rs
@@ -0,0 +1,343 @@
+"""
+Run SSH commands on many droplets at once
+"""
+from __future__ import absolute_import
+
+import threading
+import time
+from collections import namedtuple
+
+try:
+    from Queue import Queue, Empty, Full
+except ImportError:
+    from queue import Queue, Empty, Full
+
+try:
+    from shlex import quote
+except ImportError:
+    from pipes import quote
+
+from poseidon.parallel import imap_unordered
+from poseidon.ssh import SSHClient, default_pool
+
+DEFAULT_WORKERS = 16
+
+# lines buffered between the host readers and the consumer
+TAIL_BUFFER = 1000
+
+LogLine = namedtuple('LogLine', ['host', 'time', 'stream', 'line'])
+
+_DONE = object()
+
+
+class HostResult(object):
+    """
+    Outcome of running a command or helper on a single host
+    """
+
+    def __init__(self, host, target, exit_status=None, stdout='', stderr='',
+                 result=None, error=None, elapsed=None):
+        self.host = host
+        self.target = target
+        self.exit_status = exit_status
+        self.stdout = stdout
+        self.stderr = stderr
+        self.result = result
+        self.error = error
+        self.elapsed = elapsed
+
+    @property
+    def ok(self):
+        return self.error is None and self.exit_status in (0, None)
+
+    def __repr__(self):
+        return ('HostResult(host=%r, exit_status=%r, error=%r, '
+                'elapsed=%.2f)' % (self.host, self.exit_status, self.error,
+                                   self.elapsed or 0))
+
+
+class Fleet(object):
+    """
+    Executes commands concurrently across many hosts with a bounded number
+    of workers, yielding per-host results as soon as each host finishes so
+    one slow host does not hold up the others
+    """
+
+    def __init__(self, targets, workers=DEFAULT_WORKERS, username='root',
+                 password=None, pool=True):
+        """
+        Parameters
+        ----------
+        targets: list of DropletActions, SSHClient or str
+            droplets, connected clients or host names / ip addresses
+        workers: int, default 16
+            maximum number of hosts worked on at the same time
+        username: str, default 'root'
+            used for targets given as host names
+        password: str, optional
+            used for targets given as host names
+        pool: bool or SSHPool, default True
+            connection pool for targets that are not already SSHClients.
+            True uses the process-wide pool
+        """
+        if pool is True:
+            pool = default_pool()
+        self.workers = workers
+        self.username = username
+        self.password = password
+        self.pool = pool or None
+        self.targets = list(targets)
+        self.clients = [self._client(t) for t in self.targets]
+
+    def _client(self, target):
+        if isinstance(target, SSHClient):
+            return target
+        if isinstance(target, basestring):
+            return SSHClient(target, username=self.username,
+                             password=self.password, pool=self.pool)
+        # DropletActions
+        return target.connect(pool=self.pool or False)
+
+    def __len__(self):
+        return len(self.clients)
+
+    def run(self, cmd, timeout=None):
+        """
+        Run a shell command on every host and yield a HostResult for each
+        host as soon as it completes
+
+        Parameters
+        ----------
+        cmd: str
+        timeout: float, optional
+            seconds after which a host's command is abandoned and reported
+            with a CommandTimeout error
+        """
+        def run_one(ssh):
+            stdout, stderr = [], []
+            command = ssh.execute(cmd, lines=False, timeout=timeout)
+            status = command.wait(stdout=stdout.append, stderr=stderr.append)
+            return status, ''.join(stdout), ''.join(stderr)
+
+        for result in self._imap(run_one):
+            if result.error is None:
+                (result.exit_status, result.stdout,
+                 result.stderr) = result.result
+                result.result = None
+            yield result
+
+    def map(self, func, *args, **kwargs):
+        """
+        Call an SSHClient helper or a function on every host and yield a
+        HostResult whose result is the return value
+
+        Parameters
+        ----------
+        func: str or callable
+            name of an SSHClient method (e.g., 'apt', 'pip_r') or a callable
+            taking the SSHClient as first argument
+
+        Example
+        -------
+        for res in fleet.map('apt', 'git python-pip'):
+            print(res.host, res.ok)
+        """
+        if isinstance(func, basestring):
+            name = func
+            func = lambda ssh, *a, **kw: getattr(ssh, name)(*a, **kw)
+        return self._imap(lambda ssh: func(ssh, *args, **kwargs))
+
+    def wait_ready(self, timeout=300):
+        """
+        Wait for every host to accept SSH logins, e.g., after creating the
+        droplets, and yield a HostResult for each host as soon as it is
+        ready or has timed out
+
+        Parameters
+        ----------
+        timeout: float, default 300
+            seconds after which a host is reported with a ValueError
+        """
+        def ready(ssh):
+            ssh.wait_ready(timeout)
+
+        return self._imap(ready)
+
+    def collect(self, cmd, timeout=None):
+        """
+        Run a command on every host and return dict of host -> HostResult
+        """
+        return dict((r.host, r) for r in self.run(cmd, timeout=timeout))
+
+    def tail(self, paths, lines=10, grep=None, follow=True,
+             maxsize=TAIL_BUFFER):
+        """
+        Tail log files on every host and merge their lines into one stream
+
+        Parameters
+        ----------
+        paths: str or list of str
+            remote files, followed by name so rotated logs keep streaming
+        lines: int, default 10
+            number of existing lines to start with
+        grep: str, optional
+            extended regular expression applied on the host so only
+            matching lines are sent
+        follow: bool, default True
+            If False then only the last lines are read
+        maxsize: int, default 1000
+            lines buffered before host readers stop reading their channels,
+            which in turn stalls the remote tail until the consumer catches
+            up
+
+        Returns
+        -------
+        LogTail yielding LogLine(host, time, stream, line)
+
+        Example
+        -------
+        with fleet.tail('/var/log/syslog', grep='error|fail') as logs:
+            for log in logs:
+                print(log.host, log.line)
+        """
+        return LogTail(self.clients, tail_command(paths, lines, grep, follow),
+                       maxsize=maxsize)
+
+    def distribute(self, local_path, remote_path, seeds=2, retries=2,
+                   timeout=60, total_timeout=None):
+        """
+        Copy one file to every host through a relay tree. The controller
+        uploads to seeds hosts and each host holding a checksum-verified
+        copy forwards it to the next waiting host over the private network,
+        so the controller's uplink is used only seeds times
+
+        Parameters
+        ----------
+        local_path: str
+        remote_path: str
+            relative paths are relative to each client's current directory
+        seeds: int, default 2
+            number of hosts the controller uploads to
+        retries: int, default 2
+            failed copies to a host are retried from another holder
+        timeout: int, default 60
+            seconds a host waits for its sender before giving up
+        total_timeout: float, optional
+            seconds after which hosts still waiting are reported with
+            CommandTimeout
+
+        Returns
+        -------
+        dict of host -> HostResult whose result is the host the file came
+            from ('controller' for seeds)
+        """
+        from poseidon.relay import Relay, private_address
+        addresses = [private_address(t, c)
+                     for t, c in zip(self.targets, self.clients)]
+        relay = Relay(self.clients, addresses, seeds=seeds, retries=retries,
+                      timeout=timeout, targets=self.targets)
+        return relay.run(local_path, remote_path, total_timeout)
+
+    def _imap(self, func):
+        targets = dict((id(c), t) for c, t in zip(self.clients, self.targets))
+
+        def call(ssh):
+            start = time.time()
+            try:
+                result, error = func(ssh), None
+            except Exception as e:
+                result, error = None, e
+            return result, error, time.time() - start
+
+        for ssh, (result, error, elapsed), _ in imap_unordered(
+                call, self.clients, self.workers):
+            yield HostResult(ssh.host, targets[id(ssh)], result=result,
+                             error=error, elapsed=elapsed)
+
+
+def tail_command(paths, lines=10, grep=None, follow=True):
+    if isinstance(paths, basestring):
+        paths = [paths]
+    cmd = 'tail -n %d %s-q %s' % (lines, '-F ' if follow else '',
+                                  ' '.join(quote(p) for p in paths))
+    if grep is not None:
+        cmd += ' | grep --line-buffered -E %s' % quote(grep)
+    return cmd
+
+
+class LogTail(object):
+    """
+    Iterator over lines of a command running on many hosts. A reader
+    thread per host feeds a bounded queue so a slow consumer applies
+    backpressure down to the remote commands instead of buffering without
+    limit
+    """
+
+    def __init__(self, clients, cmd, maxsize=TAIL_BUFFER):
+        self.cmd = cmd
+        self.errors = {}
+        self.commands = {}
+        self._queue = Queue(maxsize=maxsize)
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+        self._threads = [threading.Thread(target=self._read, args=(ssh,))
+                         for ssh in clients]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def __iter__(self):
+        remaining = len(self._threads)
+        while remaining and not self._stopped.is_set():
+            try:
+                item = self._queue.get(timeout=0.1)
+            except Empty:
+                continue
+            if item is _DONE:
+                remaining -= 1
+            else:
+                yield item
+
+    def _read(self, ssh):
+        try:
+            command = ssh.execute(self.cmd)
+            with self._lock:
+                self.commands[ssh.host] = command
+                if self._stopped.is_set():
+                    command.channel.close()
+            for stream, line in command:
+                if not self._put(LogLine(ssh.host, time.time(), stream,
+                                         line)):
+                    return
+        except Exception as e:
+            if not self._stopped.is_set():
+                self.errors[ssh.host] = e
+        finally:
+            self._put(_DONE)
+
+    def _put(self, item):
+        while not self._stopped.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                continue
+        return False
+
+    def close(self):
+        """
+        Stop reading and close every tail channel
+        """
+        self._stopped.set()
+        with self._lock:
+            commands = list(self.commands.values())
+        for command in commands:
+            command.channel.close()
+        for thread in self._threads:
+            thread.join()
@@ -0,0 +1,327 @@
+"""
+Local SQLite mirror of the account inventory (droplets, images, domains and
+domain records).
+
+The first sync lists everything. Subsequent syncs read only the entries of
+the Actions feed that are newer than the last one seen and refresh only the
+resources those actions touched, so keeping the mirror current costs a
+handful of requests instead of a full re-listing.
+"""
+from __future__ import absolute_import
+
+import errno
+import os
+import sqlite3
+import time
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+from poseidon.api import APIError, DomainRecords, MutableCollection
+from poseidon.cache import CatalogCache
+
+KINDS = ('droplets', 'images', 'domains', 'records')
+
+# indexed columns that can be used as query filters
+COLUMNS = ('name', 'status', 'region', 'type', 'parent')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS resources (
+    kind TEXT NOT NULL,
+    parent TEXT NOT NULL DEFAULT '',
+    id TEXT NOT NULL,
+    name TEXT,
+    status TEXT,
+    region TEXT,
+    type TEXT,
+    data TEXT NOT NULL,
+    synced REAL NOT NULL,
+    PRIMARY KEY (kind, parent, id)
+);
+CREATE INDEX IF NOT EXISTS resources_name ON resources (kind, name);
+CREATE INDEX IF NOT EXISTS resources_status ON resources (kind, status);
+CREATE INDEX IF NOT EXISTS resources_region ON resources (kind, region);
+CREATE INDEX IF NOT EXISTS resources_type ON resources (kind, type);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+class Inventory(object):
+    """
+    Mirror of every resource in the account stored in a SQLite database
+    """
+
+    def __init__(self, client, path=None):
+        """
+        Parameters
+        ----------
+        client: poseidon.client.Client
+        path: str, optional
+            database file, defaults to ~/.poseidon/inventory-<account>.db.
+            Use ':memory:' for a throwaway mirror
+        """
+        self.client = client
+        if path is None:
+            path = os.path.join('~', '.poseidon', 'inventory-%s.db' %
+                                CatalogCache.key_for(client.api))
+        if path != ':memory:':
+            path = os.path.expanduser(path)
+            _makedirs(os.path.dirname(path))
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    # ------------------------------------------------------------------
+    # Synchronization
+
+    def sync(self, full=False):
+        """
+        Bring the mirror up to date
+
+        Parameters
+        ----------
+        full: bool, default False
+            If True, or if the mirror has never been synced, list every
+            resource. Otherwise only resources touched by new actions are
+            refreshed
+
+        Returns
+        -------
+        touched: set of (resource_type, resource_id) refreshed, or None
+            after a full sync
+        """
+        if full or self._meta('last_action_id') is None:
+            return self.full_sync()
+        return self.incremental_sync()
+
+    def full_sync(self):
+        """
+        Replace the mirror with a full listing of the account
+        """
+        # take the watermark first so nothing that happens while listing
+        # is missed by the next incremental sync
+        recent = self.client.actions.list() or []
+        last_id = max([a['id'] for a in recent] or [0])
+        pending = [a['id'] for a in recent if a['status'] == 'in-progress']
+        with self.db:
+            self.db.execute('DELETE FROM resources')
+            self._upsert_all('droplets', self.client.droplets.iterate())
+            self._upsert_all('images', self.client.images.iterate())
+            domains = list(self.client.domains.iterate())
+            self._upsert_all('domains', domains)
+            for domain in domains:
+                self._sync_records(domain['name'])
+            self._set_watermark(last_id, pending)
+
+    def incremental_sync(self):
+        """
+        Refresh only resources touched by actions newer than the last sync
+        and actions that were still in progress at the last sync
+        """
+        last_id = int(self._meta('last_action_id'))
+        pending = json.loads(self._meta('pending_actions') or '[]')
+        new_pending, touched = [], set()
+
+        for action_id in pending:
+            action = self.client.actions.get(action_id)
+            if action is None:
+                continue
+            touched.add(_target(action))
+            if action['status'] == 'in-progress':
+                new_pending.append(action_id)
+
+        newest, in_progress = self._scan_actions(last_id, touched)
+        new_pending.extend(in_progress)
+
+        with self.db:
+            for target in touched:
+                self._refresh(*target)
+            self._set_watermark(newest, sorted(set(new_pending)))
+        return touched
+
+    def sync_domain(self, name):
+        """
+        Refresh a domain and its records. DNS changes do not create actions
+        so these are only picked up by full syncs or by calling this
+        """
+        with self.db:
+            self._refresh('domain', name)
+
+    def _scan_actions(self, since, touched):
+        """
+        Read the Actions feed (newest first) down to action id `since`,
+        collecting the resources the new actions touched
+
+        Returns
+        -------
+        (newest action id, ids of new actions still in progress)
+        """
+        newest, in_progress = since, []
+        for action in self.client.actions.iterate():
+            if action['id'] <= since:
+                break
+            newest = max(newest, action['id'])
+            if action['status'] == 'in-progress':
+                in_progress.append(action['id'])
+            touched.add(_target(action))
+            if action.get('type') == 'snapshot':
+                touched.add(('snapshots', action['resource_id']))
+        return newest, in_progress
+
+    def _refresh(self, resource_type, resource_id):
+        if resource_type == 'droplet':
+            self._refresh_one('droplets', resource_id,
+                              self.client.droplets._get_droplet_info)
+        elif resource_type == 'image':
+            self._refresh_one(
+                'images', resource_id,
+                lambda id: MutableCollection.get(self.client.images, id))
+        elif resource_type == 'snapshots':
+            try:
+                images = self.client.droplets.snapshots(resource_id)
+            except APIError as e:
+                if e.status_code != 404:
+                    raise
+                images = []
+            self._upsert_all('images', images)
+        elif resource_type == 'domain':
+            found = self._refresh_one('domains', resource_id,
+                                      self.client.domains.get)
+            self.db.execute("DELETE FROM resources WHERE kind = 'records' "
+                            "AND parent = ?", (resource_id,))
+            if found:
+                self._sync_records(resource_id)
+        # other resource types (volumes, floating ips, ...) are not mirrored
+
+    def _refresh_one(self, kind, id, getter):
+        try:
+            info = getter(id)
+        except APIError as e:
+            if e.status_code != 404:
+                raise
+            info = None
+        if info is None:
+            self.db.execute('DELETE FROM resources WHERE kind = ? AND id = ?',
+                            (kind, str(id)))
+            return False
+        self._upsert(kind, info)
+        return True
+
+    def _sync_records(self, domain):
+        records = DomainRecords(self.client.api, domain)
+        self._upsert_all('records', records.iterate(), parent=domain)
+
+    def _upsert_all(self, kind, items, parent=''):
+        now = time.time()
+        self.db.executemany(
+            'INSERT OR REPLACE INTO resources '
+            '(kind, parent, id, name, status, region, type, data, synced) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (_row(kind, item, parent, now) for item in items))
+
+    def _upsert(self, kind, item, parent=''):
+        self._upsert_all(kind, [item], parent)
+
+    def _set_watermark(self, last_id, pending):
+        self._set_meta('last_action_id', str(last_id))
+        self._set_meta('pending_actions', json.dumps(pending))
+        self._set_meta('synced', str(time.time()))
+
+    def _meta(self, key):
+        row = self.db.execute('SELECT value FROM meta WHERE key = ?',
+                              (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key, value):
+        self.db.execute('INSERT OR REPLACE INTO meta (key, value) '
+                        'VALUES (?, ?)', (key, value))
+
+    # ------------------------------------------------------------------
+    # Queries
+
+    def query(self, kind, **filters):
+        """
+        Return mirrored resources of the given kind matching all filters
+
+        Parameters
+        ----------
+        kind: str
+            {droplets, images, domains, records}
+
+        Notes
+        -----
+        filters may use the indexed columns name, status, region, type and
+        parent (the domain name for records)
+        """
+        if kind not in KINDS:
+            raise ValueError("Unknown kind %s, must be one of %s" %
+                             (kind, ', '.join(KINDS)))
+        clauses, params = ['kind = ?'], [kind]
+        for k, v in sorted(filters.items()):
+            if k not in COLUMNS:
+                raise ValueError("Cannot filter on %s, must be one of %s" %
+                                 (k, ', '.join(COLUMNS)))
+            clauses.append('%s = ?' % k)
+            params.append(v)
+        sql = 'SELECT data FROM resources WHERE %s' % ' AND '.join(clauses)
+        return [json.loads(row[0]) for row in self.db.execute(sql, params)]
+
+    def get(self, kind, id, parent=''):
+        """
+        Return single mirrored resource or None
+        """
+        row = self.db.execute(
+            'SELECT data FROM resources WHERE kind = ? AND parent = ? '
+            'AND id = ?', (kind, parent, str(id))).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def count(self, kind):
+        return self.db.execute('SELECT COUNT(*) FROM resources WHERE kind = ?',
+                               (kind,)).fetchone()[0]
+
+    def droplets(self, **filters):
+        return self.query('droplets', **filters)
+
+    def images(self, **filters):
+        return self.query('images', **filters)
+
+    def domains(self, **filters):
+        return self.query('domains', **filters)
+
+    def records(self, domain, **filters):
+        return self.query('records', parent=domain, **filters)
+
+
+def _target(action):
+    return (action['resource_type'], action['resource_id'])
+
+
+def _row(kind, item, parent, now):
+    if kind == 'domains':
+        id = item['name']
+    else:
+        id = item['id']
+    region = item.get('region')
+    if isinstance(region, dict):
+        region = region.get('slug')
+    type = item.get('type')
+    if type is None and kind == 'images':
+        type = item.get('distribution')
+    return (kind, parent, str(id), item.get('name'), item.get('status'),
+            region, type, json.dumps(item), now)
+
+
+def _makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
@@ -0,0 +1,226 @@
+"""
+Continuous host metrics sampled by one long-running remote loop that reads
+/proc and streams one compact line per sample over a single channel into
+fixed-size NumPy ring buffers
+"""
+from __future__ import absolute_import
+
+import threading
+
+import numpy as np
+
+# cumulative counters from /proc except for time and memory (kB)
+FIELDS = ('time', 'cpu_user', 'cpu_system', 'cpu_idle', 'cpu_iowait',
+          'cpu_total', 'mem_total', 'mem_available', 'disk_read',
+          'disk_write', 'net_rx', 'net_tx')
+
+SECTOR_SIZE = 512
+
+# whole disks only, partitions would be counted twice
+DISK_PATTERN = r'^(sd[a-z]+|vd[a-z]+|xvd[a-z]+|nvme[0-9]+n[0-9]+)$'
+
+_AWK = r"""
+FILENAME == "/proc/stat" && $1 == "cpu" {
+    us = $2 + $3; sy = $4 + $7 + $8; id = $5; io = $6; tot = 0
+    for (i = 2; i <= NF && i <= 9; i++) tot += $i
+}
+FILENAME == "/proc/meminfo" && $1 == "MemTotal:" { mt = $2 }
+FILENAME == "/proc/meminfo" && $1 == "MemAvailable:" { ma = $2 }
+FILENAME == "/proc/diskstats" && $3 ~ /%(disks)s/ { rd += $6; wr += $10 }
+FILENAME == "/proc/net/dev" && FNR > 2 {
+    sub(/:/, " "); $0 = $0
+    if ($1 != "lo") { rx += $2; tx += $10 }
+}
+END { printf "%%s %%.0f %%.0f %%.0f %%.0f %%.0f %%.0f %%.0f %%.0f %%.0f %%.0f %%.0f\n",
+      t, us, sy, id, io, tot, mt, ma, rd, wr, rx, tx }
+"""
+
+
+def sampler_script(interval=1.0, count=None, disks=DISK_PATTERN):
+    """
+    Shell loop printing one line of FIELDS per sample
+
+    Parameters
+    ----------
+    interval: float, default 1.0
+        seconds between samples
+    count: int, optional
+        number of samples, unlimited by default
+    disks: str
+        awk regular expression for device names counted as disks
+    """
+    loop = 'while :' if count is None else 'for i in $(seq %d)' % count
+    awk = _AWK % {'disks': disks}
+    return ("%s; do awk -v t=$(date +%%s.%%N) '%s' /proc/stat /proc/meminfo "
+            "/proc/diskstats /proc/net/dev; sleep %s; done" %
+            (loop, awk.strip(), interval))
+
+
+class RingBuffer(object):
+    """
+    Fixed-size buffer of rows of floats, overwriting the oldest rows once
+    full
+    """
+
+    def __init__(self, size, fields=FIELDS):
+        self.fields = tuple(fields)
+        self.size = size
+        self.data = np.zeros((size, len(self.fields)))
+        self.count = 0
+
+    def append(self, row):
+        self.data[self.count % self.size] = row
+        self.count += 1
+
+    def __len__(self):
+        return min(self.count, self.size)
+
+    def values(self):
+        """
+        Copy of the buffered rows, oldest first
+        """
+        if self.count <= self.size:
+            return self.data[:self.count].copy()
+        start = self.count % self.size
+        return np.concatenate((self.data[start:], self.data[:start]))
+
+    def column(self, name):
+        return self.values()[:, self.fields.index(name)]
+
+
+class MetricsSampler(object):
+    """
+    Samples CPU, memory, disk and network counters of a host every interval
+    seconds in the background
+
+    Example
+    -------
+    with ssh.sampler(interval=1) as sampler:
+        time.sleep(60)
+        print(sampler.percentile('cpu_percent', 95))
+    """
+
+    def __init__(self, client, interval=1.0, size=3600, disks=DISK_PATTERN):
+        """
+        Parameters
+        ----------
+        client: SSHClient
+        interval: float, default 1.0
+            seconds between samples
+        size: int, default 3600
+            number of samples kept
+        disks: str
+            awk regular expression for device names counted as disks
+        """
+        self.client = client
+        self.interval = interval
+        self.disks = disks
+        self.buffer = RingBuffer(size)
+        self.command = None
+        self._thread = None
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def start(self):
+        """
+        Start the remote loop and the thread reading its output, unless
+        they are already running
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return self
+        self._stopped.clear()
+        self.command = self.client.execute(
+            sampler_script(self.interval, disks=self.disks))
+        self._thread = threading.Thread(target=self._read)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self.command is not None:
+            self.command.channel.close()
+        if self._thread is not None:
+            self._thread.join()
+        self._thread = None
+
+    def _read(self):
+        for stream, line in self.command:
+            if self._stopped.is_set():
+                break
+            if stream == 'stdout':
+                self.feed(line)
+
+    def feed(self, line):
+        """
+        Add one line of sampler output
+        """
+        values = line.split()
+        if len(values) != len(FIELDS):
+            return
+        row = [float(v) for v in values]
+        with self._lock:
+            self.buffer.append(row)
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def samples(self):
+        """
+        Raw samples as an array with one column per FIELDS entry
+        """
+        with self._lock:
+            return self.buffer.values()
+
+    def rates(self):
+        """
+        Per-interval metrics computed from consecutive samples
+
+        Returns
+        -------
+        dict of name -> array with one value per interval: time,
+            cpu_percent, iowait_percent, mem_percent, disk_read and
+            disk_write (bytes/s), net_rx and net_tx (bytes/s)
+        """
+        data = self.samples()
+        col = dict((name, data[:, i]) for i, name in enumerate(FIELDS))
+        dt = np.diff(col['time'])
+        dt[dt <= 0] = np.nan
+        dcpu = np.diff(col['cpu_total'])
+        dcpu[dcpu <= 0] = np.nan
+        busy = np.diff(col['cpu_total'] - col['cpu_idle'] - col['cpu_iowait'])
+        mem_total = col['mem_total'][1:]
+        return {
+            'time': col['time'][1:],
+            'cpu_percent': 100. * busy / dcpu,
+            'iowait_percent': 100. * np.diff(col['cpu_iowait']) / dcpu,
+            'mem_percent': 100. * (1 - col['mem_available'][1:] /
+                                   np.where(mem_total > 0, mem_total, np.nan)),
+            'disk_read': np.diff(col['disk_read']) * SECTOR_SIZE / dt,
+            'disk_write': np.diff(col['disk_write']) * SECTOR_SIZE / dt,
+            'net_rx': np.diff(col['net_rx']) / dt,
+            'net_tx': np.diff(col['net_tx']) / dt,
+        }
+
+    def percentile(self, name, q):
+        """
+        Percentile(s) q (0-100) of a metric returned by rates
+        """
+        values = self.rates()[name]
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return np.nan
+        return np.percentile(values, q)
+
+    def latest(self):
+        """
+        dict of the most recent value of each metric returned by rates
+        """
+        return dict((k, v[-1] if len(v) else np.nan)
+                    for k, v in self.rates().items())
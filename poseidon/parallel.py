@@ -0,0 +1,281 @@
+"""
+Thread based helpers for running many blocking calls (API requests, SSH
+commands) concurrently
+"""
+from __future__ import absolute_import
+
+import random
+import threading
+import time
+
+try:
+    from Queue import Queue, Empty, Full
+except ImportError:
+    from queue import Queue, Empty, Full
+
+DEFAULT_WORKERS = 8
+
+# DigitalOcean allows 5000 requests per hour per token
+API_RATE = 5000 / 3600.0
+API_BURST = 250
+
+_DONE = object()
+
+
+class RateLimiter(object):
+    """
+    Token bucket shared by any number of threads
+    """
+
+    def __init__(self, rate=API_RATE, burst=API_BURST):
+        """
+        Parameters
+        ----------
+        rate: float
+            tokens added per second
+        burst: int
+            maximum number of tokens that can be spent at once
+        """
+        self.rate = float(rate)
+        self.burst = burst
+        self._tokens = float(burst)
+        self._stamp = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Block until a token is available and take it
+        """
+        while True:
+            with self._lock:
+                now = time.time()
+                self._tokens = min(self.burst, self._tokens +
+                                   (now - self._stamp) * self.rate)
+                self._stamp = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+
+    def call(self, func, *args, **kwargs):
+        """
+        Call func once a token is available, retrying with exponential
+        backoff if the server answers 429 Too Many Requests
+        """
+        retries = kwargs.pop('retries', 5)
+        for attempt in range(retries + 1):
+            self.acquire()
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                if (getattr(e, 'status_code', None) != 429 or
+                        attempt == retries):
+                    raise
+            time.sleep(backoff(attempt, base=1.0, cap=60.0))
+
+
+def imap_unordered(func, items, workers=DEFAULT_WORKERS):
+    """
+    Call func on every item using a bounded pool of threads and yield
+    (item, result, error) tuples as soon as each call completes
+
+    items is consumed lazily so arbitrarily long generators can be processed
+    with memory bounded by the number of workers. Exceptions raised by func
+    are returned as error rather than raised, exceptions raised by items are
+    re-raised in the caller.
+
+    Parameters
+    ----------
+    func: callable
+    items: iterable
+    workers: int, default 8
+    """
+    workers = max(1, workers)
+    todo = Queue(maxsize=workers * 2)
+    done = Queue(maxsize=workers * 2)
+    stop = threading.Event()
+    failure = []
+
+    def put(queue, value):
+        while not stop.is_set():
+            try:
+                queue.put(value, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def feed():
+        try:
+            for item in items:
+                if not put(todo, item):
+                    return
+        except Exception as e:
+            failure.append(e)
+        for _ in range(workers):
+            if not put(todo, _DONE):
+                return
+
+    def work():
+        while not stop.is_set():
+            try:
+                item = todo.get(timeout=0.1)
+            except Empty:
+                continue
+            if item is _DONE:
+                break
+            try:
+                result = (item, func(item), None)
+            except Exception as e:
+                result = (item, None, e)
+            if not put(done, result):
+                return
+        put(done, _DONE)
+
+    threads = [threading.Thread(target=feed)]
+    threads.extend(threading.Thread(target=work) for _ in range(workers))
+    for t in threads:
+        t.daemon = True
+        t.start()
+
+    try:
+        finished = 0
+        while finished < workers:
+            try:
+                # timeout keeps the wait interruptible with Ctrl-C
+                result = done.get(timeout=0.5)
+            except Empty:
+                continue
+            if result is _DONE:
+                finished += 1
+                continue
+            yield result
+        if failure:
+            raise failure[0]
+    finally:
+        stop.set()
+
+
+class Job(object):
+    """
+    An item moving through a pipeline. value is the output of the last
+    stage that succeeded
+    """
+
+    def __init__(self, item):
+        self.item = item
+        self.value = item
+        self.error = None
+        self.stage = None
+        self.timings = {}
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        return 'Job(%r, stage=%r, error=%r)' % (self.item, self.stage,
+                                                 self.error)
+
+
+def pipeline(items, stages):
+    """
+    Move every item through a sequence of stages, each with its own pool of
+    threads, and yield a Job as soon as an item leaves the last stage or
+    fails. There is no barrier between stages: an item enters the next
+    stage as soon as the previous one is done with it, so a slow item only
+    holds up itself
+
+    Parameters
+    ----------
+    items: iterable
+    stages: list of (name, func, workers)
+        func is called with the value returned by the previous stage (the
+        item for the first stage). An exception ends the item's job with
+        job.stage set to the failing stage
+
+    Example
+    -------
+    for job in pipeline(urls, [('fetch', fetch, 16), ('parse', parse, 4)]):
+        print(job.item, job.value if job.ok else job.error)
+    """
+    stages = [(name, func, max(1, workers)) for name, func, workers in stages]
+    queues = [Queue() for _ in stages]
+    done = Queue()
+    stop = threading.Event()
+    failure = []
+    lock = threading.Lock()
+    exited = [0] * len(stages)
+
+    def feed():
+        try:
+            for item in items:
+                if stop.is_set():
+                    return
+                queues[0].put(Job(item))
+        except Exception as e:
+            failure.append(e)
+        for _ in range(stages[0][2]):
+            queues[0].put(_DONE)
+
+    def work(index):
+        name, func, _ = stages[index]
+        last = index == len(stages) - 1
+        while not stop.is_set():
+            try:
+                job = queues[index].get(timeout=0.1)
+            except Empty:
+                continue
+            if job is _DONE:
+                break
+            job.stage = name
+            start = time.time()
+            try:
+                job.value = func(job.value)
+            except Exception as e:
+                job.error = e
+            job.timings[name] = time.time() - start
+            if last or job.error is not None:
+                done.put(job)
+            else:
+                queues[index + 1].put(job)
+        with lock:
+            exited[index] += 1
+            # the stage drains once all of its workers are done
+            drained = exited[index] == stages[index][2]
+        if drained:
+            if last:
+                done.put(_DONE)
+            else:
+                for _ in range(stages[index + 1][2]):
+                    queues[index + 1].put(_DONE)
+
+    threads = [threading.Thread(target=feed)]
+    for index, (_, _, workers) in enumerate(stages):
+        threads.extend(threading.Thread(target=work, args=(index,))
+                       for _ in range(workers))
+    for t in threads:
+        t.daemon = True
+        t.start()
+
+    try:
+        while True:
+            try:
+                job = done.get(timeout=0.5)
+            except Empty:
+                continue
+            if job is _DONE:
+                break
+            yield job
+        if failure:
+            raise failure[0]
+    finally:
+        stop.set()
+
+
+def backoff(attempt, base=0.5, cap=10.0):
+    """
+    Seconds to wait before retry number `attempt` using full jitter
+    """
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
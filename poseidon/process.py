@@ -0,0 +1,91 @@
+"""
+Structured process tables parsed from ps output with explicit fields
+"""
+from __future__ import absolute_import
+
+from array import array
+
+# (ps field, column type) where type is 'i' (int), 'd' (float) or 's' (str).
+# Only the last field may contain whitespace
+PS_FIELDS = (('pid', 'i'), ('ppid', 'i'), ('user', 's'), ('pcpu', 'd'),
+             ('pmem', 'd'), ('rss', 'i'), ('vsz', 'i'), ('etimes', 'i'),
+             ('stat', 's'), ('args', 's'))
+
+TOP_FIELDS = (('pid', 'i'), ('user', 's'), ('pcpu', 'd'), ('pmem', 'd'),
+              ('comm', 's'))
+
+_CONVERTERS = {'i': int, 'd': float, 's': lambda x: x}
+
+
+def ps_command(fields=PS_FIELDS):
+    """
+    ps invocation listing all processes with the given fields and no header
+    """
+    # the :N width only stops ps from truncating user names
+    spec = ','.join('%s%s=' % (name, ':64' if name == 'user' else '')
+                    for name, _ in fields)
+    return 'ps -Ao %s' % spec
+
+
+class ProcessTable(object):
+    """
+    Process table stored as one compact array per column
+    """
+
+    def __init__(self, fields=PS_FIELDS):
+        self.fields = tuple(fields)
+        self.columns = {}
+        for name, type in self.fields:
+            self.columns[name] = [] if type == 's' else array(
+                'l' if type == 'i' else type)
+
+    @classmethod
+    def parse(cls, output, fields=PS_FIELDS):
+        """
+        Parse headerless ps output produced by ps_command in one pass
+        """
+        table = cls(fields)
+        table.extend(output.splitlines())
+        return table
+
+    def extend(self, lines):
+        nfields = len(self.fields)
+        appenders = [(self.columns[name].append, _CONVERTERS[type])
+                     for name, type in self.fields]
+        for line in lines:
+            values = line.split(None, nfields - 1)
+            if len(values) < nfields:
+                if not values:
+                    continue
+                # empty trailing free-form column (e.g., args of a zombie)
+                values.extend([''] * (nfields - len(values)))
+            for (append, convert), value in zip(appenders, values):
+                append(convert(value))
+
+    def __len__(self):
+        return len(self.columns[self.fields[0][0]])
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def __iter__(self):
+        """
+        Iterate over rows as dicts
+        """
+        names = [name for name, _ in self.fields]
+        cols = [self.columns[name] for name in names]
+        for values in zip(*cols):
+            yield dict(zip(names, values))
+
+    def to_frame(self):
+        """
+        Convert to a pandas DataFrame (requires pandas)
+        """
+        import pandas as pd
+        names = [name for name, _ in self.fields]
+        data = dict((name, list(self.columns[name])) for name in names)
+        return pd.DataFrame(data, columns=names)
+
+    def __repr__(self):
+        return 'ProcessTable(%d processes, fields=%s)' % (
+            len(self), ','.join(name for name, _ in self.fields))
@@ -0,0 +1,120 @@
+"""
+Streaming droplet provisioning. Each droplet moves through create, wait
+for active, SSH readiness and a user supplied setup function on its own,
+so a droplet that is slow at one stage does not hold up the others
+"""
+from __future__ import absolute_import
+
+import time
+
+from poseidon.parallel import backoff, pipeline
+
+# default number of droplets worked on at the same time per stage
+CREATE_WORKERS = 4
+ACTIVE_WORKERS = 32
+SSH_WORKERS = 32
+SETUP_WORKERS = 8
+
+
+class Provision(object):
+    """
+    State of one droplet in the pipeline
+    """
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.droplet = None
+        self.ssh = None
+        self.result = None
+
+    def __repr__(self):
+        return 'Provision(%r, droplet=%r)' % (
+            self.spec.get('name'), getattr(self.droplet, 'id', None))
+
+
+def wait_active(droplet, timeout=600, interval=5):
+    """
+    Poll a droplet until it is active and has a public IP address
+    """
+    deadline = time.time() + timeout
+    attempt = 0
+    while True:
+        droplet.refresh()
+        if getattr(droplet, 'status', None) == 'active':
+            try:
+                droplet.ip_address
+                return droplet
+            except (ValueError, KeyError, TypeError):
+                pass
+        if time.time() > deadline:
+            raise ValueError('droplet %s not active after %s seconds' %
+                             (droplet.id, timeout))
+        # jittered so many droplets do not poll the API in lockstep
+        time.sleep(interval / 2.0 + backoff(attempt, base=interval / 2.0,
+                                            cap=interval))
+        attempt += 1
+
+
+def provision(droplets, specs, setup=None, timeout=600, interval=5,
+              pool=True, create_workers=CREATE_WORKERS,
+              active_workers=ACTIVE_WORKERS, ssh_workers=SSH_WORKERS,
+              setup_workers=SETUP_WORKERS):
+    """
+    Create droplets and set them up, yielding a Job for each droplet as
+    soon as it is done or has failed. job.value is a Provision holding the
+    spec, the droplet, its connected SSHClient and the setup result;
+    job.stage names the last stage reached ('create', 'active', 'ssh' or
+    'setup') and job.timings the seconds spent in each. A droplet that
+    fails after create still exists and is left in job.value.droplet
+
+    Parameters
+    ----------
+    droplets: Droplets
+    specs: iterable of dict
+        keyword arguments for Droplets.create (name, region, size, image,
+        ssh_keys, ...)
+    setup: callable, optional
+        called with (ssh, droplet), its return value is stored as result
+    timeout: float, default 600
+        seconds to wait for each droplet to become active and accept SSH
+        logins
+    interval: float, default 5
+        seconds between status polls
+    pool: bool or SSHPool, default True
+    create_workers, active_workers, ssh_workers, setup_workers: int
+        concurrency limit of each stage
+
+    Example
+    -------
+    specs = [dict(name='web%d' % i, region='nyc3', size='512mb',
+                  image='ubuntu-14-04-x64', ssh_keys=[key_id])
+             for i in range(20)]
+    for job in client.droplets.provision(specs, setup=lambda ssh, d:
+                                         ssh.apt('nginx')):
+        print(job.value.droplet, job.stage, job.error)
+    """
+    def create(p):
+        spec = dict(p.spec)
+        spec['wait'] = False
+        p.droplet = droplets.create(**spec)
+        return p
+
+    def active(p):
+        wait_active(p.droplet, timeout, interval)
+        return p
+
+    def ready(p):
+        p.ssh = p.droplet.connect(pool=pool)
+        p.ssh.wait_ready(timeout)
+        return p
+
+    def run_setup(p):
+        if setup is not None:
+            p.result = setup(p.ssh, p.droplet)
+        return p
+
+    stages = [('create', create, create_workers),
+              ('active', active, active_workers),
+              ('ssh', ready, ssh_workers),
+              ('setup', run_setup, setup_workers)]
+    return pipeline((Provision(spec) for spec in specs), stages)
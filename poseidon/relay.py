@@ -0,0 +1,292 @@
+"""
+Distribute one file to many droplets through a relay tree. The controller
+uploads to a few seed hosts over SFTP, and every host holding a verified
+copy then forwards it to a host still waiting, over the private network.
+The number of holders roughly doubles with every round, so the total time
+grows with the logarithm of the fleet size while the controller's uplink
+carries only the seed copies
+"""
+from __future__ import absolute_import
+
+import hashlib
+import os
+import threading
+import time
+from collections import deque
+
+try:
+    from shlex import quote
+except ImportError:
+    from pipes import quote
+
+from poseidon.fleet import HostResult
+from poseidon.ssh import CommandError, CommandTimeout
+from poseidon.sync import shell_path
+from poseidon.transfer import Transfer, resolve_remote_path
+
+DEFAULT_SEEDS = 2
+
+# one-shot TCP receiver: binds an ephemeral port on the private address,
+# prints it, writes the stream to path.part, verifies the sha256 and moves
+# the file into place
+_RECEIVER = r"""
+import hashlib, os, socket, sys
+addr, path, expected, timeout = sys.argv[1:5]
+s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+s.bind((addr, 0))
+s.listen(1)
+s.settimeout(float(timeout))
+sys.stdout.write('%d\n' % s.getsockname()[1])
+sys.stdout.flush()
+conn = s.accept()[0]
+conn.settimeout(float(timeout))
+digest = hashlib.sha256()
+out = open(path + '.part', 'wb')
+while True:
+    data = conn.recv(65536)
+    if not data:
+        break
+    digest.update(data)
+    out.write(data)
+out.close()
+if digest.hexdigest() != expected:
+    os.remove(path + '.part')
+    sys.stderr.write('checksum mismatch: %s\n' % digest.hexdigest())
+    sys.exit(1)
+os.rename(path + '.part', path)
+""".strip()
+
+
+def file_sha256(path, block_size=2 ** 16):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fp:
+        for block in iter(lambda: fp.read(block_size), ''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def receive_command(addr, path, digest, timeout=60):
+    return ('mkdir -p "$(dirname %s)" && '
+            '"$(command -v python3 || command -v python)" -c %s %s %s %s %s'
+            % (shell_path(path), quote(_RECEIVER), quote(addr),
+               shell_path(path), digest, timeout))
+
+
+def send_command(path, addr, port):
+    return 'bash -c %s' % quote('cat %s > /dev/tcp/%s/%d' % (
+        shell_path(path), addr, port))
+
+
+def private_address(target, client):
+    """
+    Private IP of a droplet, falling back to the host the client connects to
+    """
+    try:
+        return target.private_ip
+    except (AttributeError, ValueError):
+        return client.host
+
+
+class Relay(object):
+    """
+    Schedules copies of one file over a set of hosts. The controller
+    uploads one copy per seed (moving on to another host only if an upload
+    fails) and every host that received a verified copy repeatedly takes
+    the next waiting host until none are left. A host whose forward fails
+    stops forwarding, so the target is retried from another holder
+    """
+
+    def __init__(self, clients, addresses, seeds=DEFAULT_SEEDS, retries=2,
+                 timeout=60, targets=None):
+        """
+        Parameters
+        ----------
+        clients: list of SSHClient
+        addresses: list of str
+            private address of each client that peers connect to
+        seeds: int, default 2
+            number of concurrent uploads from the controller
+        retries: int, default 2
+            failed copies to a host are retried this many times, possibly
+            from a different holder
+        timeout: int, default 60
+            seconds a receiver waits for its sender and between reads
+        targets: list, optional
+            reported as HostResult.target, defaults to clients
+        """
+        self.clients = list(clients)
+        self.addresses = dict((id(c), a) for c, a in
+                              zip(self.clients, addresses))
+        self.targets = dict((id(c), t) for c, t in
+                            zip(self.clients, targets or self.clients))
+        self.seeds = seeds
+        self.retries = retries
+        self.timeout = timeout
+
+    def run(self, local_path, remote_path, total_timeout=None):
+        """
+        Copy local_path to remote_path on every host
+
+        Parameters
+        ----------
+        local_path: str
+        remote_path: str
+        total_timeout: float, optional
+            seconds after which hosts that have not received the file yet
+            are reported with CommandTimeout
+
+        Returns
+        -------
+        dict of host -> HostResult whose result is the host it received the
+            file from ('controller' for seeds)
+        """
+        self.local_path = os.path.expanduser(local_path)
+        self.remote_path = remote_path
+        self.digest = file_sha256(self.local_path)
+        self.results = {}
+        self._pending = deque(self.clients)
+        self._attempts = {}
+        self._cond = threading.Condition()
+        self._threads = []
+        self._active = 0
+        self._expired = False
+        start = time.time()
+
+        with self._cond:
+            for _ in range(min(self.seeds, len(self.clients))):
+                self._spawn(None)
+            while len(self.results) < len(self.clients):
+                if (total_timeout is not None and
+                        time.time() - start > total_timeout):
+                    self._expire(start, total_timeout)
+                    break
+                if self._pending and not self._active:
+                    # every holder stopped after a failure, seed again
+                    self._spawn(None)
+                self._cond.wait(0.1)
+        return self.results
+
+    def _spawn(self, holder):
+        with self._cond:
+            self._active += 1
+        thread = threading.Thread(target=self._work, args=(holder,))
+        thread.daemon = True
+        self._threads.append(thread)
+        thread.start()
+
+    def _work(self, holder):
+        try:
+            self._forward_all(holder)
+        finally:
+            with self._cond:
+                self._active -= 1
+                self._cond.notify_all()
+
+    def _forward_all(self, holder):
+        while True:
+            with self._cond:
+                if self._expired or not self._pending:
+                    return
+                client = self._pending.popleft()
+            start = time.time()
+            try:
+                if holder is None:
+                    self._upload(client)
+                else:
+                    self._forward(holder, client)
+            except Exception as e:
+                with self._cond:
+                    if self._expired:
+                        return
+                    attempts = self._attempts.get(id(client), 0) + 1
+                    self._attempts[id(client)] = attempts
+                    if attempts <= self.retries:
+                        self._pending.append(client)
+                    else:
+                        self._finish(client, holder, start, e)
+                if holder is not None:
+                    # a holder that failed once is likely to fail again,
+                    # leave the target to the others
+                    return
+                continue
+            with self._cond:
+                self._finish(client, holder, start)
+            # the new holder starts forwarding right away
+            self._spawn(client)
+            if holder is None:
+                # the controller's uplink only carries the seed copies
+                return
+
+    def _expire(self, start, total_timeout):
+        # called with self._cond held
+        self._expired = True
+        self._pending.clear()
+        for client in self.clients:
+            if client.host not in self.results:
+                self.results[client.host] = HostResult(
+                    client.host, self.targets[id(client)],
+                    error=CommandTimeout('not received after %ss' %
+                                         total_timeout, None),
+                    elapsed=time.time() - start)
+
+    def _finish(self, client, holder, start, error=None):
+        if client.host in self.results:
+            # already reported as timed out
+            return
+        source = 'controller' if holder is None else holder.host
+        self.results[client.host] = HostResult(
+            client.host, self.targets[id(client)], result=source,
+            error=error, elapsed=time.time() - start)
+        self._cond.notify_all()
+
+    def _path(self, client):
+        path = self.remote_path
+        if client.pwd and not path.startswith(('/', '~')):
+            path = os.path.join(client.pwd, path)
+        return path
+
+    def _upload(self, client):
+        path = self._path(client)
+        client.wait('mkdir -p "$(dirname %s)"' % shell_path(path))
+        Transfer(client.transport).put(self.local_path,
+                                       resolve_remote_path(path))
+        remote = client.wait('sha256sum %s' % shell_path(path)).split()
+        if not remote or remote[0] != self.digest:
+            raise CommandError('checksum mismatch on %s' % client.host, None)
+
+    def _forward(self, holder, client):
+        addr = self.addresses[id(client)]
+        receiver = client.execute(receive_command(
+            addr, self._path(client), self.digest, self.timeout))
+        output = iter(receiver)
+        stderr = []
+        port = None
+        for stream, line in output:
+            if stream == 'stderr':
+                stderr.append(line)
+            else:
+                port = int(line)
+                break
+        if port is None:
+            raise CommandError('receiver on %s failed: %s' % (
+                client.host, '\n'.join(stderr)), receiver.exit_status,
+                '\n'.join(stderr))
+
+        sender = holder.execute(send_command(self._path(holder), addr, port),
+                                lines=False)
+        sender_stderr = []
+        status = sender.wait(stderr=sender_stderr.append)
+        if status != 0:
+            # the receiver would otherwise wait for a connection until timeout
+            receiver.channel.close()
+        for stream, line in output:
+            if stream == 'stderr':
+                stderr.append(line)
+        if status != 0:
+            raise CommandError('sending from %s to %s failed: %s' % (
+                holder.host, client.host, ''.join(sender_stderr)), status,
+                ''.join(sender_stderr))
+        status = receiver.exit_status
+        if status != 0:
+            raise CommandError('receiving on %s failed: %s' % (
+                client.host, '\n'.join(stderr)), status, '\n'.join(stderr))
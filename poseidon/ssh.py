@@ -1,7 +1,25 @@
 from __future__ import print_function
+import codecs
 import os
 import getpass
+import re
+import select
+import socket
+import threading
+import time
+import uuid
 from cStringIO import StringIO
+from distutils.version import LooseVersion
+
+from poseidon.parallel import backoff
+from poseidon.process import (
+    PS_FIELDS, TOP_FIELDS, ProcessTable, ps_command)
+from poseidon.transfer import Transfer, resolve_remote_path
+
+try:
+    from shlex import quote
+except ImportError:
+    from pipes import quote
 
 try:
     import paramiko
@@ -20,42 +38,773 @@ except ImportError:
     has_pandas = False
 
 
+CHUNK_SIZE = 32768
+
+
+class CommandError(ValueError):
+    """
+    Error raised when a remote command exits with a non-zero status
+    """
+
+    def __init__(self, message, exit_status, stderr=''):
+        super(CommandError, self).__init__(message)
+        self.exit_status = exit_status
+        self.stderr = stderr
+
+
+class CommandTimeout(CommandError):
+    """
+    Error raised when a remote command does not finish in time
+    """
+
+
+class RemoteCommand(object):
+    """
+    A command running on a remote channel. stdout and stderr are read
+    together as data arrives so a chatty command can never fill one
+    channel window while we block on the other
+    """
+
+    def __init__(self, channel, lines=True, encoding='utf-8',
+                 chunk_size=CHUNK_SIZE, timeout=None):
+        """
+        Parameters
+        ----------
+        channel: paramiko.Channel
+            channel the command was executed on
+        lines: bool, default True
+            If True then iterating yields decoded lines without the trailing
+            newline, otherwise raw chunks of bytes
+        encoding: str, default 'utf-8'
+        chunk_size: int, default 32768
+        timeout: float, optional
+            seconds after which the channel is closed and CommandTimeout is
+            raised if the command is still running
+        """
+        self.channel = channel
+        self.lines = lines
+        self.encoding = encoding
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+
+    def __iter__(self):
+        """
+        Yield (stream, data) tuples where stream is 'stdout' or 'stderr'
+        """
+        if not self.lines:
+            return self.chunks()
+        return self._lines()
+
+    def chunks(self):
+        """
+        Yield (stream, bytes) tuples as data arrives
+        """
+        deadline = self._deadline()
+        while True:
+            exited, ready = self._read_ready()
+            for item in ready:
+                yield item
+            if exited and not ready:
+                break
+            # checked even when output was read so a command that never
+            # stops writing still times out
+            _check_deadline(deadline, [self])
+            if not ready:
+                select.select([self.channel], [], [], 0.1)
+
+    def _read_ready(self):
+        """
+        Read whatever output is available without blocking
+
+        Returns
+        -------
+        (exited, [(stream, bytes)]): exited is True if the exit status had
+            arrived before reading, in which case no output is left unread
+            once ready comes back empty
+        """
+        chan = self.channel
+        # the exit status is sent after all output, so check it first. A
+        # channel closed on our side will never receive one
+        exited = chan.exit_status_ready() or chan.closed
+        ready = []
+        # one chunk per stream so a stream that is always ready cannot
+        # keep the caller from checking its deadline
+        if chan.recv_ready():
+            ready.append(('stdout', chan.recv(self.chunk_size)))
+        if chan.recv_stderr_ready():
+            ready.append(('stderr', chan.recv_stderr(self.chunk_size)))
+        return exited, ready
+
+    def _deadline(self):
+        if self.timeout is None:
+            return None
+        return time.time() + self.timeout
+
+    def _lines(self):
+        decoders = {'stdout': _LineDecoder(self.encoding),
+                    'stderr': _LineDecoder(self.encoding)}
+        for stream, data in self.chunks():
+            for line in decoders[stream].feed(data):
+                yield stream, line
+        for stream in ('stdout', 'stderr'):
+            for line in decoders[stream].flush():
+                yield stream, line
+
+    def write(self, data):
+        """
+        Send data to the command's stdin
+        """
+        self.channel.sendall(data)
+
+    def close_stdin(self):
+        self.channel.shutdown_write()
+
+    @property
+    def exit_status(self):
+        """
+        Exit status of the command, blocks until the command finishes
+        """
+        return self.channel.recv_exit_status()
+
+    def wait(self, stdout=None, stderr=None):
+        """
+        Read all output into the given sinks and return the exit status
+
+        Parameters
+        ----------
+        stdout, stderr: file-like or callable, optional
+            raw chunks of output are passed to sink.write or sink(chunk).
+            Output for a stream without a sink is discarded
+        """
+        sinks = {'stdout': _writer(stdout), 'stderr': _writer(stderr)}
+        for stream, data in self.chunks():
+            if sinks[stream] is not None:
+                sinks[stream](data)
+        return self.exit_status
+
+
+class CommandGroup(object):
+    """
+    Several commands running concurrently on channels of the same transport
+    whose output is read together as it arrives from any of them
+    """
+
+    def __init__(self, commands, lines=True, timeout=None):
+        """
+        Parameters
+        ----------
+        commands: dict of key -> RemoteCommand
+        lines: bool, default True
+            If True then iterating yields decoded lines, otherwise raw
+            chunks of bytes
+        timeout: float, optional
+            seconds after which remaining commands are closed and
+            CommandTimeout is raised
+        """
+        self.commands = commands
+        self.lines = lines
+        self.timeout = timeout
+
+    def __iter__(self):
+        """
+        Yield (key, stream, data) tuples from whichever command has output
+        """
+        deadline = None
+        if self.timeout is not None:
+            deadline = time.time() + self.timeout
+        decoders = {}
+        if self.lines:
+            for key, command in self.commands.items():
+                decoders[key] = {
+                    'stdout': _LineDecoder(command.encoding),
+                    'stderr': _LineDecoder(command.encoding)}
+        pending = dict(self.commands)
+        while pending:
+            got = False
+            for key, command in list(pending.items()):
+                exited, ready = command._read_ready()
+                got = got or bool(ready)
+                for stream, data in ready:
+                    if not self.lines:
+                        yield key, stream, data
+                        continue
+                    for line in decoders[key][stream].feed(data):
+                        yield key, stream, line
+                if exited and not ready:
+                    del pending[key]
+                    for stream in ('stdout', 'stderr'):
+                        if key not in decoders:
+                            break
+                        for line in decoders[key][stream].flush():
+                            yield key, stream, line
+            if pending:
+                _check_deadline(deadline, pending.values())
+            if pending and not got:
+                select.select([c.channel for c in pending.values()],
+                              [], [], 0.1)
+
+    def wait(self):
+        """
+        Read all output and return dict of key -> (exit status, stdout,
+        stderr) with output as raw bytes
+        """
+        output = dict((k, {'stdout': [], 'stderr': []})
+                      for k in self.commands)
+        lines, self.lines = self.lines, False
+        try:
+            for key, stream, data in self:
+                output[key][stream].append(data)
+        finally:
+            self.lines = lines
+        return dict((k, (c.exit_status, ''.join(output[k]['stdout']),
+                         ''.join(output[k]['stderr'])))
+                    for k, c in self.commands.items())
+
+    @property
+    def exit_statuses(self):
+        """
+        dict of key -> exit status, blocks until all commands finish
+        """
+        return dict((k, c.exit_status) for k, c in self.commands.items())
+
+
+class _LineDecoder(object):
+    """
+    Incrementally decode bytes and split them into lines
+    """
+
+    def __init__(self, encoding):
+        self.decoder = codecs.getincrementaldecoder(encoding)('replace')
+        self.partial = u''
+
+    def feed(self, data):
+        lines = (self.partial + self.decoder.decode(data)).split(u'\n')
+        self.partial = lines.pop()
+        return lines
+
+    def flush(self):
+        rest = self.partial + self.decoder.decode(b'', final=True)
+        self.partial = u''
+        return [rest] if rest else []
+
+
+def _check_deadline(deadline, commands):
+    if deadline is not None and time.time() > deadline:
+        for command in commands:
+            command.channel.close()
+        raise CommandTimeout('command timed out', None)
+
+
+def _writer(sink):
+    if sink is None or callable(sink):
+        return sink
+    return sink.write
+
+
+def _open_connection(host, port=None, username=None, password=None,
+                     compress=False, timeout=None):
+    con = paramiko.SSHClient()
+    con.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    kwargs = {'compress': compress}
+    if timeout is not None:
+        kwargs.update(timeout=timeout, banner_timeout=timeout,
+                      auth_timeout=timeout)
+    for k, v in [('username', username), ('password', password),
+                 ('port', port)]:
+        if v:
+            kwargs[k] = v
+    try:
+        con.connect(host, **kwargs)
+    except Exception:
+        # otherwise the transport thread and socket of a failed attempt
+        # stay around until garbage collected
+        con.close()
+        raise
+    return con
+
+
+def probe(host, port=22, timeout=2.0):
+    """
+    True if host accepts TCP connections on port and sends an SSH banner
+    within timeout seconds
+    """
+    try:
+        sock = socket.create_connection((host, port), timeout)
+    except (socket.error, socket.timeout):
+        return False
+    try:
+        banner = ''
+        deadline = time.time() + timeout
+        while '\n' not in banner and len(banner) < 256:
+            sock.settimeout(max(0.01, deadline - time.time()))
+            data = sock.recv(256)
+            if not data:
+                break
+            banner += data
+        return banner.startswith('SSH-')
+    except (socket.error, socket.timeout):
+        return False
+    finally:
+        sock.close()
+
+
+def wait_for_ssh(host, username='root', password=None, port=None,
+                 timeout=300, pool=True):
+    """
+    Return an SSHClient for host once it accepts logins, see
+    SSHClient.wait_ready
+
+    Parameters
+    ----------
+    pool: bool or SSHPool, default True
+        True uses the process-wide pool
+    """
+    if pool is True:
+        pool = default_pool()
+    client = SSHClient(host, username=username, password=password, port=port,
+                       pool=pool or None)
+    return client.wait_ready(timeout)
+
+
+class _PoolEntry(object):
+
+    def __init__(self):
+        self.con = None
+        self.users = 0
+        self.last_used = time.time()
+        self.lock = threading.Lock()
+        # set once the entry is removed from the pool
+        self.evicted = False
+
+
+class SSHPool(object):
+    """
+    Process-wide pool of authenticated SSH connections keyed by
+    (host, port, username). Connections are kept alive, reconnected
+    transparently when they die and closed after sitting idle
+    """
+
+    def __init__(self, keepalive=30, idle_timeout=300):
+        """
+        Parameters
+        ----------
+        keepalive: int, default 30
+            seconds between keepalive packets on each transport
+        idle_timeout: int, default 300
+            seconds after which a connection nobody holds is closed
+        """
+        self.keepalive = keepalive
+        self.idle_timeout = idle_timeout
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._reaper = None
+
+    def get(self, host, port=None, username='root', password=None,
+            lease=False, compress=False, timeout=None):
+        """
+        Return a live paramiko.SSHClient for the given host, connecting or
+        reconnecting if necessary
+
+        Parameters
+        ----------
+        lease: bool, default False
+            If True then the connection is marked as in use until release
+            is called and is never evicted while in use
+        compress: bool, default False
+            request zlib compression when a new connection is opened
+        timeout: float, optional
+            seconds allowed for each of TCP connect, banner and auth when a
+            new connection is opened
+        """
+        while True:
+            entry = self._entry(host, port, username)
+            with entry.lock:
+                if entry.evicted:
+                    # evicted between lookup and lock, look up again
+                    continue
+                transport = entry.con and entry.con.get_transport()
+                if transport is None or not transport.is_active():
+                    if entry.con is not None:
+                        entry.con.close()
+                        entry.con = None
+                    entry.con = _open_connection(host, port, username,
+                                                 password, compress, timeout)
+                    entry.con.get_transport().set_keepalive(self.keepalive)
+                if lease:
+                    entry.users += 1
+                entry.last_used = time.time()
+                con = entry.con
+            break
+        self._start_reaper()
+        return con
+
+    def transport(self, host, port=None, username='root', password=None):
+        """
+        Return a live paramiko.Transport for the given host
+        """
+        return self.get(host, port, username, password).get_transport()
+
+    def release(self, host, port=None, username='root'):
+        """
+        Mark a leased connection as no longer in use
+        """
+        entry = self._entry(host, port, username)
+        with entry.lock:
+            entry.users = max(0, entry.users - 1)
+            entry.last_used = time.time()
+
+    def evict(self, host, port=None, username='root'):
+        """
+        Close the connection for the given host whether in use or not
+        """
+        with self._lock:
+            entry = self._entries.pop(self._key(host, port, username), None)
+        if entry is not None:
+            with entry.lock:
+                entry.evicted = True
+                if entry.con is not None:
+                    entry.con.close()
+                    entry.con = None
+
+    def evict_idle(self):
+        """
+        Close connections that are not in use and have been idle for longer
+        than idle_timeout
+        """
+        cutoff = time.time() - self.idle_timeout
+        idle = []
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                with entry.lock:
+                    # checked and removed together so a concurrent get
+                    # cannot lease the connection in between
+                    if entry.users == 0 and entry.last_used <= cutoff:
+                        del self._entries[key]
+                        entry.evicted = True
+                        idle.append((key, entry.con))
+                        entry.con = None
+        for key, con in idle:
+            if con is not None:
+                con.close()
+        return [key for key, con in idle]
+
+    def close(self):
+        """
+        Close all pooled connections
+        """
+        with self._lock:
+            keys = list(self._entries)
+        for key in keys:
+            self.evict(*key)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _key(self, host, port, username):
+        return (host, port or 22, username)
+
+    def _entry(self, host, port, username):
+        key = self._key(host, port, username)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _PoolEntry()
+            return entry
+
+    def _start_reaper(self):
+        with self._lock:
+            if self._reaper is not None and self._reaper.is_alive():
+                return
+            self._reaper = threading.Thread(target=self._reap)
+            self._reaper.daemon = True
+            self._reaper.start()
+
+    def _reap(self):
+        while self._entries:
+            time.sleep(max(1, self.idle_timeout / 2.0))
+            self.evict_idle()
+
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+
+def default_pool():
+    """
+    Return the process-wide SSHPool
+    """
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = SSHPool()
+        return _default_pool
+
+
+class ShellSession(object):
+    """
+    One long-lived remote shell that commands are sent to in turn. Each
+    command is framed with sentinels on stdout and stderr so its output and
+    exit status can be separated from the next one, while working directory,
+    environment and sudo state carry over between commands. A command costs
+    one round-trip on an already open channel
+    """
+
+    def __init__(self, client, shell='bash --noprofile --norc',
+                 chunk_size=CHUNK_SIZE):
+        """
+        Parameters
+        ----------
+        client: SSHClient
+        shell: str, default 'bash --noprofile --norc'
+            shell command that reads commands from stdin
+        """
+        self.client = client
+        self.chunk_size = chunk_size
+        self.depth = 0
+        self.channel = client.transport.open_session()
+        self.channel.exec_command(shell)
+        self._out = b''
+        self._err = b''
+        if client.pwd:
+            self.run('cd %s' % client.pwd)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def run(self, cmd, raise_on_error=True, timeout=None):
+        """
+        Run command in the shell and wait for it to finish. stdin of the
+        command is /dev/null so it cannot consume the commands that follow
+
+        Returns
+        -------
+        (exit_status, stdout, stderr)
+        """
+        if self.client.interactive:
+            print(cmd)
+        return self._send('{ %s\n} < /dev/null' % cmd, cmd, raise_on_error,
+                          timeout)
+
+    def wait(self, cmd, raise_on_error=True, timeout=None):
+        """
+        Run command in the shell and return its stdout
+        """
+        return self.run(cmd, raise_on_error, timeout)[1]
+
+    @property
+    def pwd(self):
+        """
+        Current working directory of the shell
+        """
+        return self.wait('pwd').strip()
+
+    def chdir(self, path):
+        self.run('cd %s' % path)
+
+    def export(self, **env):
+        """
+        Set environment variables for all following commands
+        """
+        self.run('export %s' % ' '.join('%s=%s' % (k, quote(str(v)))
+                                        for k, v in sorted(env.items())))
+
+    def sudo(self, password=None):
+        """
+        Continue the session in a root shell until unsudo is called
+        """
+        if self.client.username == 'root':
+            raise ValueError('Already root user')
+        password = self.client.validate_password(password)
+        # printf is a builtin so the password never shows in process listings,
+        # and the command bypasses run so it is not echoed in interactive mode
+        cmd = "printf '%%s\\n' %s | sudo -S -p '' -v" % quote(password)
+        self._send('{ %s\n} < /dev/null' % cmd, 'sudo -S -v', True, None)
+        self._send('sudo -n bash --noprofile --norc', 'sudo', True, None,
+                   sync=True)
+        self.depth += 1
+
+    def unsudo(self):
+        """
+        Leave the root shell entered by sudo
+        """
+        if self.depth == 0:
+            raise ValueError('Not in sudo mode')
+        self._send('exit', 'exit', True, None, sync=True)
+        self.depth -= 1
+
+    def close(self):
+        if self.channel is not None:
+            self.channel.close()
+            self.channel = None
+
+    def _send(self, line, cmd, raise_on_error, timeout, sync=False):
+        if self.channel is None:
+            raise ValueError('Shell session is closed')
+        marker = '__poseidon_%s' % uuid.uuid4().hex
+        payload = line + '\n'
+        if sync:
+            # line replaces or leaves the shell, frame an empty command run
+            # by whichever shell reads next
+            payload += 'true\n'
+        payload += ("__rc=$?; printf '\\n%s %%d\\n' $__rc; "
+                    "printf '\\n%s\\n' >&2\n" % (marker, marker))
+        self.channel.sendall(payload)
+        status, out, err = self._read_frame(marker, timeout)
+        if self.client.interactive:
+            print(out)
+            print(err)
+        if status != 0 and raise_on_error:
+            raise CommandError('%s exited with status %d: %s' %
+                               (cmd, status, err), status, err)
+        return status, out, err
+
+    def _read_frame(self, marker, timeout):
+        chan = self.channel
+        out_tag = '\n%s ' % marker
+        err_tag = '\n%s\n' % marker
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        status = out = err = None
+        while out is None or err is None:
+            exited = chan.exit_status_ready()
+            got = False
+            while chan.recv_ready():
+                self._out += chan.recv(self.chunk_size)
+                got = True
+            while chan.recv_stderr_ready():
+                self._err += chan.recv_stderr(self.chunk_size)
+                got = True
+            if out is None:
+                idx = self._out.find(out_tag)
+                end = self._out.find('\n', idx + len(out_tag))
+                if idx >= 0 and end >= 0:
+                    out = self._out[:idx]
+                    status = int(self._out[idx + len(out_tag):end])
+                    self._out = self._out[end + 1:]
+            if err is None:
+                idx = self._err.find(err_tag)
+                if idx >= 0:
+                    err = self._err[:idx]
+                    self._err = self._err[idx + len(err_tag):]
+            if got or (out is not None and err is not None):
+                continue
+            if exited:
+                status = chan.recv_exit_status()
+                self.close()
+                raise CommandError('Shell session exited with status %s' %
+                                   status, status, self._err)
+            if deadline is not None and time.time() > deadline:
+                # the shell is out of step with our framing now
+                self.close()
+                raise CommandTimeout('command timed out', None)
+            select.select([chan], [], [], 0.1)
+        return status, out, err
+
+
 class SSHClient(object):
     """
     Thin wrapper to connect to client over SSH and execute commands
     """
 
     def __init__(self, host, username='root', password=None, port=None,
-                 interactive=False):
+                 interactive=False, pool=None, compress=False, timeout=None):
         """
         Parameters
         ----------
         interactive: bool, default False
             If True then prompts for password whenever necessary
+        pool: SSHPool, optional
+            If given then the connection is borrowed from the pool and
+            shared with other clients for the same host, port and user
+        compress: bool, default False
+            If True then request zlib compression for the connection, which
+            helps transfers of compressible data over slow links. Ignored if
+            a pooled connection to the host is already open
+        timeout: float, optional
+            seconds allowed for each of TCP connect, banner and auth when
+            connecting
         """
         self.host = host
         self.port = port
         self.username = username
         self.password = password
         self.interactive = interactive
+        self.pool = pool
+        self.compress = compress
+        self.timeout = timeout
         self.pwd = '~'
         self._con = None
+        self._packages = {}
 
     @property
     def con(self):
-        if self._con is None:
+        if self.pool is not None:
+            # the pool checks liveness and reconnects dead connections
+            leased = self._con is not None
+            self._con = self.pool.get(self.host, self.port, self.username,
+                                      self.password, lease=not leased,
+                                      compress=self.compress,
+                                      timeout=self.timeout)
+        elif self._con is None:
             self._connect()
         return self._con
 
+    @property
+    def transport(self):
+        """
+        Underlying paramiko.Transport
+        """
+        return self.con.get_transport()
+
     def _connect(self):
-        self._con = paramiko.SSHClient()
-        self._con.set_missing_host_key_policy(
-            paramiko.AutoAddPolicy())
-        kwargs = {}
-        for k in ['username', 'password', 'port']:
-            if getattr(self, k, None):
-                kwargs[k] = getattr(self, k)
-        self._con.connect(self.host, **kwargs)
+        self._con = _open_connection(self.host, self.port, self.username,
+                                     self.password, self.compress,
+                                     self.timeout)
+
+    def wait_ready(self, timeout=300, probe_timeout=2.0):
+        """
+        Wait until the host accepts SSH logins, e.g., right after a droplet
+        is created, and return this client with its connection open.
+        Cheap probes of the port and the SSH banner with short timeouts and
+        jittered backoff run until the banner shows, then logins are tried
+        until one succeeds
+
+        Parameters
+        ----------
+        timeout: float, default 300
+            seconds after which ValueError is raised
+        probe_timeout: float, default 2.0
+            seconds allowed for each probe and login step
+        """
+        deadline = time.time() + timeout
+        attempt = 0
+        saved = self.timeout
+        self.timeout = probe_timeout
+        try:
+            while True:
+                error = None
+                if probe(self.host, self.port or 22, probe_timeout):
+                    try:
+                        self.transport
+                        return self
+                    except (paramiko.SSHException, socket.error,
+                            EOFError) as e:
+                        # sshd can be up before cloud-init installs keys
+                        error = e
+                        self._con = None
+                delay = backoff(attempt, base=0.25, cap=5.0)
+                if time.time() + delay > deadline:
+                    raise ValueError('%s did not accept SSH logins within %s '
+                                     'seconds (%s)' % (self.host, timeout,
+                                                       error or 'no banner'))
+                time.sleep(delay)
+                attempt += 1
+        finally:
+            self.timeout = saved
 
     def chdir(self, new_pwd, relative=True):
         """
@@ -80,9 +829,90 @@ class SSHClient(object):
             cmd = 'mkdir -p ~/.ssh && echo "%s" >> ~/.ssh/authorized_keys'
             self.wait(cmd % fp.read())
 
+    def put(self, local_path, remote_path, callback=None, workers=4,
+            **kwargs):
+        """
+        Upload a file over SFTP with pipelined writes. Files larger than
+        64MB are split into parts sent concurrently over separate channels
+
+        Parameters
+        ----------
+        local_path: str
+        remote_path: str
+            relative paths are relative to the current directory
+        callback: callable, optional
+            called with (bytes transferred, total bytes) as data moves
+        workers: int, default 4
+            number of parts for large files
+        kwargs: window_size, max_packet_size, threshold
+            see poseidon.transfer.Transfer
+
+        Returns
+        -------
+        number of bytes sent
+        """
+        transfer = Transfer(self.transport, workers=workers,
+                            callback=callback, **kwargs)
+        return transfer.put(os.path.expanduser(local_path),
+                            resolve_remote_path(remote_path, self.pwd))
+
+    def get(self, remote_path, local_path, callback=None, workers=4,
+            **kwargs):
+        """
+        Download a file over SFTP with pipelined reads. Files larger than
+        64MB are split into parts fetched concurrently over separate
+        channels. Parameters are as for put
+
+        Returns
+        -------
+        number of bytes received
+        """
+        transfer = Transfer(self.transport, workers=workers,
+                            callback=callback, **kwargs)
+        return transfer.get(resolve_remote_path(remote_path, self.pwd),
+                            os.path.expanduser(local_path))
+
+    def sync(self, local_dir, remote_dir, delete=True, exclude=None,
+             compress=True, dry_run=False):
+        """
+        Make a remote directory match a local one, sending only files whose
+        content hash differs from the manifest left by the previous sync.
+        Changed files go out as one tar stream on the channel that fetched
+        the remote manifest, so a sync with no changes is one round-trip
+
+        Parameters
+        ----------
+        local_dir: str
+        remote_dir: str
+            relative paths are relative to the current directory
+        delete: bool, default True
+            If True then files synced earlier but missing locally are removed
+        exclude: sequence of str, optional
+            glob patterns for file and directory names to skip, by default
+            .git, *.pyc and __pycache__
+        compress: bool, default True
+            gzip the tar stream
+        dry_run: bool, default False
+            If True then only report what would change
+
+        Returns
+        -------
+        SyncResult(uploaded, deleted, unchanged) lists of relative paths
+        """
+        from poseidon import sync
+        if self.pwd and not remote_dir.startswith(('/', '~')):
+            remote_dir = os.path.join(self.pwd, remote_dir)
+        if exclude is None:
+            exclude = sync.DEFAULT_EXCLUDE
+        return sync.sync(self, local_dir, remote_dir, delete=delete,
+                         exclude=exclude, compress=compress, dry_run=dry_run)
+
     def close(self):
         if self._con is not None:
-            self._con.close()
+            if self.pool is not None:
+                self.pool.release(self.host, self.port, self.username)
+            else:
+                self._con.close()
             self._con = None
 
     def exec_command(self, cmd):
@@ -100,18 +930,92 @@ class SSHClient(object):
             print(cmd)
         return self.con.exec_command(cmd)
 
+    def execute(self, cmd, lines=True, encoding='utf-8', timeout=None):
+        """
+        Execute command and return a RemoteCommand that streams its output.
+        Iterating over it yields ('stdout' or 'stderr', data) as data arrives
+
+        Parameters
+        ----------
+        lines: bool, default True
+            If True then yield decoded lines, otherwise raw chunks of bytes
+        encoding: str, default 'utf-8'
+        timeout: float, optional
+            seconds after which reading raises CommandTimeout
+
+        Example
+        -------
+        cmd = ssh.execute('apt-get update')
+        for stream, line in cmd:
+            print(stream, line)
+        print(cmd.exit_status)
+        """
+        _, stdout, _ = self.exec_command(cmd)
+        return RemoteCommand(stdout.channel, lines=lines, encoding=encoding,
+                             timeout=timeout)
+
+    def run(self, cmd, stdout=None, stderr=None, raise_on_error=True,
+            timeout=None):
+        """
+        Execute command, stream its output into the given sinks without
+        holding it in memory and return its exit status
+
+        Parameters
+        ----------
+        stdout, stderr: file-like or callable, optional
+            receive raw chunks of output as they arrive, e.g., a local file
+            opened in binary mode. Output without a sink is discarded
+        raise_on_error: bool, default True
+            If True then raise CommandError if the exit status is not 0
+        timeout: float, optional
+            seconds after which CommandTimeout is raised
+        """
+        command = self.execute(cmd, lines=False, timeout=timeout)
+        status = command.wait(stdout=stdout, stderr=stderr)
+        if status != 0 and raise_on_error:
+            raise CommandError('%s exited with status %d' % (cmd, status),
+                               status)
+        return status
+
+    def multiplex(self, cmds, lines=True, timeout=None):
+        """
+        Start several independent commands at once, each on its own channel
+        of this connection, and return a CommandGroup streaming their output
+
+        Parameters
+        ----------
+        cmds: list of str or dict of key -> str
+            commands are identified by their index or key
+        lines: bool, default True
+            If True then yield decoded lines, otherwise raw chunks of bytes
+        timeout: float, optional
+            seconds after which reading raises CommandTimeout
+
+        Example
+        -------
+        group = ssh.multiplex({'apt': 'apt-get install -y nginx',
+                               'code': 'git pull'})
+        for key, stream, line in group:
+            print(key, stream, line)
+        print(group.exit_statuses)
+        """
+        if not isinstance(cmds, dict):
+            cmds = dict(enumerate(cmds))
+        commands = dict((k, self.execute(cmd, lines=lines))
+                        for k, cmd in cmds.items())
+        return CommandGroup(commands, lines=lines, timeout=timeout)
+
     def wait(self, cmd, raise_on_error=True):
         """
         Execute command and wait for it to finish. Proceed with caution because
         if you run a command that causes a prompt this will hang
         """
-        _, stdout, stderr = self.exec_command(cmd)
-        stdout.channel.recv_exit_status()
-        output = stdout.read()
+        output, errors = [], []
+        command = self.execute(cmd, lines=False)
+        command.wait(stdout=output.append, stderr=errors.append)
+        output, errors = ''.join(output), ''.join(errors)
         if self.interactive:
             print(output)
-        errors = stderr.read()
-        if self.interactive:
             print(errors)
         if errors and raise_on_error:
             raise ValueError(errors)
@@ -124,6 +1028,21 @@ class SSHClient(object):
         cmd = "nohup %s &" % cmd
         self.exec_command(cmd)
 
+    def session(self, shell='bash --noprofile --norc'):
+        """
+        Open a persistent remote shell. Unlike exec_command, the working
+        directory, environment and sudo state persist between commands and
+        no new channel is opened per command
+
+        Example
+        -------
+        with ssh.session() as sh:
+            sh.run('cd /srv/app && export FLASK_ENV=production')
+            sh.sudo()
+            sh.run('pip install -r requirements.txt')
+        """
+        return ShellSession(self, shell=shell)
+
     def sudo(self, password=None):
         """
         Enter sudo mode
@@ -165,27 +1084,13 @@ class SSHClient(object):
             If True then raise ValueError if stderr is not empty
             debconf often gives tty error
         """
-        if isinstance(package_names, basestring):
-            package_names = [package_names]
-        cmd = "apt-get install -y %s" % (' '.join(package_names))
-        return self.wait(cmd, raise_on_error=raise_on_error)
+        self._packages.pop('apt', None)
+        return self.wait(apt_command(package_names),
+                         raise_on_error=raise_on_error)
 
     def curl(self, url, raise_on_error=True, **kwargs):
-        import simplejson as json
-        def format_param(name):
-            if len(name) == 1:
-                prefix = '-'
-            else:
-                prefix = '--'
-            return prefix + name
-        def format_value(value):
-            if value is None:
-                return ''
-            return json.dumps(value)
-        options = ['%s %s' % (format_param(k), format_value(v))
-                   for k, v in kwargs.items()]
-        cmd = 'curl %s "%s"' % (' '.join(options), url)
-        return self.wait(cmd, raise_on_error=raise_on_error)
+        return self.wait(curl_command(url, **kwargs),
+                         raise_on_error=raise_on_error)
 
     def pip(self, package_names, raise_on_error=True):
         """
@@ -198,10 +1103,9 @@ class SSHClient(object):
         raise_on_error: bool, default True
             If True then raise ValueError if stderr is not empty
         """
-        if isinstance(package_names, basestring):
-            package_names = [package_names]
-        cmd = "pip install -U %s" % (' '.join(package_names))
-        return self.wait(cmd, raise_on_error=raise_on_error)
+        self._packages.pop('pip', None)
+        return self.wait(pip_command(package_names),
+                         raise_on_error=raise_on_error)
 
     def pip_freeze(self, raise_on_error=True):
         """
@@ -210,7 +1114,7 @@ class SSHClient(object):
         """
         return self.wait('pip freeze', raise_on_error=raise_on_error)
 
-    def pip_r(self, requirements, raise_on_error=True):
+    def pip_r(self, requirements, raise_on_error=True, wheelhouse=None):
         """
         Install all requirements contained in the given file path
         Waits for command to finish.
@@ -221,9 +1125,93 @@ class SSHClient(object):
             Path to requirements.txt
         raise_on_error: bool, default True
             If True then raise ValueError if stderr is not empty
+        wheelhouse: Wheelhouse, optional
+            If given then install offline from wheels built once for the
+            fleet, shipping them to this host if needed. Only pip's exit
+            status is checked in this mode
+        """
+        self._packages.pop('pip', None)
+        if wheelhouse is not None:
+            return wheelhouse.install(self, requirements,
+                                      raise_on_error=raise_on_error)
+        return self.wait(pip_r_command(requirements),
+                         raise_on_error=raise_on_error)
+
+    def apt_packages(self, refresh=False):
+        """
+        Installed system packages as dict of name -> version. Queried once
+        with dpkg-query and cached on this client until an install
+
+        Parameters
+        ----------
+        refresh: bool, default False
+            If True then query the host again
         """
-        cmd = "pip install -r %s" % requirements
-        return self.wait(cmd, raise_on_error=raise_on_error)
+        if refresh or 'apt' not in self._packages:
+            output = self.wait(DPKG_QUERY, raise_on_error=False)
+            self._packages['apt'] = parse_dpkg_query(output)
+        return self._packages['apt']
+
+    def pip_packages(self, refresh=False):
+        """
+        Installed python packages as dict of normalized name -> version.
+        Queried once with pip freeze and cached on this client until an
+        install
+
+        Parameters
+        ----------
+        refresh: bool, default False
+            If True then query the host again
+        """
+        if refresh or 'pip' not in self._packages:
+            output = self.wait('pip freeze', raise_on_error=False)
+            self._packages['pip'] = parse_pip_freeze(output)
+        return self._packages['pip']
+
+    def ensure_apt(self, package_names, raise_on_error=False):
+        """
+        Install only the system packages that are not installed yet.
+        Packages may be pinned as name=version
+
+        Returns
+        -------
+        missing: list of str
+            packages that were installed, empty if nothing was needed
+        """
+        if isinstance(package_names, basestring):
+            package_names = package_names.split()
+        installed = self.apt_packages()
+        missing = []
+        for spec in package_names:
+            name, _, version = spec.partition('=')
+            name = name.split(':')[0]
+            if name not in installed or (version and
+                                         installed[name] != version):
+                missing.append(spec)
+        if missing:
+            self.apt(missing, raise_on_error=raise_on_error)
+        return missing
+
+    def ensure_pip(self, package_names, raise_on_error=True):
+        """
+        Install only the python packages that are missing or whose
+        installed version does not satisfy the given requirement, e.g.,
+        'flask', 'requests>=2.3', 'six==1.9.0'
+
+        Returns
+        -------
+        missing: list of str
+            requirements that were installed, empty if nothing was needed
+        """
+        if isinstance(package_names, basestring):
+            package_names = package_names.split()
+        installed = self.pip_packages()
+        missing = [spec for spec in package_names
+                   if not requirement_satisfied(spec, installed)]
+        if missing:
+            self.pip(["'%s'" % spec for spec in missing],
+                     raise_on_error=raise_on_error)
+        return missing
 
     def ps(self, args=None, options='', all=True, verbose=True,
            as_frame='auto', raise_on_error=True):
@@ -247,17 +1235,71 @@ class SSHClient(object):
                 raise ImportError("Unable to import pandas")
             df = pd.read_fwf(StringIO(results))
             cmd_loc = df.columns.get_loc('CMD')
-            if cmd_loc < len(df.columns):
-                col = cmd_loc.fillna('')
+            if cmd_loc < len(df.columns) - 1:
+                # read_fwf splits free-form command lines into extra columns
+                col = df.iloc[:, cmd_loc].fillna('').astype(str)
                 for i in range(cmd_loc + 1, len(df.columns)):
-                    col = col + df.icol(i).fillna('')
-                df['CMD'] = col
+                    col = col + ' ' + df.iloc[:, i].fillna('').astype(str)
+                df = df.iloc[:, :cmd_loc + 1]
+                df['CMD'] = col.str.strip()
             return df
 
         return results
 
-    def top(self):
-        return self.ps('o', TOP_OPTIONS)
+    def processes(self, fields=PS_FIELDS, raise_on_error=True):
+        """
+        Snapshot of all processes parsed into a ProcessTable with one
+        compact array per field. Use .to_frame() for a pandas DataFrame
+
+        Parameters
+        ----------
+        fields: sequence of (ps field, type), default PS_FIELDS
+            type is 'i', 'd' or 's'. Only the last field may contain
+            whitespace
+        """
+        output = self.wait(ps_command(fields), raise_on_error=raise_on_error)
+        return ProcessTable.parse(output, fields)
+
+    def top(self, samples=None, interval=1.0, fields=TOP_FIELDS):
+        """
+        Without arguments return ps output for the top columns. With samples
+        return a list of ProcessTables sampled every interval seconds by a
+        single remote loop, so sampling many times costs one exec
+
+        Parameters
+        ----------
+        samples: int, optional
+        interval: float, default 1.0
+        fields: sequence of (ps field, type), default TOP_FIELDS
+        """
+        if samples is None:
+            return self.ps('o', TOP_OPTIONS)
+        marker = '__poseidon_sample'
+        cmd = ('for i in $(seq %d); do %s; echo %s; sleep %s; done' %
+               (samples, ps_command(fields), marker, interval))
+        tables = [ProcessTable(fields)]
+        for stream, line in self.execute(cmd):
+            if stream != 'stdout':
+                continue
+            if line == marker:
+                tables.append(ProcessTable(fields))
+            else:
+                tables[-1].extend([line])
+        return tables[:samples]
+
+    def sampler(self, interval=1.0, size=3600):
+        """
+        Started MetricsSampler collecting CPU, memory, disk and network
+        counters every interval seconds over one channel (requires numpy)
+
+        Parameters
+        ----------
+        interval: float, default 1.0
+        size: int, default 3600
+            number of samples kept
+        """
+        from poseidon.metrics import MetricsSampler
+        return MetricsSampler(self, interval=interval, size=size).start()
 
     def git(self, username, repo, alias=None, token=None):
         """
@@ -271,17 +1313,192 @@ class SSHClient(object):
         """
         if alias is None:
             alias = repo
-        if token is None:
-            token = os.environ.get('GITHUB_TOKEN')
         self.wait('mkdir -p %s' % alias)
         old_dir = self.pwd
         try:
             self.chdir(alias, relative=True)
-            cmd = 'git init && git pull https://%s@github.com/%s/%s.git'
             # last line to stderr
-            return self.wait(cmd % (token, username, repo),
+            return self.wait(git_command(username, repo, token),
                              raise_on_error=False)
         finally:
             self.chdir(old_dir, relative=False)
 
+    def git_deploy(self, path, alias=None, ref='HEAD'):
+        """
+        Check out a commit of a local repository on the host without the
+        host talking to GitHub. A git bundle holding only the commits the
+        host is missing is built locally and streamed over the same channel
+        that reported the host's current revision, so a re-deploy sends
+        just the new commits and an up to date host costs one round-trip
+
+        Parameters
+        ----------
+        path: str
+            local git repository
+        alias: str, optional
+            remote directory relative to the current directory, defaults to
+            the name of the local repository
+        ref: str, default 'HEAD'
+            branch, tag or commit to deploy. The host ends up with a
+            detached HEAD at that commit
+
+        Returns
+        -------
+        DeployResult(revision, previous, sent): deployed and previously
+            deployed commit and number of bundle bytes sent
+        """
+        from poseidon.deploy import deploy
+        path = os.path.expanduser(path)
+        if alias is None:
+            alias = os.path.basename(os.path.abspath(path))
+        remote_dir = alias
+        if self.pwd and not alias.startswith(('/', '~')):
+            remote_dir = os.path.join(self.pwd, alias)
+        return deploy(self, path, remote_dir, ref=ref)
+
+    def batch(self, keep_going=False):
+        """
+        Record helper calls (apt, pip, pip_r, git, chdir, curl, wait) and
+        run them as one remote script in a single exec
+
+        Parameters
+        ----------
+        keep_going: bool, default False
+            If True then later steps run even if an earlier one failed
+
+        Example
+        -------
+        with ssh.batch() as b:
+            b.apt('git python-pip')
+            b.git(username='changhiskhan', repo='hello_world')
+            b.chdir('hello_world')
+            b.pip_r('requirements.txt')
+        for step in b.results:
+            print(step.name, step.exit_status, step.elapsed)
+        """
+        from poseidon.batch import Batch
+        return Batch(self, keep_going=keep_going)
+
+def apt_command(package_names):
+    if isinstance(package_names, basestring):
+        package_names = [package_names]
+    return "apt-get install -y %s" % (' '.join(package_names))
+
+
+def pip_command(package_names):
+    if isinstance(package_names, basestring):
+        package_names = [package_names]
+    return "pip install -U %s" % (' '.join(package_names))
+
+
+def pip_r_command(requirements):
+    return "pip install -r %s" % requirements
+
+
+def curl_command(url, **kwargs):
+    import simplejson as json
+    def format_param(name):
+        if len(name) == 1:
+            prefix = '-'
+        else:
+            prefix = '--'
+        return prefix + name
+    def format_value(value):
+        if value is None:
+            return ''
+        return json.dumps(value)
+    options = ['%s %s' % (format_param(k), format_value(v))
+               for k, v in kwargs.items()]
+    return 'curl %s "%s"' % (' '.join(options), url)
+
+
+def git_command(username, repo, token=None):
+    """
+    Command that initializes the current directory and pulls from github
+    """
+    if token is None:
+        token = os.environ.get('GITHUB_TOKEN')
+    cmd = 'git init && git pull https://%s@github.com/%s/%s.git'
+    return cmd % (token, username, repo)
+
+
+DPKG_QUERY = r"dpkg-query -W -f='${Package}\t${Version}\t${Status}\n'"
+
+
+def parse_dpkg_query(output):
+    """
+    Parse DPKG_QUERY output into dict of installed package -> version
+    """
+    packages = {}
+    for line in output.splitlines():
+        parts = line.split('\t')
+        if len(parts) == 3 and parts[2].endswith(' installed'):
+            packages[parts[0]] = parts[1]
+    return packages
+
+
+def parse_pip_freeze(output):
+    """
+    Parse pip freeze output into dict of normalized name -> version
+    """
+    packages = {}
+    for line in output.splitlines():
+        line = line.strip()
+        if not line or line.startswith(('#', '-')):
+            continue
+        if '==' in line:
+            name, version = line.split('==', 1)
+        elif ' @ ' in line:
+            name, version = line.split(' @ ', 1)[0], None
+        else:
+            continue
+        packages[normalize_name(name)] = version
+    return packages
+
+
+def normalize_name(name):
+    return re.sub(r'[-_.]+', '-', name).lower()
+
+
+_REQUIREMENT = re.compile(r'^\s*([A-Za-z0-9][A-Za-z0-9._-]*)\s*(\[[^\]]*\])?'
+                          r'\s*(.*)$')
+_SPECIFIER = re.compile(r'^\s*(==|!=|>=|<=|>|<|~=)\s*([^\s,]+)\s*$')
+
+
+def requirement_satisfied(spec, installed):
+    """
+    True if requirement spec (e.g., 'requests>=2.3,<3') is satisfied by
+    the installed packages dict returned by parse_pip_freeze
+    """
+    m = _REQUIREMENT.match(spec)
+    if m is None:
+        return False
+    name, _, constraints = m.groups()
+    version = installed.get(normalize_name(name), False)
+    if version is False:
+        return False
+    constraints = constraints.strip()
+    if not constraints:
+        return True
+    if version is None:
+        # installed from a url, version unknown
+        return False
+    have = LooseVersion(version)
+    for constraint in constraints.split(','):
+        c = _SPECIFIER.match(constraint)
+        if c is None:
+            return False
+        op, want = c.group(1), LooseVersion(c.group(2))
+        if op == '~=':
+            prefix = want.version[:-1]
+            ok = have >= want and have.version[:len(prefix)] == prefix
+        else:
+            ok = {'==': have == want, '!=': have != want,
+                  '>=': have >= want, '<=': have <= want,
+                  '>': have > want, '<': have < want}[op]
+        if not ok:
+            return False
+    return True
+
+
 TOP_OPTIONS = '%cpu,%mem,user,comm'
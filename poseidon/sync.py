@@ -0,0 +1,205 @@
+"""
+Incremental directory sync. A content hash manifest of the local tree is
+compared with the manifest cached on the droplet by the previous sync and
+only changed files are sent, as one tar stream over the same channel that
+returned the remote manifest
+"""
+from __future__ import absolute_import
+
+import fnmatch
+import hashlib
+import os
+import stat
+import tarfile
+import uuid
+from collections import namedtuple
+from cStringIO import StringIO
+
+try:
+    from shlex import quote
+except ImportError:
+    from pipes import quote
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+from poseidon.ssh import CommandError
+
+MANIFEST = '.poseidon-manifest'
+DELETIONS = '.poseidon-deletions'
+DEFAULT_EXCLUDE = ('.git', '*.pyc', '__pycache__')
+
+SyncResult = namedtuple('SyncResult', ['uploaded', 'deleted', 'unchanged'])
+
+
+def file_digest(path, block_size=2 ** 16):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as fp:
+        for block in iter(lambda: fp.read(block_size), ''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def build_manifest(root, exclude=DEFAULT_EXCLUDE):
+    """
+    Map each regular file under root to [sha1, permission bits]
+
+    Parameters
+    ----------
+    root: str
+    exclude: sequence of str
+        glob patterns matched against file and directory names
+    """
+    def excluded(name):
+        return name == MANIFEST or any(fnmatch.fnmatch(name, pattern)
+                                       for pattern in exclude)
+
+    manifest = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if not excluded(d))
+        for name in sorted(filenames):
+            if excluded(name):
+                continue
+            path = os.path.join(dirpath, name)
+            st = os.lstat(path)
+            if not stat.S_ISREG(st.st_mode):
+                continue
+            rel = os.path.relpath(path, root).replace(os.sep, '/')
+            manifest[rel] = [file_digest(path), stat.S_IMODE(st.st_mode)]
+    return manifest
+
+
+def diff_manifests(local, remote):
+    """
+    Returns
+    -------
+    (changed, deleted, unchanged): sorted lists of relative paths
+    """
+    changed, unchanged = [], []
+    for path in sorted(local):
+        if remote.get(path) == local[path]:
+            unchanged.append(path)
+        else:
+            changed.append(path)
+    deleted = sorted(set(remote) - set(local))
+    return changed, deleted, unchanged
+
+
+def shell_path(path):
+    """
+    Quote a remote path for the shell, keeping a leading ~ expandable
+    """
+    if path == '~':
+        return '"$HOME"'
+    if path.startswith('~/'):
+        return '"$HOME"/' + quote(path[2:])
+    return quote(path)
+
+
+def sync_script(remote_dir, marker, compress=True):
+    """
+    Remote side of a sync: print the cached manifest and a marker line, then
+    wait for 'skip' or 'tar' on stdin. 'tar' is followed by a tar stream of
+    changed files, the new manifest and the list of files to delete
+    """
+    return '\n'.join([
+        'set -e',
+        'mkdir -p %s' % shell_path(remote_dir),
+        'cd %s' % shell_path(remote_dir),
+        'cat %s 2>/dev/null || echo "{}"' % MANIFEST,
+        'echo',
+        'echo %s' % marker,
+        'IFS= read -r action',
+        '[ "$action" = tar ] || exit 0',
+        'tar --no-same-owner -x%sf -' % ('z' if compress else ''),
+        'if [ -s %s ]; then xargs -0 rm -f -- < %s; fi' % (DELETIONS,
+                                                            DELETIONS),
+        'rm -f %s' % DELETIONS,
+    ])
+
+
+class _ChannelWriter(object):
+    """
+    File-like adapter so tarfile can stream into a RemoteCommand's stdin
+    """
+
+    def __init__(self, command):
+        self.command = command
+
+    def write(self, data):
+        self.command.write(data)
+
+
+def sync(client, local_dir, remote_dir, delete=True,
+         exclude=DEFAULT_EXCLUDE, compress=True, dry_run=False):
+    """
+    Make remote_dir match local_dir. See SSHClient.sync
+    """
+    local_dir = os.path.expanduser(local_dir)
+    if not os.path.isdir(local_dir):
+        raise ValueError('%s is not a directory' % local_dir)
+    local = build_manifest(local_dir, exclude)
+
+    marker = '__poseidon_sync_%s' % uuid.uuid4().hex
+    command = client.execute('sh -c %s' % quote(
+        sync_script(remote_dir, marker, compress)))
+    output = iter(command)
+    stdout, stderr = [], []
+    for stream, line in output:
+        if stream == 'stderr':
+            stderr.append(line)
+        elif line == marker:
+            break
+        else:
+            stdout.append(line)
+    else:
+        raise CommandError('sync of %s failed: %s' %
+                           (remote_dir, '\n'.join(stderr)),
+                           command.exit_status, '\n'.join(stderr))
+
+    remote = json.loads(''.join(stdout) or '{}')
+    changed, deleted, unchanged = diff_manifests(local, remote)
+    if not delete:
+        # keep entries for files left in place so they are not resent
+        local.update((path, remote[path]) for path in deleted)
+        deleted = []
+
+    if dry_run or not (changed or deleted):
+        command.write('skip\n')
+    else:
+        command.write('tar\n')
+        _send_tar(_ChannelWriter(command), local_dir, changed, deleted,
+                  local, compress)
+    command.close_stdin()
+
+    for stream, line in output:
+        if stream == 'stderr':
+            stderr.append(line)
+    status = command.exit_status
+    if status != 0:
+        raise CommandError('sync of %s failed: %s' %
+                           (remote_dir, '\n'.join(stderr)), status,
+                           '\n'.join(stderr))
+    return SyncResult(changed, deleted, unchanged)
+
+
+def _send_tar(fp, local_dir, changed, deleted, manifest, compress):
+    tar = tarfile.open(fileobj=fp, mode='w|gz' if compress else 'w|')
+    try:
+        for path in changed:
+            tar.add(os.path.join(local_dir, path), arcname=path,
+                    recursive=False)
+        _add_bytes(tar, DELETIONS, ''.join(p + '\0' for p in deleted))
+        # written last so an interrupted sync is retried in full
+        _add_bytes(tar, MANIFEST, json.dumps(manifest, sort_keys=True))
+    finally:
+        tar.close()
+
+
+def _add_bytes(tar, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mode = 0o644
+    tar.addfile(info, StringIO(data))
@@ -0,0 +1,75 @@
+import os
+import signal
+import subprocess
+import threading
+
+import pytest
+
+import poseidon.ssh as S
+
+
+class LocalCommand(object):
+    """
+    RemoteCommand stand-in running the command in a local shell
+    """
+
+    def __init__(self, cmd, cwd=None):
+        # own process group so close() also stops the shell's children
+        self.proc = subprocess.Popen(cmd, shell=True, stdin=subprocess.PIPE,
+                                     stdout=subprocess.PIPE,
+                                     stderr=subprocess.PIPE, cwd=cwd,
+                                     preexec_fn=os.setsid)
+        self.channel = self
+        self.stderr = []
+        self.reader = threading.Thread(target=lambda: self.stderr.extend(
+            self.proc.stderr.read().splitlines()))
+        self.reader.start()
+
+    def __iter__(self):
+        for line in iter(self.proc.stdout.readline, ''):
+            yield 'stdout', line.rstrip('\n')
+        self.reader.join()
+        for line in self.stderr:
+            yield 'stderr', line
+
+    def write(self, data):
+        self.proc.stdin.write(data)
+
+    def close_stdin(self):
+        self.proc.stdin.close()
+
+    def close(self):
+        try:
+            os.killpg(self.proc.pid, signal.SIGKILL)
+        except OSError:
+            # already exited
+            pass
+
+    def wait(self, stdout=None, stderr=None):
+        for stream, line in self:
+            sink = stdout if stream == 'stdout' else stderr
+            if sink is not None:
+                sink(line + '\n')
+        return self.exit_status
+
+    @property
+    def exit_status(self):
+        return self.proc.wait()
+
+
+@pytest.fixture
+def local_command():
+    """
+    Factory for commands run in a local shell, for SSHClient stand-ins
+    """
+    return LocalCommand
+
+
+@pytest.fixture
+def local_client(mock):
+    """
+    SSHClient whose execute runs commands in a local shell
+    """
+    mock.patch.object(S.SSHClient, 'execute',
+                      side_effect=lambda cmd: LocalCommand(cmd))
+    return S.SSHClient('localhost')
@@ -1,6 +1,7 @@
 import os
 import time
 import pytest
+from pytest_mock import mock
 import poseidon.api as P
 from poseidon import connect
 from poseidon.client import Client
@@ -101,3 +102,84 @@ def test_domains(client):
 
     client.domains.delete(new_name)
     assert len(client.domains.list()) == len(old_domains)
+
+
+def test_iterate(mock):
+    api = P.DigitalOceanAPI(api_key='foo')
+    pages = [{'regions': [{'slug': 'sfo1'}],
+              'links': {'pages': {'next': 'page=2'}}},
+             {'regions': [{'slug': 'nyc1'}], 'links': {}}]
+    mock.patch.object(P.Resource, 'get', side_effect=pages)
+    regions = P.Regions(api)
+    result = [x['slug'] for x in regions.iterate(per_page=1)]
+    assert result == ['sfo1', 'nyc1']
+    P.Resource.get.assert_called_with(regions, (), page=2, per_page=1)
+
+
+def test_watcher(mock):
+    api = P.DigitalOceanAPI(api_key='foo')
+    domains = P.Domains(api)
+    a, b = {'name': 'a.com', 'ttl': 1800}, {'name': 'b.com', 'ttl': 1800}
+    responses = [
+        ({'domains': [a, b]}, 'v1'),
+        (None, 'v1'),
+        ({'domains': [dict(a, ttl=60)]}, 'v2')]
+    mock.patch.object(P.Resource, 'send_conditional_request',
+                      side_effect=responses)
+    watcher = P.CollectionWatcher(domains)
+    assert watcher.poll() == [P.Added('a.com', a), P.Added('b.com', b)]
+    assert watcher.poll() == []
+    P.Resource.send_conditional_request.assert_called_with(
+        (), 'v1', page=1, per_page=P.PER_PAGE)
+    assert watcher.poll() == [P.Changed('a.com', a, dict(a, ttl=60)),
+                              P.Removed('b.com', b)]
+
+
+def test_conditional_request(mock):
+    api = P.DigitalOceanAPI(api_key='foo')
+    resp = mock.Mock(status_code=304)
+    mock.patch('requests.get', return_value=resp)
+    assert api.send_conditional_request('droplets', (), 'v1') == (None, 'v1')
+    headers = P.requests.get.call_args[1]['headers']
+    assert headers['If-None-Match'] == 'v1'
+
+
+def test_reconcile(mock):
+    api = P.DigitalOceanAPI(api_key='foo')
+    records = P.DomainRecords(api, 'example.com')
+    current = [
+        {'id': 1, 'type': 'A', 'name': '@', 'data': '1.1.1.1'},
+        {'id': 2, 'type': 'A', 'name': 'www', 'data': '1.1.1.1'},
+        {'id': 3, 'type': 'CNAME', 'name': 'old', 'data': 'example.com'},
+        {'id': 4, 'type': 'NS', 'name': '@', 'data': 'ns1.digitalocean.com'}]
+    desired = [
+        {'type': 'A', 'name': None, 'data': '1.1.1.1'},
+        {'type': 'A', 'name': 'www.example.com.', 'data': '2.2.2.2'},
+        {'type': 'MX', 'name': '@', 'data': 'mail.example.com.',
+         'priority': 10}]
+    mock.patch.object(P.DomainRecords, 'iterate', return_value=iter(current))
+    for meth in ('create', 'update', 'delete'):
+        mock.patch.object(P.DomainRecords, meth)
+
+    report = records.reconcile(desired, limiter=P.RateLimiter(1000, 1000))
+    assert report.unchanged == 1
+    assert report.changes == 3
+    assert not report.errors
+    records.update.assert_called_once_with(
+        2, type='A', name='www', data='2.2.2.2', priority=None, port=None,
+        weight=None, flags=None, tag=None)
+    records.create.assert_called_once_with(
+        type='MX', name='@', data='mail.example.com', priority=10, port=None,
+        weight=None, flags=None, tag=None)
+    records.delete.assert_called_once_with(3)
+
+
+def test_reconcile_noop(mock):
+    api = P.DigitalOceanAPI(api_key='foo')
+    records = P.DomainRecords(api, 'example.com')
+    current = [{'id': 1, 'type': 'A', 'name': '@', 'data': '1.1.1.1'}]
+    mock.patch.object(P.DomainRecords, 'iterate', return_value=iter(current))
+    mock.patch.object(P.Resource, 'send_request')
+    report = records.reconcile([dict(current[0], id=None)])
+    assert report.changes == 0
+    assert not P.Resource.send_request.called
@@ -0,0 +1,160 @@
+import pytest
+
+import poseidon.api as P
+import poseidon.bake as B
+from poseidon.parallel import Job
+from poseidon.provision import Provision
+
+
+class FakeBatch(object):
+
+    def __init__(self, log):
+        self.log = log
+        self.steps = []
+
+    def run(self):
+        self.log.append([cmd for name, cmd, pwd in self.steps])
+
+
+class FakeSSH(object):
+
+    def __init__(self, log):
+        self.log = log
+
+    def batch(self):
+        return FakeBatch(self.log)
+
+    def wait_ready(self, timeout):
+        return self
+
+    def close(self):
+        pass
+
+
+class FakeDroplet(object):
+
+    def __init__(self, images, image, region, log):
+        self.id = 7
+        self.images = images
+        self.image = image
+        self.region = region
+        self.log = log
+        self.status = 'active'
+        self.deleted = False
+
+    def connect(self, pool=True):
+        return FakeSSH(self.log)
+
+    def shutdown(self):
+        self.status = 'off'
+
+    def refresh(self):
+        pass
+
+    def power_on(self):
+        self.status = 'active'
+
+    def take_snapshot(self, name):
+        assert self.status == 'off'
+        self.images.append({'id': 1000 + len(self.images), 'name': name,
+                            'regions': [self.region]})
+
+    def delete(self, wait=True):
+        self.deleted = True
+
+
+class FakeClient(object):
+
+    def __init__(self):
+        self.snapshots = []
+        api = P.DigitalOceanAPI(api_key='foo', api_url='http://localhost')
+        self.images = P.Images(api)
+        self.images.iterate = lambda **params: iter(self.snapshots)
+        self.droplets = None
+
+
+def make_cache(mock, region='nyc3'):
+    client = FakeClient()
+    builders, log = [], []
+
+    def provision(droplets, specs, timeout=600, pool=True):
+        for spec in specs:
+            job = Job(Provision(spec))
+            droplet = FakeDroplet(client.snapshots, spec['image'],
+                                  spec['region'], log)
+            builders.append(droplet)
+            job.value.droplet = droplet
+            job.value.ssh = droplet.connect()
+            yield job
+    mock.patch.object(B, 'provision', provision)
+    return B.BakeCache(client, region, '1gb'), builders, log
+
+
+def recipe(packages='git'):
+    r = B.Recipe('ubuntu')
+    r.apt(packages).layer()
+    r.chdir('/srv')
+    r.pip('flask')
+    return r
+
+
+def test_layers():
+    a, b = recipe(), recipe()
+    assert a.key == b.key
+    assert len(a.layers()) == 2
+    assert a.layers()[0][1] == [('apt', 'apt-get install -y git', None)]
+    assert a.layers()[1][1][0][2] == '/srv'
+    c = recipe('git vim')
+    assert c.layers()[0][0] != a.layers()[0][0]
+    assert c.key != a.key
+    a.layer().layer()
+    assert len(a.layers()) == 2
+    assert B.Recipe('ubuntu').layers() == []
+    assert not hasattr(a, 'run')
+
+
+def test_bake_and_reuse(mock):
+    cache, builders, log = make_cache(mock)
+    first = cache.image(recipe())
+    assert len(builders) == 1 and builders[0].image == 'ubuntu'
+    assert builders[0].deleted
+    assert log == [['apt-get install -y git'], ['pip install -U flask']]
+    names = [i['name'] for i in cache.client.snapshots]
+    assert names == ['poseidon-bake-' + k for k, _ in recipe().layers()]
+    assert first == cache.client.snapshots[-1]['id']
+
+    # cached: no builder
+    assert cache.image(recipe()) == first
+    assert len(builders) == 1
+
+    # shared prefix: only the new layer is baked, on the cached snapshot
+    other = recipe().layer()
+    other.pip('gunicorn')
+    cache.image(other)
+    assert len(builders) == 2
+    assert builders[1].image == first
+    assert log[-1] == ['pip install -U gunicorn']
+
+
+def test_bake_failure(mock):
+    cache, builders, log = make_cache(mock)
+    r = recipe()
+
+    def fail(self):
+        raise ValueError('step failed')
+    mock.patch.object(FakeBatch, 'run', fail)
+    with pytest.raises(ValueError):
+        cache.image(r)
+    assert builders[0].deleted
+    assert cache.client.snapshots == []
+
+
+def test_bake_per_region(mock):
+    cache, builders, log = make_cache(mock)
+    baked = cache.image(recipe())
+    other, other_builders, other_log = make_cache(mock, region='sfo2')
+    other.client.snapshots.extend(cache.client.snapshots)
+    # the nyc3 snapshot cannot be used to create droplets in sfo2
+    assert other.image(recipe()) != baked
+    assert len(other_builders) == 1
+    assert other.lookup(recipe().key)['regions'] == ['sfo2']
@@ -0,0 +1,63 @@
+import base64
+
+import pytest
+from pytest_mock import mock
+
+import poseidon.ssh as S
+from poseidon.batch import Batch, BatchError
+
+
+@pytest.fixture()
+def client():
+    return S.SSHClient('localhost', username='foo', password='')
+
+
+def step_output(marker, index, status, stdout='', stderr=''):
+    return '%s %d %d 10.0 12.5\n%s\n%s\n' % (
+        marker, index, status, base64.b64encode(stdout),
+        base64.b64encode(stderr))
+
+
+def test_script(client):
+    batch = client.batch()
+    batch.apt(['git', 'python-pip'])
+    batch.git(username='changhiskhan', repo='hello_world', token='t')
+    batch.chdir('hello_world')
+    batch.pip_r('requirements.txt')
+    assert [s[0] for s in batch.steps] == ['apt', 'git', 'pip_r']
+    assert batch.steps[2][2] == '~/hello_world'
+    script = batch.script()
+    assert 'cd ~ && apt-get install -y git python-pip\n' in script
+    assert ('cd ~ && mkdir -p hello_world && cd hello_world && git init && '
+            'git pull https://t@github.com/changhiskhan/hello_world.git'
+            in script)
+    assert 'cd ~/hello_world && pip install -r requirements.txt' in script
+    assert script.count('[ $__rc -eq 0 ] || exit $__rc') == 3
+    assert 'exit $__rc' not in Batch(client, keep_going=True).add(
+        'ls').script()
+
+
+def test_run(client, mock):
+    command = mock.Mock()
+    mock.patch.object(S.SSHClient, 'execute', return_value=command)
+    mock.patch('poseidon.batch.uuid.uuid4', return_value=mock.Mock(hex='x'))
+    marker = '__poseidon_step_x'
+
+    def wait(stdout, stderr):
+        stdout(step_output(marker, 0, 0, 'installed\n'))
+        stdout(step_output(marker, 1, 1, stderr='missing'))
+        return 1
+    command.wait.side_effect = wait
+
+    with pytest.raises(BatchError) as e:
+        with client.batch() as batch:
+            batch.apt('git')
+            batch.pip_r('requirements.txt')
+            batch.pip('flask')
+    S.SSHClient.execute.assert_called_with('bash -s', lines=False)
+    assert command.write.called and command.close_stdin.called
+    assert e.value.exit_status == 1
+    apt, pip_r, pip = e.value.results
+    assert apt.ok and apt.stdout == 'installed\n' and apt.elapsed == 2.5
+    assert pip_r.exit_status == 1 and pip_r.stderr == 'missing'
+    assert pip.skipped
@@ -0,0 +1,128 @@
+import os
+import threading
+import time
+
+import pytest
+
+import poseidon.api as P
+import poseidon.droplet as D
+from poseidon.cache import CatalogCache
+
+
+class Loader(object):
+
+    def __init__(self, data):
+        self.data = data
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.data
+
+
+@pytest.fixture
+def api():
+    return P.DigitalOceanAPI(api_key='foo', api_url='http://localhost')
+
+
+@pytest.fixture
+def cache(api, tmpdir):
+    return CatalogCache(api, path=str(tmpdir))
+
+
+def test_key(api):
+    other = P.DigitalOceanAPI(api_key='bar', api_url='http://localhost')
+    assert CatalogCache.key_for(api) == CatalogCache.key_for(api)
+    assert CatalogCache.key_for(api) != CatalogCache.key_for(other)
+    assert 'foo' not in CatalogCache.key_for(api)
+
+
+def test_fetch_cold_then_warm(cache):
+    loader = Loader([{'slug': 'sfo1'}])
+    assert cache.fetch('regions', loader) == [{'slug': 'sfo1'}]
+    assert cache.fetch('regions', loader) == [{'slug': 'sfo1'}]
+    assert loader.calls == 1
+    assert os.path.exists(os.path.join(cache.path, 'regions.json'))
+
+
+def test_shared_across_instances(api, cache, tmpdir):
+    cache.fetch('sizes', Loader(['512mb']))
+    other = CatalogCache(api, path=str(tmpdir))
+    loader = Loader(['1gb'])
+    assert other.fetch('sizes', loader) == ['512mb']
+    assert loader.calls == 0
+
+
+def test_stale_while_revalidate(cache):
+    cache.ttl = 0
+    cache.fetch('images', Loader(['old']))
+    time.sleep(0.01)
+    started, release, calls = threading.Event(), threading.Event(), []
+
+    def loader():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return ['new']
+
+    # the expired entry is served while it is refreshed in the background
+    assert cache.fetch('images', loader) == ['old']
+    assert started.wait(5)
+    assert cache.fetch('images', loader) == ['old']
+    release.set()
+    deadline = time.time() + 5
+    while cache.read('images')['data'] != ['new'] and time.time() < deadline:
+        time.sleep(0.01)
+    assert cache.read('images')['data'] == ['new']
+    assert len(calls) == 1
+
+
+def test_max_stale_refreshes_synchronously(cache):
+    cache.fetch('images', Loader(['old']))
+    cache.ttl = cache.max_stale = 0
+    time.sleep(0.01)
+    assert cache.fetch('images', Loader(['new'])) == ['new']
+
+
+def test_invalidate(cache):
+    cache.fetch('ssh_keys', Loader([1]))
+    cache.invalidate('ssh_keys')
+    cache.invalidate('ssh_keys')
+    assert cache.read('ssh_keys') is None
+
+
+def test_corrupt_entry(cache):
+    cache.write('sizes', ['512mb'])
+    with open(os.path.join(cache.path, 'sizes.json'), 'w') as fh:
+        fh.write('{not json')
+    assert cache.fetch('sizes', Loader(['1gb'])) == ['1gb']
+
+
+def test_collection_uses_cache(api, cache, mock):
+    regions = P.Regions(api)
+    regions.cache = cache
+    mock.patch.object(P.Resource, 'get',
+                      return_value={'regions': [{'slug': 'sfo1'}]})
+    assert regions.list() == [{'slug': 'sfo1'}]
+    assert regions.list() == [{'slug': 'sfo1'}]
+    assert P.Resource.get.call_count == 1
+
+
+def test_keys_create_invalidates(api, cache, mock):
+    keys = P.Keys(api)
+    keys.cache = cache
+    cache.write('ssh_keys', [])
+    mock.patch.object(P.Resource, 'post', return_value={'ssh_key': {}})
+    keys.create('foo', 'ssh-rsa AAAA')
+    assert cache.read('ssh_keys') is None
+
+
+def test_snapshot_invalidates_images(api, cache, mock):
+    droplets = D.Droplets(api)
+    droplets.images = P.Images(api)
+    droplets.images.cache = cache
+    cache.write('images', [])
+    droplet = D.DropletActions(api, droplets, id=1)
+    mock.patch.object(D.DropletActions, 'post', return_value={})
+    droplet.take_snapshot('snap', wait=False)
+    assert cache.read('images') is None
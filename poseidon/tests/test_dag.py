@@ -0,0 +1,99 @@
+import threading
+import time
+
+import pytest
+
+import poseidon.dag as D
+
+
+def sleeper(seconds, value=None):
+    def func(*args):
+        time.sleep(seconds)
+        return value if value is not None else args
+    return func
+
+
+def test_run_concurrently():
+    graph = D.Graph()
+    graph.add('droplet', sleeper(0.05, 'ip'), resource=D.API)
+    graph.add('dns', sleeper(0.3), deps=['droplet'], resource=D.API)
+    graph.add('apt', sleeper(0.1), deps=['droplet'], resource='ip')
+    graph.add('app', sleeper(0.1), deps=['apt', 'droplet'],
+              resource=lambda apt, droplet: droplet)
+    start = time.time()
+    report = graph.run()
+    # dns runs alongside apt and app instead of after them
+    assert time.time() - start < 0.45
+    assert report['app'].value == (('ip',), 'ip')
+    assert report['app'].key == 'ip'
+    assert [t.name for t in report.critical_path()] == ['droplet', 'dns']
+    assert all(t.ok and t.elapsed >= 0 for t in report.tasks)
+    text = report.format()
+    assert '* dns' in text and '  apt' in text
+    assert 'critical path droplet -> dns' in text
+
+
+def test_limits():
+    active, peak = [0], [0]
+    lock = threading.Lock()
+
+    def step(*args):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        time.sleep(0.02)
+        with lock:
+            active[0] -= 1
+
+    graph = D.Graph(host_workers=2, limits={'db': 1})
+    for i in range(6):
+        graph.add('web%d' % i, step, resource='web')
+    report = graph.run()
+    assert peak[0] == 2
+    assert max(t.waited for t in report.tasks) > 0
+
+    peak[0] = 0
+    graph = D.Graph(limits={'db': 1})
+    for i in range(3):
+        graph.add('db%d' % i, step, resource='db')
+    graph.run()
+    assert peak[0] == 1
+
+
+def test_failure_skips_dependents():
+    def fail():
+        raise ValueError('create failed')
+
+    graph = D.Graph()
+    graph.add('droplet', fail)
+    graph.add('dns', sleeper(0), deps=['droplet'])
+    graph.add('ssh', sleeper(0), deps=['dns'])
+    graph.add('key', sleeper(0, 'key'))
+    with pytest.raises(D.GraphError) as e:
+        graph.run()
+    report = e.value.report
+    assert isinstance(report['droplet'].error, ValueError)
+    assert [t.name for t in report.skipped] == ['dns', 'ssh']
+    assert report['key'].value == 'key'
+
+    report = graph.run(raise_on_error=False)
+    assert [t.name for t in report.failed] == ['droplet']
+
+
+def test_rate_limited(mock):
+    rate = mock.Mock()
+    rate.call.side_effect = lambda func, *args: func(*args)
+    graph = D.Graph(rate=rate)
+    graph.add('a', sleeper(0, 'a'), resource=D.API)
+    graph.add('b', sleeper(0, 'b'), resource='host')
+    graph.run()
+    assert rate.call.call_count == 1
+
+
+def test_add_validation():
+    graph = D.Graph()
+    graph.add('a', sleeper(0))
+    with pytest.raises(ValueError):
+        graph.add('a', sleeper(0))
+    with pytest.raises(ValueError):
+        graph.add('b', sleeper(0), deps=['c'])
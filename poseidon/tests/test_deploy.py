@@ -0,0 +1,60 @@
+import os
+import subprocess
+
+import pytest
+
+import poseidon.deploy as D
+
+
+def git(repo, *args):
+    return subprocess.check_output(
+        ('git', '-C', str(repo), '-c', 'user.name=test',
+         '-c', 'user.email=test@example.com') + args).strip()
+
+
+def commit(repo, name, data):
+    repo.join(name).write(data)
+    git(repo, 'add', name)
+    git(repo, 'commit', '-q', '-m', name)
+    return git(repo, 'rev-parse', 'HEAD')
+
+
+def test_git_deploy(tmpdir, local_client):
+    repo = tmpdir.mkdir('app')
+    git(repo, 'init', '-q')
+    data = os.urandom(10000).encode('hex')
+    first = commit(repo, 'a.txt', data)
+    remote = tmpdir.join('remote')
+    local_client.chdir(str(remote), relative=False)
+
+    result = local_client.git_deploy(str(repo))
+    assert result.revision == first and result.previous is None
+    assert remote.join('app', 'a.txt').read() == data
+    full = result.sent
+
+    result = local_client.git_deploy(str(repo))
+    assert result == (first, first, 0)
+
+    second = commit(repo, 'b.txt', 'b')
+    result = local_client.git_deploy(str(repo))
+    assert result.revision == second and result.previous == first
+    assert 0 < result.sent < full
+    assert remote.join('app', 'b.txt').read() == 'b'
+
+    # rolling back needs no bundle
+    result = local_client.git_deploy(str(repo), ref=first)
+    assert result == (first, second, 0)
+    assert not remote.join('app', 'b.txt').check()
+
+
+def test_plan(tmpdir):
+    repo = tmpdir.mkdir('app')
+    git(repo, 'init', '-q')
+    first = commit(repo, 'a.txt', 'a')
+    second = commit(repo, 'b.txt', 'b')
+    assert D.plan(str(repo), 'HEAD', None) == ('bundle', second, None)
+    assert D.plan(str(repo), 'HEAD', first) == ('bundle', second, first)
+    assert D.plan(str(repo), 'HEAD', '0' * 40) == ('bundle', second, None)
+    assert D.plan(str(repo), first, second) == ('checkout', first, None)
+    with pytest.raises(ValueError):
+        D.plan(str(repo), 'nope', None)
@@ -0,0 +1,129 @@
+import time
+
+import pytest
+from pytest_mock import mock
+
+import poseidon.ssh as S
+from poseidon.fleet import Fleet
+
+
+class FakeChannel(object):
+
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakeCommand(object):
+
+    def __init__(self, host, cmd):
+        self.host = host
+        self.cmd = cmd
+        self.read = 0
+        self.channel = FakeChannel()
+
+    def __iter__(self):
+        if self.host == 'broken':
+            raise S.CommandTimeout('timed out', None)
+        for i in range(50):
+            self.read += 1
+            yield 'stdout', '%s %d' % (self.host, i)
+
+    def wait(self, stdout=None, stderr=None):
+        if self.host == 'slow':
+            time.sleep(0.2)
+        if self.host == 'broken':
+            raise S.CommandTimeout('timed out', None)
+        stdout('%s: %s' % (self.host, self.cmd))
+        return 0 if self.host != 'bad' else 1
+
+
+@pytest.fixture
+def fleet(mock):
+    def execute(self, cmd, lines=True, timeout=None):
+        return FakeCommand(self.host, cmd)
+    mock.patch.object(S.SSHClient, 'execute', execute)
+    return Fleet(['slow', 'a', 'bad', 'broken'], workers=4,
+                 pool=S.SSHPool())
+
+
+def test_run(fleet):
+    results = list(fleet.run('uptime'))
+    assert len(results) == 4
+    # slow host comes last
+    assert results[-1].host == 'slow'
+    by_host = dict((r.host, r) for r in results)
+    assert by_host['a'].ok and by_host['a'].stdout == 'a: uptime'
+    assert by_host['bad'].exit_status == 1 and not by_host['bad'].ok
+    assert isinstance(by_host['broken'].error, S.CommandTimeout)
+    assert by_host['slow'].elapsed >= 0.2
+
+
+def test_collect(fleet):
+    results = fleet.collect('uptime')
+    assert sorted(results) == ['a', 'bad', 'broken', 'slow']
+
+
+def test_map(fleet, mock):
+    mock.patch.object(S.SSHClient, 'apt', return_value='done')
+    results = list(fleet.map('apt', 'git'))
+    assert all(r.result == 'done' for r in results)
+    S.SSHClient.apt.assert_called_with('git')
+    results = list(fleet.map(lambda ssh, x: ssh.host + x, '!'))
+    assert sorted(r.result for r in results) == [
+        'a!', 'bad!', 'broken!', 'slow!']
+
+
+def test_targets(mock):
+    ssh = S.SSHClient('localhost')
+    droplet = mock.Mock()
+    fleet = Fleet([ssh, 'example.com', droplet], pool=False)
+    assert fleet.clients[0] is ssh
+    assert fleet.clients[1].host == 'example.com'
+    assert fleet.clients[1].pool is None
+    droplet.connect.assert_called_with(pool=False)
+
+
+def test_targets_generator(mock):
+    def execute(self, cmd, lines=True, timeout=None):
+        return FakeCommand(self.host, cmd)
+    mock.patch.object(S.SSHClient, 'execute', execute)
+    fleet = Fleet((host for host in ['a', 'bad']), pool=False)
+    assert fleet.targets == ['a', 'bad']
+    assert sorted(r.target for r in fleet.run('uptime')) == ['a', 'bad']
+
+
+def test_tail(fleet):
+    logs = fleet.tail(['/var/log/a b', '/var/log/c'], lines=5, grep='err|x',
+                      maxsize=4)
+    time.sleep(0.1)
+    # readers stop once the buffer is full
+    assert sum(c.read for c in logs.commands.values()) <= 4 + 4
+    lines = list(logs)
+    logs.close()
+    assert len(lines) == 3 * 50
+    assert set(l.host for l in lines) == set(['slow', 'a', 'bad'])
+    by_host = [l.line for l in lines if l.host == 'a']
+    assert by_host == ['a %d' % i for i in range(50)]
+    assert isinstance(logs.errors['broken'], S.CommandTimeout)
+    assert logs.cmd == ("tail -n 5 -F -q '/var/log/a b' /var/log/c | "
+                        "grep --line-buffered -E 'err|x'")
+
+
+def test_tail_close(fleet):
+    with fleet.tail('/var/log/syslog', maxsize=1) as logs:
+        next(iter(logs))
+    assert all(c.channel.closed for c in logs.commands.values())
+
+
+def test_wait_ready(fleet, mock):
+    def wait_ready(self, timeout=300):
+        if self.host == 'broken':
+            raise ValueError('not ready')
+        return self
+    mock.patch.object(S.SSHClient, 'wait_ready', wait_ready)
+    results = dict((r.host, r) for r in fleet.wait_ready(timeout=1))
+    assert sorted(h for h, r in results.items() if r.ok) == [
+        'a', 'bad', 'slow']
+    assert isinstance(results['broken'].error, ValueError)
@@ -0,0 +1,99 @@
+import pytest
+from pytest_mock import mock
+
+import poseidon.api as P
+from poseidon.inventory import Inventory
+
+
+DROPLET = {'id': 1, 'name': 'web-1', 'status': 'active',
+           'region': {'slug': 'sfo1'}}
+IMAGE = {'id': 10, 'name': 'ubuntu', 'distribution': 'Ubuntu'}
+DOMAIN = {'name': 'example.com', 'ttl': 1800}
+RECORD = {'id': 100, 'type': 'A', 'name': '@', 'data': '127.0.0.1'}
+
+
+class FakeClient(object):
+
+    def __init__(self, mock):
+        self.api = P.DigitalOceanAPI(api_key='foo')
+        self.actions = mock.Mock()
+        self.actions.list.return_value = [
+            {'id': 5, 'status': 'completed'}]
+        self.droplets = mock.Mock()
+        self.droplets.iterate.return_value = iter([DROPLET])
+        self.images = mock.Mock()
+        self.images.iterate.return_value = iter([IMAGE])
+        self.domains = mock.Mock()
+        self.domains.iterate.return_value = iter([DOMAIN])
+
+
+@pytest.fixture
+def inventory(mock):
+    mock.patch.object(P.DomainRecords, 'iterate',
+                      side_effect=lambda: iter([RECORD]))
+    inv = Inventory(FakeClient(mock), path=':memory:')
+    inv.sync()
+    return inv
+
+
+def test_full_sync(inventory):
+    assert inventory.droplets() == [DROPLET]
+    assert inventory.images(type='Ubuntu') == [IMAGE]
+    assert inventory.domains() == [DOMAIN]
+    assert inventory.records('example.com') == [RECORD]
+    assert inventory._meta('last_action_id') == '5'
+
+
+def test_query(inventory):
+    assert inventory.droplets(region='sfo1', status='active') == [DROPLET]
+    assert inventory.droplets(status='off') == []
+    assert inventory.get('droplets', 1) == DROPLET
+    assert inventory.count('records') == 1
+    with pytest.raises(ValueError):
+        inventory.droplets(size='512mb')
+    with pytest.raises(ValueError):
+        inventory.query('volumes')
+
+
+def test_incremental_sync(inventory):
+    client = inventory.client
+    off = dict(DROPLET, status='off')
+    client.actions.iterate.return_value = iter([
+        {'id': 7, 'status': 'in-progress', 'resource_type': 'droplet',
+         'resource_id': 1, 'type': 'power_off'},
+        {'id': 6, 'status': 'completed', 'resource_type': 'droplet',
+         'resource_id': 2, 'type': 'destroy'},
+        {'id': 5, 'status': 'completed', 'resource_type': 'droplet',
+         'resource_id': 3, 'type': 'create'}])
+
+    def info(id):
+        if id == 1:
+            return off
+        raise P.APIError('not found', 404)
+    client.droplets._get_droplet_info.side_effect = info
+
+    touched = inventory.sync()
+    assert touched == set([('droplet', 1), ('droplet', 2)])
+    assert inventory.droplets(status='off') == [off]
+    assert inventory._meta('last_action_id') == '7'
+    assert inventory._meta('pending_actions') == '[7]'
+    assert not client.droplets.iterate.call_count > 1
+
+    # pending action is rechecked on the next sync
+    client.actions.iterate.return_value = iter([
+        {'id': 7, 'status': 'in-progress'}])
+    client.actions.get.return_value = {
+        'id': 7, 'status': 'completed', 'resource_type': 'droplet',
+        'resource_id': 1}
+    assert inventory.sync() == set([('droplet', 1)])
+    assert inventory._meta('pending_actions') == '[]'
+
+
+def test_deleted_droplet(inventory):
+    client = inventory.client
+    client.actions.iterate.return_value = iter([
+        {'id': 6, 'status': 'completed', 'resource_type': 'droplet',
+         'resource_id': 1, 'type': 'destroy'}])
+    client.droplets._get_droplet_info.side_effect = P.APIError('gone', 404)
+    inventory.sync()
+    assert inventory.droplets() == []
@@ -0,0 +1,38 @@
+import numpy as np
+
+from poseidon.metrics import FIELDS, RingBuffer, MetricsSampler
+
+LINES = [
+    '100.0 80 20 800 0 900 1000 600 0 0 1000 500',
+    '101.0 120 30 850 50 1050 1000 500 8 2 3000 500',
+    '103.0 120 30 850 50 1050 1000 500 8 2 7000 900',
+    'garbage',
+]
+
+
+def test_ring_buffer():
+    buf = RingBuffer(3, fields=('a', 'b'))
+    for i in range(5):
+        buf.append([i, -i])
+    assert len(buf) == 3
+    assert buf.column('a').tolist() == [2, 3, 4]
+    assert buf.values().shape == (3, 2)
+
+
+def test_rates():
+    sampler = MetricsSampler(None, size=10)
+    for line in LINES:
+        sampler.feed(line)
+    assert len(sampler) == 3
+    assert sampler.samples().shape == (3, len(FIELDS))
+    rates = sampler.rates()
+    assert rates['cpu_percent'][0] == 100. * 50 / 150
+    assert rates['iowait_percent'][0] == 100. * 50 / 150
+    assert np.isnan(rates['cpu_percent'][1])
+    assert rates['disk_read'].tolist() == [8 * 512, 0]
+    assert rates['net_rx'].tolist() == [2000, 2000]
+    assert rates['net_tx'].tolist() == [0, 200]
+    assert rates['mem_percent'].tolist() == [50, 50]
+    assert sampler.percentile('net_tx', 50) == 100
+    assert sampler.percentile('cpu_percent', 50) == 100. * 50 / 150
+    assert sampler.latest()['net_tx'] == 200
@@ -0,0 +1,112 @@
+import threading
+import time
+
+import pytest
+
+from poseidon.parallel import RateLimiter, imap_unordered, pipeline
+
+
+def test_imap_unordered():
+    results = sorted(imap_unordered(lambda x: x * 2, range(100), workers=4))
+    assert results == [(i, i * 2, None) for i in range(100)]
+
+
+def test_imap_unordered_errors():
+    def func(x):
+        if x == 3:
+            raise ValueError(x)
+        return x
+    results = list(imap_unordered(func, range(5), workers=2))
+    errors = [r for r in results if r[2] is not None]
+    assert len(results) == 5
+    assert len(errors) == 1 and errors[0][0] == 3
+
+
+def test_imap_unordered_lazy():
+    consumed = []
+
+    def items():
+        for i in range(1000):
+            consumed.append(i)
+            yield i
+    gen = imap_unordered(lambda x: x, items(), workers=2)
+    next(gen)
+    time.sleep(0.1)
+    assert len(consumed) < 20
+    gen.close()
+
+
+def test_imap_unordered_bad_items():
+    def items():
+        yield 1
+        raise IOError('bad input')
+    with pytest.raises(IOError):
+        list(imap_unordered(lambda x: x, items()))
+
+
+def test_rate_limiter():
+    limiter = RateLimiter(rate=100, burst=1)
+    start = time.time()
+    for _ in range(6):
+        limiter.acquire()
+    assert time.time() - start >= 0.04
+
+
+def test_rate_limiter_retries(mock):
+    mock.patch('poseidon.parallel.time.sleep')
+    calls = []
+
+    class TooMany(Exception):
+        status_code = 429
+
+    def func():
+        calls.append(1)
+        if len(calls) < 3:
+            raise TooMany()
+        return 'ok'
+    assert RateLimiter(1000, 1000).call(func) == 'ok'
+    assert len(calls) == 3
+
+
+def test_pipeline():
+    def slow_first(x):
+        if x == 0:
+            time.sleep(0.3)
+        return x + 1
+
+    def second(x):
+        if x == 3:
+            raise ValueError(x)
+        return x * 10
+
+    jobs = list(pipeline(range(5), [('first', slow_first, 2),
+                                    ('second', second, 1)]))
+    assert len(jobs) == 5
+    # the slow item does not hold up the others
+    assert jobs[-1].item == 0 and jobs[-1].value == 10
+    by_item = dict((j.item, j) for j in jobs)
+    assert by_item[4].value == 50 and by_item[4].ok
+    assert isinstance(by_item[2].error, ValueError)
+    assert by_item[2].stage == 'second' and by_item[2].value == 3
+    assert sorted(by_item[0].timings) == ['first', 'second']
+    assert by_item[0].timings['first'] >= 0.3
+
+
+def test_pipeline_limits():
+    running, peak = [0], [0]
+    lock = threading.Lock()
+
+    def stage(x):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.02)
+        with lock:
+            running[0] -= 1
+        return x
+
+    jobs = list(pipeline(range(20), [('a', lambda x: x, 8),
+                                     ('b', stage, 3)]))
+    assert sorted(j.value for j in jobs) == list(range(20))
+    assert peak[0] <= 3
+    assert list(pipeline([], [('a', stage, 2)])) == []
@@ -0,0 +1,25 @@
+from poseidon.process import (
+    PS_FIELDS, TOP_FIELDS, ProcessTable, ps_command)
+
+PS_OUTPUT = """\
+    1     0 root             0.0  0.1  11520   22184     8321 Ss   /sbin/init splash
+  412     1 www-data        12.5  2.0 204800 1048576      120 Sl   python app.py --port 8000
+  977   412 www-data         0.0  0.0      0       0        3 Z
+"""
+
+
+def test_ps_command():
+    assert ps_command(TOP_FIELDS) == 'ps -Ao pid=,user:64=,pcpu=,pmem=,comm='
+
+
+def test_parse():
+    table = ProcessTable.parse(PS_OUTPUT)
+    assert len(table) == 3
+    assert list(table['pid']) == [1, 412, 977]
+    assert list(table['pcpu']) == [0.0, 12.5, 0.0]
+    assert table['args'] == ['/sbin/init splash',
+                             'python app.py --port 8000', '']
+    row = list(table)[1]
+    assert row['user'] == 'www-data'
+    assert row['etimes'] == 120
+    assert set(row) == set(name for name, _ in PS_FIELDS)
@@ -0,0 +1,70 @@
+import pytest
+
+import poseidon.provision as P
+import poseidon.ssh as S
+
+
+class FakeDroplet(object):
+
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+        self.status = 'new'
+        self.polls = 2 if name == 'slow' else 0
+
+    def refresh(self):
+        if self.polls:
+            self.polls -= 1
+        else:
+            self.status = 'active'
+
+    @property
+    def ip_address(self):
+        return '10.0.0.%d' % self.id
+
+    def connect(self, pool=True):
+        return S.SSHClient(self.ip_address, pool=pool or None)
+
+
+class FakeDroplets(object):
+
+    def __init__(self):
+        self.created = []
+
+    def create(self, name, region, size, image, wait=True):
+        assert not wait
+        if name == 'bad':
+            raise ValueError('invalid size')
+        droplet = FakeDroplet(len(self.created) + 1, name)
+        self.created.append(droplet)
+        return droplet
+
+
+def test_provision(mock):
+    mock.patch.object(P.time, 'sleep')
+    mock.patch.object(S.SSHClient, 'wait_ready',
+                      lambda self, timeout: self)
+    droplets = FakeDroplets()
+    specs = [dict(name=name, region='nyc3', size='512mb', image='ubuntu')
+             for name in ('slow', 'a', 'bad', 'b')]
+    jobs = list(P.provision(droplets, specs,
+                            setup=lambda ssh, d: '%s@%s' % (d.name, ssh.host),
+                            pool=False))
+    assert len(jobs) == 4
+    by_name = dict((j.value.spec['name'], j) for j in jobs)
+    assert by_name['a'].ok and by_name['a'].stage == 'setup'
+    assert by_name['a'].value.result == 'a@%s' % by_name['a'].value.ssh.host
+    assert by_name['bad'].stage == 'create'
+    assert isinstance(by_name['bad'].error, ValueError)
+    assert by_name['slow'].value.droplet.status == 'active'
+    assert sorted(by_name['slow'].timings) == [
+        'active', 'create', 'setup', 'ssh']
+    assert len(droplets.created) == 3
+
+
+def test_wait_active_timeout(mock):
+    mock.patch.object(P.time, 'sleep')
+    droplet = FakeDroplet(1, 'slow')
+    droplet.polls = 10 ** 6
+    with pytest.raises(ValueError):
+        P.wait_active(droplet, timeout=-1)
@@ -0,0 +1,124 @@
+import os
+import shutil
+import subprocess
+import time
+
+import pytest
+
+import poseidon.relay as R
+import poseidon.ssh as S
+from poseidon.fleet import Fleet
+
+
+class LocalHost(object):
+    """
+    SSHClient stand-in running commands in its own local directory
+    """
+
+    def __init__(self, root, name, command):
+        self.host = name
+        self.command = command
+        self.private_ip = '127.0.0.1'
+        self.root = str(root.mkdir(name))
+        self.pwd = ''
+        self.transport = self
+        self.commands = []
+
+    def execute(self, cmd, lines=True, timeout=None):
+        self.commands.append(cmd)
+        return self.command(cmd, cwd=self.root)
+
+    def wait(self, cmd):
+        return subprocess.check_output(cmd, shell=True, cwd=self.root)
+
+
+class FakeTransfer(object):
+
+    def __init__(self, host):
+        self.host = host
+
+    def put(self, local_path, remote_path):
+        shutil.copy(local_path, os.path.join(self.host.root, remote_path))
+
+
+@pytest.fixture
+def hosts(tmpdir, mock, local_command):
+    mock.patch.object(R, 'Transfer', FakeTransfer)
+    mock.patch.object(Fleet, '_client', lambda self, target: target)
+    return [LocalHost(tmpdir, 'host%d' % i, local_command)
+            for i in range(7)]
+
+
+def test_distribute(tmpdir, hosts):
+    src = tmpdir.join('artifact.bin')
+    data = os.urandom(300000)
+    src.write(data, 'wb')
+    fleet = Fleet(hosts)
+    results = fleet.distribute(str(src), 'artifact.bin', seeds=2)
+
+    assert sorted(results) == sorted(h.host for h in hosts)
+    assert all(r.ok for r in results.values())
+    for host in hosts:
+        with open(os.path.join(host.root, 'artifact.bin'), 'rb') as fp:
+            assert fp.read() == data
+    sources = [r.result for r in results.values()]
+    assert sources.count('controller') <= 2
+    assert len([s for s in sources if s != 'controller']) >= 5
+
+
+class BrokenSender(LocalHost):
+    """
+    Host whose forwards always fail
+    """
+
+    def execute(self, cmd, lines=True, timeout=None):
+        if cmd.startswith('bash -c'):
+            self.commands.append(cmd)
+            return self.command('exit 1', cwd=self.root)
+        return super(BrokenSender, self).execute(cmd, lines, timeout)
+
+
+def test_failed_holder_retires(tmpdir, hosts, local_command):
+    src = tmpdir.join('artifact.bin')
+    src.write('payload')
+    broken = BrokenSender(tmpdir, 'broken', local_command)
+    relay = R.Relay([broken] + hosts[:4], ['127.0.0.1'] * 5, seeds=1,
+                    retries=2)
+    results = relay.run(str(src), 'dist/artifact.bin')
+    assert all(r.ok for r in results.values())
+    # the broken host forwarded at most once before its target moved on
+    assert len(broken.commands) <= 1
+    for host in hosts[:4]:
+        with open(os.path.join(host.root, 'dist', 'artifact.bin')) as fp:
+            assert fp.read() == 'payload'
+
+
+def test_total_timeout(tmpdir, hosts, mock):
+    src = tmpdir.join('artifact.bin')
+    src.write('payload')
+    mock.patch.object(FakeTransfer, 'put',
+                      lambda self, local_path, remote_path: time.sleep(1))
+    relay = R.Relay(hosts[:3], ['127.0.0.1'] * 3, seeds=1)
+    start = time.time()
+    results = relay.run(str(src), 'artifact.bin', total_timeout=0.1)
+    assert time.time() - start < 1
+    assert all(isinstance(r.error, S.CommandTimeout)
+               for r in results.values())
+
+
+def test_checksum_mismatch(tmpdir, hosts, mock):
+    src = tmpdir.join('artifact.bin')
+    src.write('payload')
+    mock.patch.object(R, 'file_sha256', return_value='0' * 64)
+    relay = R.Relay(hosts[:3], ['127.0.0.1'] * 3, seeds=1, retries=0)
+    results = relay.run(str(src), 'artifact.bin')
+    assert all(not r.ok for r in results.values())
+    assert 'checksum mismatch' in str(results['host0'].error)
+
+
+def test_private_address(mock):
+    class Droplet(object):
+        private_ip = '10.0.0.5'
+    client = mock.Mock(host='1.2.3.4')
+    assert R.private_address(Droplet(), client) == '10.0.0.5'
+    assert R.private_address('1.2.3.4', client) == '1.2.3.4'
@@ -1,5 +1,8 @@
 import os
+import re
 import time
+from cStringIO import StringIO
+
 import pytest
 from pytest_mock import mock
 
@@ -129,6 +132,120 @@ def test_auth(pair):
     assert client._con is None
 
 
+def test_pool(pair):
+    client, server = pair
+    pool = S.SSHPool()
+    client.pool = pool
+    con = client.con
+    assert isinstance(con, paramiko.SSHClient)
+    assert con.get_transport().is_active()
+
+    other = S.SSHClient(server.addr, port=server.port, username='slowdive',
+                        password='pygmalion', pool=pool)
+    assert other.con is con
+    assert len(pool) == 1
+    assert pool._entry(server.addr, server.port, 'slowdive').users == 2
+
+    client.close()
+    assert con.get_transport().is_active()
+    pool.idle_timeout = 0
+    assert pool.evict_idle() == []
+    other.close()
+    assert pool.evict_idle() == [(server.addr, server.port, 'slowdive')]
+    assert len(pool) == 0
+
+
+def test_pool_reconnect(mock):
+    dead, live = mock.Mock(), mock.Mock()
+    dead.get_transport.return_value.is_active.return_value = False
+    mock.patch.object(S, '_open_connection', side_effect=[dead, live])
+    pool = S.SSHPool()
+    assert pool.get('localhost') is dead
+    assert pool.get('localhost') is live
+    assert dead.close.called
+    live.get_transport.return_value.set_keepalive.assert_called_with(
+        pool.keepalive)
+
+
+def test_pool_evict_idle_leased(mock):
+    con = mock.Mock()
+    mock.patch.object(S, '_open_connection', return_value=con)
+    pool = S.SSHPool()
+    pool.idle_timeout = 0
+    pool.get('localhost', lease=True)
+    assert pool.evict_idle() == []
+    assert not con.close.called
+    pool.release('localhost')
+    assert pool.evict_idle() == [('localhost', 22, 'root')]
+    assert con.close.called
+
+
+def test_pool_get_evicted_entry(mock):
+    con = mock.Mock()
+    mock.patch.object(S, '_open_connection', return_value=con)
+    pool = S.SSHPool()
+    # evicted by another thread between the lookup and taking its lock
+    stale = S._PoolEntry()
+    stale.evicted = True
+    lookup, entries = pool._entry, [stale]
+    mock.patch.object(pool, '_entry', side_effect=lambda *args: (
+        entries.pop() if entries else lookup(*args)))
+    assert pool.get('localhost', lease=True) is con
+    assert stale.con is None and stale.users == 0
+    assert lookup('localhost', None, 'root').users == 1
+
+
+def test_open_connection_closed_on_failure(mock):
+    con = mock.Mock()
+    con.connect.side_effect = paramiko.AuthenticationException('denied')
+    mock.patch.object(S.paramiko, 'SSHClient', return_value=con)
+    with pytest.raises(paramiko.AuthenticationException):
+        S._open_connection('localhost', username='root', timeout=1)
+    assert con.close.called
+
+
+def serve_banner(banner):
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+
+    def serve():
+        conn = listener.accept()[0]
+        conn.sendall(banner)
+        conn.close()
+        listener.close()
+    thread = threading.Thread(target=serve)
+    thread.daemon = True
+    thread.start()
+    return listener.getsockname()[1]
+
+
+def test_probe():
+    assert S.probe('127.0.0.1', serve_banner('SSH-2.0-OpenSSH_7.4\r\n'))
+    assert not S.probe('127.0.0.1', serve_banner('HTTP/1.1 400\r\n'))
+    port = serve_banner('')
+    time.sleep(0.1)
+    assert not S.probe('127.0.0.1', port, timeout=0.5)
+
+
+def test_wait_ready(mock):
+    con = mock.Mock()
+    mock.patch.object(S, 'probe', side_effect=[False, True, True])
+    mock.patch.object(S, '_open_connection',
+                      side_effect=[paramiko.AuthenticationException(), con])
+    mock.patch.object(S.time, 'sleep')
+    client = S.SSHClient('localhost')
+    assert client.wait_ready(timeout=60, probe_timeout=1) is client
+    assert client._con is con
+    assert S.time.sleep.call_count == 2
+    assert S._open_connection.call_args[0][-1] == 1
+    assert client.timeout is None
+
+    mock.patch.object(S, 'probe', return_value=False)
+    with pytest.raises(ValueError):
+        S.SSHClient('localhost').wait_ready(timeout=0)
+
+
 def test_exec_command(client, mock):
     def my_mock(*args):
         return None, None, None
@@ -147,6 +264,233 @@ def test_exec_command(client, mock):
 #     assert output == 'ok'
 
 
+class FakeChannel(object):
+    """
+    Replays stdout/stderr chunks in order then reports the exit status
+    """
+
+    def __init__(self, chunks, status=0):
+        self.chunks = list(chunks)
+        self.status = status
+        self.sent = []
+        self.closed = False
+
+    def recv_ready(self):
+        return bool(self.chunks) and self.chunks[0][0] == 'stdout'
+
+    def recv_stderr_ready(self):
+        return bool(self.chunks) and self.chunks[0][0] == 'stderr'
+
+    def recv(self, n):
+        return self.chunks.pop(0)[1]
+
+    recv_stderr = recv
+
+    def exit_status_ready(self):
+        return not self.chunks
+
+    def recv_exit_status(self):
+        return self.status
+
+    def sendall(self, data):
+        self.sent.append(data)
+
+    def close(self):
+        self.closed = True
+
+
+def fake_exec(mock, chunks, status=0):
+    channel = FakeChannel(chunks, status)
+    stdout = mock.Mock(channel=channel)
+    mock.patch.object(S.SSHClient, 'exec_command',
+                      return_value=(None, stdout, None))
+    return channel
+
+
+def test_execute_lines(client, mock):
+    fake_exec(mock, [('stdout', 'a\nb'), ('stderr', 'oops\n'),
+                     ('stdout', 'c\n\xc3'), ('stdout', '\xa9')], status=3)
+    cmd = client.execute('foo')
+    assert list(cmd) == [('stdout', u'a'), ('stderr', u'oops'),
+                         ('stdout', u'bc'), ('stdout', u'\xe9')]
+    assert cmd.exit_status == 3
+
+
+def test_execute_chunks(client, mock):
+    fake_exec(mock, [('stdout', 'a\nb'), ('stderr', 'oops')])
+    cmd = client.execute('foo', lines=False)
+    assert list(cmd) == [('stdout', 'a\nb'), ('stderr', 'oops')]
+
+
+class LateChannel(FakeChannel):
+    """
+    Output and the exit status arrive together right after stdout was
+    found empty
+    """
+
+    def __init__(self):
+        super(LateChannel, self).__init__([])
+        self.arrived = False
+
+    def recv_stderr_ready(self):
+        if not self.arrived:
+            self.arrived = True
+            self.chunks.append(('stdout', 'late'))
+        return super(LateChannel, self).recv_stderr_ready()
+
+    def exit_status_ready(self):
+        return self.arrived
+
+
+def test_execute_output_with_exit_status(client, mock):
+    mock.patch.object(S.select, 'select')
+    channel = LateChannel()
+    mock.patch.object(S.SSHClient, 'exec_command',
+                      return_value=(None, mock.Mock(channel=channel), None))
+    assert list(client.execute('foo', lines=False)) == [('stdout', 'late')]
+
+
+def test_run(client, mock):
+    fake_exec(mock, [('stdout', 'x' * 10), ('stderr', 'warning'),
+                     ('stdout', 'y')], status=0)
+    sink = StringIO()
+    assert client.run('foo', stdout=sink) == 0
+    assert sink.getvalue() == 'x' * 10 + 'y'
+
+    fake_exec(mock, [('stderr', 'fail')], status=2)
+    with pytest.raises(S.CommandError) as e:
+        client.run('foo')
+    assert e.value.exit_status == 2
+    assert client.run('foo', raise_on_error=False) == 2
+
+
+def test_multiplex(client, mock):
+    channels = {
+        'apt': FakeChannel([('stdout', 'installing\n'), ('stdout', 'done')]),
+        'git': FakeChannel([('stderr', 'fatal\n')], status=128)}
+
+    def execute(self, cmd, lines=True, timeout=None):
+        return S.RemoteCommand(channels[cmd], lines=lines)
+    mock.patch.object(S.SSHClient, 'execute', execute)
+
+    group = client.multiplex({'apt': 'apt', 'git': 'git'})
+    events = list(group)
+    assert [e for e in events if e[0] == 'apt'] == [
+        ('apt', 'stdout', u'installing'), ('apt', 'stdout', u'done')]
+    assert [e for e in events if e[0] == 'git'] == [
+        ('git', 'stderr', u'fatal')]
+    assert group.exit_statuses == {'apt': 0, 'git': 128}
+
+    channels = [FakeChannel([('stdout', 'a')]), FakeChannel([], status=1)]
+    mock.patch.object(S.SSHClient, 'execute',
+                      lambda self, cmd, lines=True: S.RemoteCommand(
+                          channels[int(cmd)], lines=lines))
+    assert client.multiplex(['0', '1']).wait() == {
+        0: (0, 'a', ''), 1: (1, '', '')}
+
+
+class EndlessChannel(FakeChannel):
+    """
+    A command like yes that always has output ready
+    """
+
+    def __init__(self):
+        super(EndlessChannel, self).__init__([])
+
+    def recv_ready(self):
+        return not self.closed
+
+    def recv(self, n):
+        return 'y\n'
+
+    def exit_status_ready(self):
+        return False
+
+
+def test_timeout_with_endless_output():
+    command = S.RemoteCommand(EndlessChannel(), lines=False, timeout=0.05)
+    with pytest.raises(S.CommandTimeout):
+        for _ in command:
+            pass
+    assert command.channel.closed
+
+    endless, quiet = EndlessChannel(), FakeChannel([('stdout', 'ok')])
+    group = S.CommandGroup({'yes': S.RemoteCommand(endless),
+                            'ok': S.RemoteCommand(quiet)}, timeout=0.05)
+    with pytest.raises(S.CommandTimeout):
+        group.wait()
+    assert endless.closed
+
+
+class FakeShellChannel(FakeChannel):
+    """
+    Answers every framed command sent to the session with canned output
+    """
+
+    def __init__(self, outputs):
+        super(FakeShellChannel, self).__init__([])
+        self.outputs = outputs
+        self.exited = False
+
+    def exec_command(self, cmd):
+        self.shell = cmd
+
+    def sendall(self, data):
+        self.sent.append(data)
+        marker = re.search(r'(__poseidon_\w+)', data).group(1)
+        out, err, status = self.outputs.pop(0)
+        self.chunks.append(('stdout', '%s\n%s %d\n' % (out, marker, status)))
+        self.chunks.append(('stderr', '%s\n%s\n' % (err, marker)))
+
+    def exit_status_ready(self):
+        return self.exited
+
+    def close(self):
+        self.exited = True
+
+
+def test_session(client, mock):
+    channel = FakeShellChannel([('', '', 0), ('/srv\n', '', 0),
+                                ('', 'no such file', 1)])
+    transport = mock.Mock()
+    transport.open_session.return_value = channel
+    mock.patch.object(S.SSHClient, 'transport', transport)
+
+    with client.session() as sh:
+        assert channel.sent[0].startswith('{ cd ~\n} < /dev/null\n')
+        assert sh.wait('pwd') == '/srv\n'
+        with pytest.raises(S.CommandError) as e:
+            sh.run('cat foo')
+        assert e.value.exit_status == 1
+        assert e.value.stderr == 'no such file'
+    assert sh.channel is None
+    with pytest.raises(ValueError):
+        sh.run('ls')
+
+
+def test_session_sudo_not_echoed(mock, capsys):
+    client = S.SSHClient('localhost', username='foo', password='secret',
+                         interactive=True)
+    channel = FakeShellChannel([('', '', 0), ('', '', 0), ('', '', 0)])
+    transport = mock.Mock()
+    transport.open_session.return_value = channel
+    mock.patch.object(S.SSHClient, 'transport', transport)
+
+    with client.session() as sh:
+        sh.sudo()
+        assert sh.depth == 1
+        assert 'secret' in channel.sent[1]
+    assert 'secret' not in capsys.readouterr().out
+
+
+def test_wait(client, mock):
+    fake_exec(mock, [('stdout', 'ok'), ('stdout', '!')])
+    assert client.wait('yes') == 'ok!'
+    fake_exec(mock, [('stdout', 'ok'), ('stderr', 'bad')])
+    with pytest.raises(ValueError):
+        client.wait('yes')
+
+
 def test_nohup(client, mock):
     mock.patch.object(S.SSHClient, 'exec_command')
     client.nohup('foo')
@@ -194,6 +538,46 @@ def test_pip_r(client, mock):
                                    raise_on_error=True)
 
 
+DPKG = ("git\t1:1.9.1-1\tinstall ok installed\n"
+        "nginx\t1.4.6\tdeinstall ok config-files\n"
+        "python-pip\t1.5.4\tinstall ok installed\n")
+
+FREEZE = ("Flask==0.10.1\nrequests==2.3.0\n-e git+https://x/y.git#egg=y\n"
+          "zope.interface==4.1.1\n")
+
+
+def test_ensure_apt(client, mock):
+    mock.patch.object(S.SSHClient, 'wait', return_value=DPKG)
+    assert client.ensure_apt('git python-pip') == []
+    assert client.ensure_apt(['git=1:1.9.1-1', 'nginx']) == ['nginx']
+    # dpkg-query ran once, then the install
+    assert S.SSHClient.wait.call_count == 2
+    client.wait.assert_called_with('apt-get install -y nginx',
+                                   raise_on_error=False)
+    assert 'apt' not in client._packages
+
+
+def test_ensure_pip(client, mock):
+    mock.patch.object(S.SSHClient, 'wait', return_value=FREEZE)
+    assert client.ensure_pip(['flask', 'Zope_Interface>=4.0,<5']) == []
+    assert client.ensure_pip(['requests>=2.4', 'flask~=0.10']) == [
+        'requests>=2.4']
+    client.wait.assert_called_with("pip install -U 'requests>=2.4'",
+                                   raise_on_error=True)
+    assert S.SSHClient.wait.call_count == 2
+    client.pip_packages()
+    assert S.SSHClient.wait.call_count == 3
+
+
+def test_requirement_satisfied():
+    installed = S.parse_pip_freeze(FREEZE)
+    assert installed['zope-interface'] == '4.1.1'
+    assert S.requirement_satisfied('flask[async]==0.10.1', installed)
+    assert not S.requirement_satisfied('flask!=0.10.1', installed)
+    assert not S.requirement_satisfied('flask~=0.9.0', installed)
+    assert not S.requirement_satisfied('pandas', installed)
+
+
 def test_ps(client, mock):
     mock.patch.object(S.SSHClient, 'wait')
     client.ps()
@@ -204,3 +588,54 @@ def test_top(client, mock):
     mock.patch.object(S.SSHClient, 'ps')
     client.top()
     client.ps.assert_called_with('o', S.TOP_OPTIONS)
+
+
+def test_processes(client, mock):
+    fake_exec(mock, [('stdout', '  1  0 root 0.5 0.1 100 200 30 Ss init\n')])
+    table = client.processes()
+    assert list(table['pid']) == [1]
+    assert table['args'] == ['init']
+
+
+def test_top_samples(client, mock):
+    fake_exec(mock, [('stdout', '1 root 0.0 0.1 init\n'
+                                '__poseidon_sample\n'
+                                '1 root 0.0 0.1 init\n2 bob 9.5 1.0 vim\n'
+                                '__poseidon_sample\n')])
+    tables = client.top(samples=2, interval=0.5)
+    assert [len(t) for t in tables] == [1, 2]
+    assert list(tables[1]['pcpu']) == [0.0, 9.5]
+    cmd = S.SSHClient.exec_command.call_args[0][0]
+    assert 'seq 2' in cmd and 'sleep 0.5' in cmd
+
+
+def test_sampler(client, mock):
+    fake_exec(mock, [('stdout', '1.0 1 1 1 0 3 10 5 0 0 0 0\n'
+                                '2.0 2 1 1 0 4 10 5 0 0 100 0\n')])
+    sampler = client.sampler(interval=0.5, size=5)
+    sampler._thread.join()
+    sampler.stop()
+    assert len(sampler) == 2
+    assert sampler.rates()['net_rx'].tolist() == [100]
+    cmd = S.SSHClient.exec_command.call_args[0][0]
+    assert '/proc/net/dev' in cmd and 'sleep 0.5' in cmd
+
+
+class OpenChannel(EndlessChannel):
+    """
+    A command like yes that runs until its channel is closed
+    """
+
+    def exit_status_ready(self):
+        return self.closed
+
+
+def test_sampler_with(client, mock):
+    channel = OpenChannel()
+    mock.patch.object(S.SSHClient, 'execute',
+                      return_value=S.RemoteCommand(channel))
+    with client.sampler(interval=0.5) as sampler:
+        assert sampler._thread.is_alive()
+    assert S.SSHClient.execute.call_count == 1
+    assert channel.closed
+    assert sampler._thread is None
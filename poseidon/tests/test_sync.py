@@ -0,0 +1,58 @@
+import json
+
+import pytest
+
+import poseidon.ssh as S
+import poseidon.sync as sync
+
+
+def test_build_manifest(tmpdir):
+    tmpdir.join('a.txt').write('a')
+    tmpdir.join('a.pyc').write('a')
+    tmpdir.mkdir('.git').join('HEAD').write('x')
+    tmpdir.mkdir('sub').join('b').write('b')
+    manifest = sync.build_manifest(str(tmpdir))
+    assert sorted(manifest) == ['a.txt', 'sub/b']
+    assert manifest['sub/b'][0] == sync.file_digest(str(tmpdir.join('sub/b')))
+
+
+def test_sync(tmpdir, local_client):
+    src = tmpdir.mkdir('src')
+    src.join('x.txt').write('x')
+    src.mkdir('a').mkdir('b').join('y.txt').write('y')
+    dst = tmpdir.join('dst')
+
+    result = local_client.sync(str(src), str(dst))
+    assert result.uploaded == ['a/b/y.txt', 'x.txt']
+    assert dst.join('a/b/y.txt').read() == 'y'
+    manifest = json.loads(dst.join(sync.MANIFEST).read())
+    assert sorted(manifest) == ['a/b/y.txt', 'x.txt']
+
+    result = local_client.sync(str(src), str(dst))
+    assert result == ([], [], ['a/b/y.txt', 'x.txt'])
+    assert S.SSHClient.execute.call_count == 2
+
+    src.join('x.txt').remove()
+    src.join('a/b/y.txt').write('changed')
+    result = local_client.sync(str(src), str(dst), dry_run=True)
+    assert result == (['a/b/y.txt'], ['x.txt'], [])
+    assert dst.join('x.txt').check()
+
+    result = local_client.sync(str(src), str(dst), delete=False,
+                               compress=False)
+    assert result == (['a/b/y.txt'], [], [])
+    assert dst.join('x.txt').check()
+    assert dst.join('a/b/y.txt').read() == 'changed'
+
+    result = local_client.sync(str(src), str(dst))
+    assert result == ([], ['x.txt'], ['a/b/y.txt'])
+    assert not dst.join('x.txt').check()
+    assert not dst.join(sync.DELETIONS).check()
+
+
+def test_sync_error(tmpdir, local_client):
+    src = tmpdir.mkdir('src')
+    dst = tmpdir.join('dst')
+    dst.write('not a directory')
+    with pytest.raises(S.CommandError):
+        local_client.sync(str(src), str(dst))
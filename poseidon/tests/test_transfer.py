@@ -0,0 +1,100 @@
+import os
+import stat
+
+import pytest
+
+import poseidon.transfer as T
+
+
+class FakeFile(object):
+
+    def __init__(self, path, mode):
+        self.fp = open(path, mode)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.fp.close()
+
+    def set_pipelined(self, pipelined):
+        self.pipelined = pipelined
+
+    def readv(self, chunks):
+        for offset, size in chunks:
+            self.fp.seek(offset)
+            yield self.fp.read(size)
+
+    def __getattr__(self, name):
+        return getattr(self.fp, name)
+
+
+class FakeSFTP(object):
+    """
+    Serves paths relative to a local directory
+    """
+    opened = 0
+
+    def __init__(self, root):
+        self.root = root
+        FakeSFTP.opened += 1
+
+    def _path(self, path):
+        return os.path.join(self.root, path)
+
+    def open(self, path, mode):
+        return FakeFile(self._path(path), mode)
+
+    def stat(self, path):
+        return os.stat(self._path(path))
+
+    def chmod(self, path, mode):
+        os.chmod(self._path(path), mode)
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def remote(tmpdir, mock):
+    root = tmpdir.mkdir('remote')
+    FakeSFTP.opened = 0
+    mock.patch.object(T, 'open_sftp', lambda *a: FakeSFTP(str(root)))
+    return root
+
+
+def test_split():
+    assert T.split(100, 4) == [(0, 100)]
+    block = T.BLOCK_SIZE
+    parts = T.split(10 * block + 1, 4, threshold=0)
+    assert parts == [(0, 3 * block), (3 * block, 3 * block),
+                     (6 * block, 3 * block), (9 * block, block + 1)]
+
+
+@pytest.mark.parametrize('threshold', [T.PART_THRESHOLD, 0])
+def test_put_get(tmpdir, remote, threshold):
+    data = os.urandom(5 * T.BLOCK_SIZE + 123)
+    src = tmpdir.join('src')
+    src.write(data, 'wb')
+    src.chmod(0o750)
+    progress = []
+    transfer = T.Transfer(None, workers=3, threshold=threshold,
+                          callback=lambda *a: progress.append(a))
+
+    assert transfer.put(str(src), 'dst') == len(data)
+    assert remote.join('dst').read('rb') == data
+    assert stat.S_IMODE(os.stat(str(remote.join('dst'))).st_mode) == 0o750
+    assert progress[-1] == (len(data), len(data))
+    assert FakeSFTP.opened == (1 if threshold else 4)
+
+    back = tmpdir.join('back')
+    assert transfer.get('dst', str(back)) == len(data)
+    assert back.read('rb') == data
+    assert stat.S_IMODE(os.stat(str(back)).st_mode) == 0o750
+
+
+def test_resolve_remote_path():
+    assert T.resolve_remote_path('a', '~') == 'a'
+    assert T.resolve_remote_path('a', '/srv') == '/srv/a'
+    assert T.resolve_remote_path('~/a', '/srv') == 'a'
+    assert T.resolve_remote_path('/a', '/srv') == '/a'
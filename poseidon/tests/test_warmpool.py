@@ -0,0 +1,156 @@
+import pytest
+
+import poseidon.warmpool as W
+from poseidon.parallel import Job
+from poseidon.provision import Provision
+
+
+class FakeDroplet(object):
+
+    def __init__(self, id, name, status='active'):
+        self.id = id
+        self.name = name
+        self.status = status
+        self.deleted = False
+
+    def connect(self, pool=True):
+        return 'ssh-%d' % self.id
+
+    def delete(self, wait=True):
+        self.deleted = True
+
+
+class FakeDroplets(object):
+
+    def __init__(self, tagged=()):
+        self.created = []
+        self.tagged = list(tagged)
+
+    def by_tag(self, tag):
+        return self.tagged
+
+
+class FakeTags(object):
+
+    def __init__(self):
+        self.names = set()
+        self.members = {}
+
+    def create(self, name):
+        self.names.add(name)
+
+    def tag(self, name, droplet_ids):
+        self.members.setdefault(name, set()).update(droplet_ids)
+
+    def untag(self, name, droplet_ids):
+        self.members.setdefault(name, set()).difference_update(droplet_ids)
+
+
+class FakeClient(object):
+
+    def __init__(self, tagged=()):
+        self.droplets = FakeDroplets(tagged)
+        self.tags = FakeTags()
+
+
+def fake_provision(droplets, specs, setup=None, timeout=600, pool=True):
+    for spec in specs:
+        job = Job(Provision(spec))
+        droplet = FakeDroplet(100 + len(droplets.created), spec['name'])
+        droplets.created.append(droplet)
+        job.value.droplet = droplet
+        if spec['tags'] != ['poseidon-pool-ci']:
+            job.error = ValueError('untagged')
+        elif setup is not None:
+            job.value.result = setup('ssh', droplet)
+        yield job
+
+
+def make_pool(mock, client, **kwargs):
+    mock.patch.object(W, 'provision', fake_provision)
+    return W.WarmPool(client, 'ci', 'nyc3', '512mb', 'ubuntu', **kwargs)
+
+
+def test_acquire_release(mock):
+    adopted = FakeDroplet(1, 'ci-old')
+    client = FakeClient([adopted, FakeDroplet(2, 'ci-new', status='new')])
+    recycled = []
+    with make_pool(mock, client, low=1, high=2, interval=0.01,
+                   recycle=lambda ssh, d: recycled.append(ssh)) as pool:
+        first = pool.acquire(timeout=5)
+        assert first is adopted
+        second = pool.acquire(timeout=5)
+        assert second in client.droplets.created
+        idle = client.tags.members['poseidon-pool-ci-idle']
+        assert first.id not in idle and second.id not in idle
+
+        pool.release(first)
+        assert recycled == ['ssh-1']
+        assert not first.deleted
+        pool.release(second, destroy=True)
+        assert second.deleted
+    assert len(client.droplets.created) == 2
+    assert client.tags.names == set(['poseidon-pool-ci',
+                                     'poseidon-pool-ci-idle'])
+    assert pool.errors == []
+
+
+def test_acquire_untag_fails(mock):
+    adopted = FakeDroplet(1, 'ci-old')
+    client = FakeClient([adopted])
+    mock.patch.object(FakeTags, 'untag',
+                      side_effect=[ValueError('api down'), None])
+    with make_pool(mock, client, low=0, high=0, interval=0.01) as pool:
+        with pytest.raises(ValueError):
+            pool.acquire(timeout=5)
+        assert len(pool) == 1
+        assert pool.acquire(timeout=5) is adopted
+        assert len(pool) == 0
+
+
+def test_release_full_and_close(mock):
+    client = FakeClient()
+    with make_pool(mock, client, low=1, high=1, interval=0.01,
+                   recycle=lambda ssh, d: None) as pool:
+        droplet = pool.acquire(timeout=5)
+        # wait for the replacement so the pool is at its high watermark
+        while not len(pool):
+            W.time.sleep(0.01)
+        pool.release(droplet)
+        assert droplet.deleted
+        pool.close(destroy=True)
+        assert all(d.deleted for d in client.droplets.created)
+
+
+def test_failed_provision_destroyed(mock):
+    client = FakeClient()
+    pool = make_pool(mock, client, low=1, high=1, interval=0.01)
+    pool.tag = 'other'
+    pool.start()
+    with pytest.raises(ValueError):
+        pool.acquire(timeout=0.1)
+    pool.close()
+    assert client.droplets.created
+    assert all(d.deleted for d in client.droplets.created)
+    assert isinstance(pool.errors[0][1], ValueError)
+
+
+def test_failures_back_off(mock):
+    client = FakeClient()
+    pool = make_pool(mock, client, low=2, high=3, interval=0.01,
+                     max_failures=3)
+    pool.tag = 'other'
+    pool.start()
+    pool._thread.join(5)
+    assert not pool._thread.is_alive()
+    # one batch of high droplets per failure, then replenishing stops
+    assert len(client.droplets.created) == 9
+    assert all(d.deleted for d in client.droplets.created)
+    assert 'stopped replenishing' in str(pool.errors[-1][1])
+    pool.close()
+
+
+def test_watermarks():
+    with pytest.raises(ValueError):
+        W.WarmPool(FakeClient(), 'ci', 'nyc3', '512mb', 'ubuntu',
+                   low=3, high=2)
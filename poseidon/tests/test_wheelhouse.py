@@ -0,0 +1,128 @@
+import os
+import subprocess
+
+import pytest
+
+import poseidon.ssh as S
+from poseidon.transfer import resolve_remote_path
+from poseidon.wheelhouse import Wheelhouse
+
+# stands in for pip: wheel writes one file per requirement, install checks
+# that each requirement has one
+FAKE_PIP = """#!/bin/sh
+case "$1" in
+--version) echo "pip 9.0.1 from /usr/lib (python 2.7)" ;;
+wheel)
+    for name in $(cat "$4"); do touch "$6/$name-1.0-py2-none-any.whl"; done
+    echo built >> "$(dirname "$0")/builds" ;;
+install)
+    for name in $(cat "$6"); do
+        [ -f "$4/$name-1.0-py2-none-any.whl" ] || exit 1
+    done
+    echo installed $(cat "$6") ;;
+esac
+"""
+
+
+class LocalHost(object):
+    """
+    SSHClient stand-in whose home directory is a local directory
+    """
+
+    def __init__(self, root, name):
+        self.host = name
+        self.home = root.mkdir(name)
+        self.commands = []
+
+    def run(self, cmd, stdout=None, stderr=None, raise_on_error=True):
+        self.commands.append(cmd)
+        proc = subprocess.Popen(cmd, shell=True, cwd=str(self.home),
+                                env=dict(os.environ, HOME=str(self.home)),
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+        out, err = proc.communicate()
+        for sink, data in ((stdout, out), (stderr, err)):
+            if hasattr(sink, 'write'):
+                sink.write(data)
+            elif sink is not None:
+                sink(data)
+        if proc.returncode and raise_on_error:
+            raise S.CommandError(cmd, proc.returncode)
+        return proc.returncode
+
+    def wait(self, cmd):
+        output = []
+        self.run(cmd, stdout=output.append)
+        return ''.join(output)
+
+    def put(self, local_path, remote_path):
+        path = self.home.join(resolve_remote_path(remote_path))
+        path.write(open(local_path, 'rb').read(), 'wb')
+
+
+@pytest.fixture
+def pip(tmpdir):
+    path = tmpdir.join('pip')
+    path.write(FAKE_PIP)
+    path.chmod(0o755)
+    return str(path)
+
+
+@pytest.fixture
+def requirements(tmpdir):
+    path = tmpdir.join('requirements.txt')
+    path.write('requests\nsimplejson\n')
+    return str(path)
+
+
+def test_install(tmpdir, pip, requirements):
+    builder = LocalHost(tmpdir, 'builder')
+    target = LocalHost(tmpdir, 'target')
+    wheels = Wheelhouse(requirements, builder=builder,
+                        cache_dir=str(tmpdir.join('cache')), pip=pip)
+    assert len(wheels.key) == 16
+
+    assert 'installed requests simplejson' in wheels.install(target)
+    assert os.path.exists(wheels.path)
+    assert tmpdir.join('builds').read() == 'built\n'
+    assert len(target.commands) == 2
+    assert target.home.join('.poseidon', 'wheelhouse', wheels.key,
+                            'requests-1.0-py2-none-any.whl').check()
+
+    # cached locally and present on the host: one exec, no rebuild
+    target.commands = []
+    wheels.install(target)
+    assert len(target.commands) == 1
+    assert tmpdir.join('builds').read() == 'built\n'
+
+
+def test_build_local(tmpdir, pip, requirements):
+    wheels = Wheelhouse(requirements, cache_dir=str(tmpdir.join('cache')),
+                        pip=pip)
+    wheels.build()
+    target = LocalHost(tmpdir, 'target')
+    target.home.join('req.txt').write('requests\n')
+    output = wheels.install(target, requirements='~/req.txt')
+    assert output == 'installed requests\n'
+    other = Wheelhouse(str(tmpdir.join('pip')), pip=pip,
+                       cache_dir=str(tmpdir.join('cache')))
+    assert other.key != wheels.key
+
+
+def test_install_error(tmpdir, pip, requirements):
+    wheels = Wheelhouse(requirements, cache_dir=str(tmpdir.join('cache')),
+                        pip=pip)
+    target = LocalHost(tmpdir, 'target')
+    target.home.join('req.txt').write('missing\n')
+    with pytest.raises(S.CommandError):
+        wheels.install(target, requirements='req.txt')
+    assert wheels.install(target, requirements='req.txt',
+                          raise_on_error=False) == ''
+
+
+def test_pip_r(mock):
+    wheels = mock.Mock()
+    client = S.SSHClient('localhost')
+    client.pip_r('requirements.txt', wheelhouse=wheels)
+    wheels.install.assert_called_with(client, 'requirements.txt',
+                                      raise_on_error=True)
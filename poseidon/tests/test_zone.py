@@ -0,0 +1,109 @@
+from cStringIO import StringIO
+
+import pytest
+
+import poseidon.api as P
+from poseidon.zone import ZoneError, export_zone, format_record, parse_zone
+
+
+ZONE = """\
+$ORIGIN example.com.
+$TTL 3600
+@       IN  SOA ns1.digitalocean.com. hostmaster.example.com. (
+                1 7200 3600 1209600 1800 ) ; serial etc.
+@       IN  NS  ns1.digitalocean.com.
+@           A   127.0.0.1
+        600 IN  AAAA ::1
+www     IN  CNAME @
+mail.example.com. IN MX 10 mx1.example.com.
+txt     IN  TXT "v=spf1 ; -all" "more \\"text\\""
+_sip._tcp IN SRV 10 20 5060 sip
+"""
+
+
+def test_parse_zone():
+    records = list(parse_zone(StringIO(ZONE)))
+    types = [r['type'] for r in records]
+    assert types == ['SOA', 'NS', 'A', 'AAAA', 'CNAME', 'MX', 'TXT', 'SRV']
+    a, aaaa, cname, mx, txt, srv = records[2:]
+    assert (a['name'], a['data']) == ('@', '127.0.0.1')
+    assert (aaaa['name'], aaaa['data']) == ('@', '::1')
+    assert (a['ttl'], aaaa['ttl']) == (3600, 600)
+    assert (cname['name'], cname['data']) == ('www', 'example.com')
+    assert (mx['name'], mx['priority'], mx['data']) == (
+        'mail', 10, 'mx1.example.com')
+    assert txt['data'] == 'v=spf1 ; -allmore "text"'
+    assert (srv['priority'], srv['weight'], srv['port'], srv['data']) == (
+        10, 20, 5060, 'sip.example.com')
+
+
+def test_parse_zone_errors():
+    with pytest.raises(ZoneError):
+        list(parse_zone(['www IN A 127.0.0.1']))
+    with pytest.raises(ZoneError):
+        list(parse_zone(['www IN BOGUS 1'], origin='example.com'))
+    with pytest.raises(ZoneError):
+        list(parse_zone(['mx IN MX mail'], origin='example.com'))
+
+
+def test_parse_zone_parens_in_quotes():
+    records = list(parse_zone(['a IN TXT "foo (bar)"',
+                               'b IN TXT "smile :("',
+                               'c IN TXT ( "x)" ', '"y" )'],
+                              origin='example.com'))
+    assert [r['data'] for r in records] == ['foo (bar)', 'smile :(', 'x)y']
+    with pytest.raises(ZoneError):
+        list(parse_zone(['a IN TXT ( "x"'], origin='example.com'))
+
+
+def test_round_trip():
+    records = [r for r in parse_zone(StringIO(ZONE))
+               if r['type'] not in ('SOA', 'NS')]
+    text = ''.join(export_zone(records, 'example.com'))
+    assert text.startswith('$ORIGIN example.com.\n$TTL 1800\n')
+    assert list(parse_zone(StringIO(text))) == records
+
+
+def test_export_round_trip():
+    # as listed by the API, DigitalOcean's SOA record only carries a TTL
+    records = [
+        {'id': 1, 'type': 'SOA', 'name': '@', 'data': '1800', 'ttl': 1800},
+        {'id': 2, 'type': 'CAA', 'name': '@', 'data': 'letsencrypt.org',
+         'flags': 0, 'tag': 'issue', 'ttl': 3600},
+        {'id': 3, 'type': 'CAA', 'name': '@', 'data': 'mailto:a@example.com',
+         'flags': 128, 'tag': 'iodef', 'ttl': 600},
+        {'id': 4, 'type': 'A', 'name': 'www', 'data': '127.0.0.1',
+         'ttl': 60}]
+    text = ''.join(export_zone(records, 'example.com'))
+    assert 'SOA' not in text
+    assert '@\t3600\tIN\tCAA\t0 issue "letsencrypt.org"\n' in text
+    parsed = list(parse_zone(StringIO(text)))
+    assert [r['type'] for r in parsed] == ['CAA', 'CAA', 'A']
+    for record, expected in zip(parsed, records[1:]):
+        for key in ('name', 'data', 'flags', 'tag', 'ttl'):
+            assert record[key] == expected.get(key)
+
+
+def test_format_record():
+    line = format_record({'type': 'MX', 'name': '@', 'priority': 5,
+                          'data': 'mail.example.com'})
+    assert line == '@\tIN\tMX\t5 mail.example.com.\n'
+
+
+def test_import_zone(mock):
+    domains = P.Domains(P.DigitalOceanAPI(api_key='foo'))
+    mock.patch.object(P.DomainRecords, 'create')
+    created, errors = domains.import_zone(
+        'example.com', StringIO(ZONE), limiter=P.RateLimiter(1000, 1000))
+    assert created == 6
+    assert not errors
+    assert P.DomainRecords.create.call_count == 6
+
+
+def test_export_zone(mock):
+    domains = P.Domains(P.DigitalOceanAPI(api_key='foo'))
+    mock.patch.object(P.DomainRecords, 'iterate', return_value=iter(
+        [{'type': 'A', 'name': '@', 'data': '127.0.0.1'}]))
+    fp = StringIO()
+    domains.export_zone('example.com', fp)
+    assert fp.getvalue().splitlines()[-1] == '@\tIN\tA\t127.0.0.1'
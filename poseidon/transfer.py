@@ -0,0 +1,229 @@
+"""
+SFTP file transfer over an existing SSH transport. Requests are pipelined
+so throughput is not bound by round-trip time, and large files are split
+into parts moved concurrently over separate SFTP channels of the same
+connection
+"""
+from __future__ import absolute_import
+
+import os
+import posixpath
+import threading
+
+import paramiko
+
+from poseidon.parallel import imap_unordered
+
+# per channel flow control window, large enough to keep a fast link with
+# high latency busy
+WINDOW_SIZE = 16 * 2 ** 20
+MAX_PACKET_SIZE = 2 ** 15
+
+# size of each SFTP read/write request
+BLOCK_SIZE = 2 ** 15
+# bytes of reads kept in flight per part when downloading
+READ_AHEAD = 8 * 2 ** 20
+# files smaller than this are moved in a single part
+PART_THRESHOLD = 64 * 2 ** 20
+DEFAULT_WORKERS = 4
+
+
+def open_sftp(transport, window_size=WINDOW_SIZE,
+              max_packet_size=MAX_PACKET_SIZE):
+    """
+    Open an SFTP session on a new channel of the given transport
+    """
+    return paramiko.SFTPClient.from_transport(
+        transport, window_size=window_size, max_packet_size=max_packet_size)
+
+
+def split(size, parts, threshold=PART_THRESHOLD):
+    """
+    Split size bytes into at most parts contiguous (offset, length) ranges,
+    block aligned, with a single range for sizes below threshold
+    """
+    if size < threshold or parts <= 1:
+        return [(0, size)]
+    length = -(-size // parts)
+    length += -length % BLOCK_SIZE
+    return [(offset, min(length, size - offset))
+            for offset in range(0, size, length)]
+
+
+class _Progress(object):
+    """
+    Thread-safe byte counter reporting to a callback(transferred, total)
+    """
+
+    def __init__(self, total, callback=None):
+        self.total = total
+        self.callback = callback
+        self.transferred = 0
+        self._lock = threading.Lock()
+
+    def update(self, n):
+        with self._lock:
+            self.transferred += n
+            transferred = self.transferred
+        if self.callback is not None:
+            self.callback(transferred, self.total)
+
+
+class Transfer(object):
+    """
+    Moves files between the local host and the remote end of a transport
+    """
+
+    def __init__(self, transport, workers=DEFAULT_WORKERS,
+                 window_size=WINDOW_SIZE, max_packet_size=MAX_PACKET_SIZE,
+                 threshold=PART_THRESHOLD, callback=None):
+        """
+        Parameters
+        ----------
+        transport: paramiko.Transport
+        workers: int, default 4
+            number of parts, each on its own SFTP channel, for files larger
+            than threshold
+        window_size: int, default 16MB
+            SSH window of each SFTP channel
+        max_packet_size: int, default 32KB
+            maximum SSH packet size of each SFTP channel
+        threshold: int, default 64MB
+            files smaller than this are transferred in one part
+        callback: callable, optional
+            called with (bytes transferred, total bytes) as data moves
+        """
+        self.transport = transport
+        self.workers = workers
+        self.window_size = window_size
+        self.max_packet_size = max_packet_size
+        self.threshold = threshold
+        self.callback = callback
+
+    def _sftp(self):
+        return open_sftp(self.transport, self.window_size,
+                         self.max_packet_size)
+
+    def put(self, local_path, remote_path):
+        """
+        Upload a local file, preserving its permission bits. Returns the
+        number of bytes sent
+        """
+        size = os.path.getsize(local_path)
+        mode = os.stat(local_path).st_mode & 0o7777
+        progress = _Progress(size, self.callback)
+        ranges = split(size, self.workers, self.threshold)
+
+        sftp = self._sftp()
+        try:
+            # create and size the file up front so parts can be written in
+            # any order
+            with sftp.open(remote_path, 'wb') as fp:
+                if len(ranges) > 1:
+                    fp.truncate(size)
+                else:
+                    self._put_range(fp, local_path, 0, size, progress)
+            sftp.chmod(remote_path, mode)
+        finally:
+            sftp.close()
+
+        if len(ranges) > 1:
+            self._parallel(self._put_part, ranges, local_path, remote_path,
+                           progress)
+        return size
+
+    def _put_part(self, local_path, remote_path, offset, length, progress):
+        sftp = self._sftp()
+        try:
+            with sftp.open(remote_path, 'r+b') as fp:
+                self._put_range(fp, local_path, offset, length, progress)
+        finally:
+            sftp.close()
+
+    def _put_range(self, fp, local_path, offset, length, progress):
+        # writes are acknowledged asynchronously and checked on close
+        fp.set_pipelined(True)
+        fp.seek(offset)
+        with open(local_path, 'rb') as src:
+            src.seek(offset)
+            remaining = length
+            while remaining > 0:
+                data = src.read(min(BLOCK_SIZE, remaining))
+                if not data:
+                    raise IOError('%s changed size during transfer' %
+                                  local_path)
+                fp.write(data)
+                remaining -= len(data)
+                progress.update(len(data))
+
+    def get(self, remote_path, local_path):
+        """
+        Download a remote file, preserving its permission bits. Returns the
+        number of bytes received
+        """
+        sftp = self._sftp()
+        try:
+            stat = sftp.stat(remote_path)
+            size = stat.st_size
+            progress = _Progress(size, self.callback)
+            ranges = split(size, self.workers, self.threshold)
+            with open(local_path, 'wb') as fp:
+                if len(ranges) > 1:
+                    fp.truncate(size)
+                else:
+                    with sftp.open(remote_path, 'rb') as src:
+                        self._get_range(src, fp, 0, size, progress)
+        finally:
+            sftp.close()
+
+        if len(ranges) > 1:
+            self._parallel(self._get_part, ranges, remote_path, local_path,
+                           progress)
+        os.chmod(local_path, stat.st_mode & 0o7777)
+        return size
+
+    def _get_part(self, remote_path, local_path, offset, length, progress):
+        sftp = self._sftp()
+        try:
+            with sftp.open(remote_path, 'rb') as src:
+                with open(local_path, 'r+b') as fp:
+                    self._get_range(src, fp, offset, length, progress)
+        finally:
+            sftp.close()
+
+    def _get_range(self, src, fp, offset, length, progress):
+        fp.seek(offset)
+        end = offset + length
+        while offset < end:
+            # readv sends every request of the window before reading replies
+            window = min(READ_AHEAD, end - offset)
+            blocks = [(o, min(BLOCK_SIZE, offset + window - o))
+                      for o in range(offset, offset + window, BLOCK_SIZE)]
+            for data in src.readv(blocks):
+                fp.write(data)
+                progress.update(len(data))
+            offset += window
+
+    def _parallel(self, func, ranges, src, dst, progress):
+        def part(rng):
+            func(src, dst, rng[0], rng[1], progress)
+
+        errors = [error for _, _, error in
+                  imap_unordered(part, ranges, self.workers)
+                  if error is not None]
+        if errors:
+            raise errors[0]
+
+
+def resolve_remote_path(path, pwd=None):
+    """
+    Resolve a path for SFTP, which does not expand ~ and starts relative
+    paths in the home directory
+    """
+    if pwd and not posixpath.isabs(path) and not path.startswith('~'):
+        path = posixpath.join(pwd, path)
+    if path == '~':
+        return '.'
+    if path.startswith('~/'):
+        return path[2:]
+    return path
@@ -0,0 +1,253 @@
+"""
+Keep a pool of droplets created, active and set up ahead of time so a
+caller gets one immediately instead of waiting for create, boot and setup.
+Pool members carry a membership tag and idle members an extra idle tag, so
+a pool survives restarts of the controller
+"""
+from __future__ import absolute_import
+
+import threading
+import time
+import uuid
+from collections import deque
+
+from poseidon.parallel import backoff
+from poseidon.provision import provision
+
+TAG_PREFIX = 'poseidon-pool-'
+IDLE_SUFFIX = '-idle'
+
+
+class WarmPool(object):
+    """
+    Droplets kept ready between the low and high watermarks. A background
+    thread creates droplets whenever the number of idle and pending ones
+    drops below low, up to high
+
+    Example
+    -------
+    with WarmPool(client, 'ci', 'nyc3', '1gb', 'ubuntu-14-04-x64',
+                  ssh_keys=[key_id], setup=install_deps,
+                  recycle=lambda ssh, d: ssh.run('rm -rf ~/work')) as pool:
+        droplet = pool.acquire(timeout=600)
+        try:
+            droplet.connect().run('make test')
+        finally:
+            pool.release(droplet)
+    """
+
+    def __init__(self, client, name, region, size, image, ssh_keys=None,
+                 low=2, high=4, setup=None, recycle=None,
+                 private_networking=None, interval=30, timeout=600,
+                 max_failures=5, pool=True):
+        """
+        Parameters
+        ----------
+        client: Client
+        name: str
+            pool name, used in the tags and droplet names
+        region, size, image, ssh_keys, private_networking:
+            passed to Droplets.create
+        low: int, default 2
+            replenish when fewer droplets than this are idle or being created
+        high: int, default 4
+            replenish up to this many, released droplets beyond it are
+            destroyed
+        setup: callable, optional
+            called with (ssh, droplet) once after a droplet is created
+        recycle: callable, optional
+            called with (ssh, droplet) on release to reset a droplet before
+            it goes back to the pool. Released droplets are destroyed if None
+        interval: float, default 30
+            seconds between replenishment checks when nothing wakes the
+            background thread
+        timeout: float, default 600
+            seconds a new droplet may take to become active and reachable
+        max_failures: int, default 5
+            replenishment stops after this many batches in a row produced
+            no droplet, waiting longer after each one
+        pool: bool or SSHPool, default True
+        """
+        if not 0 <= low <= high:
+            raise ValueError('watermarks must satisfy 0 <= low <= high, '
+                             'got low=%s high=%s' % (low, high))
+        self.client = client
+        self.name = name
+        self.spec = dict(region=region, size=size, image=image,
+                         ssh_keys=ssh_keys,
+                         private_networking=private_networking)
+        self.low = low
+        self.high = high
+        self.setup = setup
+        self.recycle = recycle
+        self.interval = interval
+        self.timeout = timeout
+        self.max_failures = max_failures
+        self.pool = pool
+        self.tag = TAG_PREFIX + name
+        self.idle_tag = self.tag + IDLE_SUFFIX
+        self.errors = []
+        self._idle = deque()
+        self._busy = {}
+        self._pending = 0
+        self._cond = threading.Condition()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self):
+        return len(self._idle)
+
+    def start(self):
+        """
+        Adopt idle droplets left by a previous run and start replenishing
+        """
+        for tag in (self.tag, self.idle_tag):
+            self.client.tags.create(tag)
+        for droplet in self.client.droplets.by_tag(self.idle_tag):
+            if getattr(droplet, 'status', None) == 'active':
+                self._idle.append(droplet)
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._replenish)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def acquire(self, timeout=None):
+        """
+        Take an idle droplet out of the pool, waiting up to timeout seconds
+        (forever if None) when the pool is empty
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while not self._idle:
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise ValueError('no idle droplet in pool %s after '
+                                         '%s seconds' % (self.name, timeout))
+                self._cond.wait(remaining)
+            droplet = self._idle.popleft()
+            self._busy[droplet.id] = droplet
+            # let the replenisher react to the lower idle count right away
+            self._cond.notify_all()
+        try:
+            self.client.tags.untag(self.idle_tag, [droplet.id])
+        except Exception:
+            # still tagged idle, so it goes back instead of leaking
+            with self._cond:
+                self._busy.pop(droplet.id, None)
+                self._idle.appendleft(droplet)
+                self._cond.notify_all()
+            raise
+        return droplet
+
+    def release(self, droplet, destroy=False):
+        """
+        Give a droplet back. It is reset with recycle and becomes idle again,
+        or is destroyed if destroy is True, there is no recycle function,
+        recycling fails or the pool is already at its high watermark
+        """
+        with self._cond:
+            self._busy.pop(droplet.id, None)
+            full = len(self._idle) + self._pending >= self.high
+        if destroy or full or self.recycle is None:
+            self._destroy(droplet)
+            return
+        try:
+            self.recycle(droplet.connect(pool=self.pool), droplet)
+        except Exception as e:
+            self.errors.append((droplet, e))
+            self._destroy(droplet)
+            return
+        self._add_idle(droplet)
+
+    def close(self, destroy=False):
+        """
+        Stop replenishing, destroying the idle droplets if destroy is True.
+        Acquired droplets are left alone
+        """
+        self._stopped.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if destroy:
+            while self._idle:
+                self._destroy(self._idle.popleft())
+
+    def _replenish(self):
+        failures = 0
+        while not self._stopped.is_set():
+            with self._cond:
+                count = len(self._idle) + self._pending
+                if count >= self.low:
+                    self._cond.wait(self.interval)
+                    continue
+                wanted = self.high - count
+                self._pending += wanted
+            # a generator so nothing new is created once the pool is closed
+            specs = (dict(self.spec, name=self._droplet_name(),
+                          tags=[self.tag])
+                     for _ in range(wanted) if not self._stopped.is_set())
+            done = added = 0
+            for job in provision(self.client.droplets, specs,
+                                 setup=self.setup, timeout=self.timeout,
+                                 pool=self.pool):
+                done += 1
+                droplet = job.value.droplet
+                with self._cond:
+                    self._pending -= 1
+                if job.ok:
+                    self._add_idle(droplet)
+                    added += 1
+                else:
+                    self.errors.append((droplet, job.error))
+                    if droplet is not None:
+                        self._destroy(droplet)
+            with self._cond:
+                # specs skipped because the pool was closed
+                self._pending -= wanted - done
+            if added or self._stopped.is_set():
+                failures = 0
+                continue
+            failures += 1
+            if failures >= self.max_failures:
+                self.errors.append((None, ValueError(
+                    'stopped replenishing pool %s after %d failed batches' %
+                    (self.name, failures))))
+                return
+            self._sleep(self.interval / 2.0 + backoff(
+                failures, base=self.interval / 2.0, cap=self.interval * 8))
+
+    def _sleep(self, seconds):
+        # acquire() notifies the condition, which must not cut this short
+        until = time.time() + seconds
+        with self._cond:
+            while not self._stopped.is_set():
+                remaining = until - time.time()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+    def _add_idle(self, droplet):
+        self.client.tags.tag(self.idle_tag, [droplet.id])
+        with self._cond:
+            self._idle.append(droplet)
+            self._cond.notify_all()
+
+    def _destroy(self, droplet):
+        try:
+            droplet.delete(wait=False)
+        except Exception as e:
+            self.errors.append((droplet, e))
+
+    def _droplet_name(self):
+        return '%s-%s' % (self.name, uuid.uuid4().hex[:8])
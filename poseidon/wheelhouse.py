@@ -0,0 +1,187 @@
+"""
+Build wheels for a requirements file once, on the controller or on a
+builder droplet, cache them by requirements hash and install them on other
+droplets with pip --no-index so they neither download nor compile anything
+"""
+from __future__ import absolute_import
+
+import hashlib
+import os
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import threading
+
+from poseidon.ssh import CommandError
+from poseidon.sync import shell_path
+
+WHEELHOUSE_DIR = os.path.join('~', '.poseidon', 'wheelhouse')
+REMOTE_DIR = '~/.poseidon/wheelhouse'
+REQUIREMENTS = 'requirements.txt'
+COMPLETE = '.complete'
+
+# exit status of the install script when the wheelhouse is not on the host
+_MISSING = 99
+
+# identifies the interpreter wheels are built for; wheels only install on
+# hosts reporting the same value
+PLATFORM_COMMAND = 'uname -sm; %s --version | sed "s/.*(\\(.*\\))/\\1/"'
+
+
+class Wheelhouse(object):
+    """
+    Wheels for one requirements file built for one platform
+
+    Example
+    -------
+    wheels = Wheelhouse('requirements.txt', builder=droplets[0].connect())
+    for res in fleet.map('pip_r', 'app/requirements.txt', wheelhouse=wheels):
+        print(res.host, res.ok)
+    """
+
+    def __init__(self, requirements, builder=None, cache_dir=WHEELHOUSE_DIR,
+                 pip='pip'):
+        """
+        Parameters
+        ----------
+        requirements: str
+            local path to requirements.txt
+        builder: SSHClient, optional
+            host the wheels are built on, which should run the same OS and
+            Python as the targets. Built on the controller if None
+        cache_dir: str, default ~/.poseidon/wheelhouse
+            local directory for built wheelhouses
+        pip: str, default 'pip'
+            pip executable on the builder and the targets
+        """
+        self.requirements = os.path.expanduser(requirements)
+        self.builder = builder
+        self.cache_dir = os.path.expanduser(cache_dir)
+        self.pip = pip
+        self._key = None
+        self._lock = threading.Lock()
+
+    @property
+    def key(self):
+        """
+        Hash of the requirements and the builder's platform
+        """
+        if self._key is None:
+            digest = hashlib.sha1()
+            with open(self.requirements, 'rb') as fp:
+                digest.update(fp.read())
+            digest.update('\0' + self.platform())
+            self._key = digest.hexdigest()[:16]
+        return self._key
+
+    def platform(self):
+        cmd = PLATFORM_COMMAND % self.pip
+        if self.builder is not None:
+            return self.builder.wait(cmd).strip()
+        return subprocess.check_output(cmd, shell=True).strip()
+
+    @property
+    def path(self):
+        """
+        Local path of the wheelhouse archive
+        """
+        return os.path.join(self.cache_dir, '%s.tar.gz' % self.key)
+
+    @property
+    def remote_dir(self):
+        return '%s/%s' % (REMOTE_DIR, self.key)
+
+    def build(self, rebuild=False):
+        """
+        Build the wheelhouse unless it is cached and return the archive path.
+        Safe to call from many threads, the build runs once
+        """
+        with self._lock:
+            if rebuild or not os.path.exists(self.path):
+                if not os.path.isdir(self.cache_dir):
+                    os.makedirs(self.cache_dir)
+                if self.builder is None:
+                    self._build_local()
+                else:
+                    self._build_remote()
+        return self.path
+
+    def _build_local(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            subprocess.check_call([self.pip, 'wheel', '-q', '-r',
+                                   self.requirements, '-w', tmp])
+            shutil.copy(self.requirements, os.path.join(tmp, REQUIREMENTS))
+            fd, partial = tempfile.mkstemp(dir=self.cache_dir)
+            with os.fdopen(fd, 'wb') as fp:
+                with tarfile.open(fileobj=fp, mode='w:gz') as tar:
+                    for name in sorted(os.listdir(tmp)):
+                        tar.add(os.path.join(tmp, name), arcname=name)
+            os.rename(partial, self.path)
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    def _build_remote(self):
+        builder, remote = self.builder, shell_path(self.remote_dir)
+        builder.run('mkdir -p %s' % remote)
+        builder.put(self.requirements, '%s/%s' % (self.remote_dir,
+                                                  REQUIREMENTS))
+        builder.run('%s wheel -q -r %s/%s -w %s && touch %s/%s' % (
+            self.pip, remote, REQUIREMENTS, remote, remote, COMPLETE))
+        # stream the archive back without staging it on the builder
+        fd, partial = tempfile.mkstemp(dir=self.cache_dir)
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                builder.run('tar -C %s -czf - --exclude %s .' %
+                            (remote, COMPLETE), stdout=fp)
+            os.rename(partial, self.path)
+        except Exception:
+            os.remove(partial)
+            raise
+
+    def install(self, client, requirements=None, raise_on_error=True):
+        """
+        Install the requirements on a host from the wheelhouse, uploading it
+        first if the host does not have it yet. A host that already has it
+        costs a single exec
+
+        Parameters
+        ----------
+        client: SSHClient
+        requirements: str, optional
+            remote requirements file, relative to the current directory,
+            defaults to the copy shipped with the wheelhouse
+        raise_on_error: bool, default True
+            If True then raise CommandError if pip fails
+
+        Returns
+        -------
+        pip output
+        """
+        self.build()
+        remote = shell_path(self.remote_dir)
+        if requirements is None:
+            requirements = '%s/%s' % (remote, REQUIREMENTS)
+        install = '%s install --no-index --find-links %s -r %s' % (
+            self.pip, remote, requirements)
+
+        output, errors = [], []
+        status = client.run(
+            '[ -f %s/%s ] || { mkdir -p %s; exit %d; }; %s' % (
+                remote, COMPLETE, remote, _MISSING, install),
+            stdout=output.append, stderr=errors.append, raise_on_error=False)
+        if status == _MISSING:
+            archive = '%s.tar.gz' % self.remote_dir
+            client.put(self.path, archive)
+            output, errors = [], []
+            status = client.run(
+                'tar -C %s -xzf %s && rm -f %s && touch %s/%s && %s' % (
+                    remote, shell_path(archive), shell_path(archive),
+                    remote, COMPLETE, install),
+                stdout=output.append, stderr=errors.append,
+                raise_on_error=False)
+        if status != 0 and raise_on_error:
+            raise CommandError('%s exited with status %d: %s' % (
+                install, status, ''.join(errors)), status, ''.join(errors))
+        return ''.join(output)
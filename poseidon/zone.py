@@ -0,0 +1,264 @@
+"""
+Streaming conversion between DigitalOcean domain records and BIND zone file
+text. Both directions work on generators so zones of any size can be
+converted with flat memory.
+"""
+from __future__ import absolute_import
+
+import re
+
+DEFAULT_TTL = 1800
+
+CLASSES = ('IN', 'CH', 'HS')
+TYPES = ('A', 'AAAA', 'CNAME', 'MX', 'TXT', 'SRV', 'NS', 'SOA', 'CAA', 'PTR')
+HOSTNAME_TYPES = ('CNAME', 'MX', 'NS', 'SRV')
+
+_TOKEN = re.compile(r'"((?:[^"\\]|\\.)*)"|([^\s"]+)')
+
+
+class ZoneError(ValueError):
+    """
+    Error raised when zone file text cannot be parsed
+    """
+
+    def __init__(self, message, lineno):
+        super(ZoneError, self).__init__('line %d: %s' % (lineno, message))
+        self.lineno = lineno
+
+
+def export_zone(records, domain, ttl=DEFAULT_TTL):
+    """
+    Yield BIND zone file lines for the given domain records
+
+    Parameters
+    ----------
+    records: iterable of dict
+        domain records as returned by the API (e.g., DomainRecords.iterate)
+    domain: str
+        domain name, used as $ORIGIN
+    ttl: int, default 1800
+        value for the $TTL directive
+
+    Notes
+    -----
+    SOA records are skipped, DigitalOcean only exposes their TTL
+    """
+    yield '$ORIGIN %s.\n' % domain.rstrip('.')
+    yield '$TTL %d\n' % ttl
+    for record in records:
+        if record['type'] != 'SOA':
+            yield format_record(record)
+
+
+def format_record(record):
+    """
+    Format a single domain record as a zone file line
+    """
+    type = record['type']
+    name = record.get('name') or '@'
+    data = record.get('data')
+    if type in HOSTNAME_TYPES:
+        data = _absolute(data)
+    if type == 'TXT':
+        data = _quote(data)
+    elif type == 'CAA':
+        data = '%s %s %s' % (record.get('flags') or 0, record.get('tag'),
+                             _quote(data))
+    elif type == 'MX':
+        data = '%s %s' % (record.get('priority') or 0, data)
+    elif type == 'SRV':
+        data = '%s %s %s %s' % (record.get('priority') or 0,
+                                record.get('weight') or 0,
+                                record.get('port') or 0, data)
+    if record.get('ttl'):
+        name = '%s\t%d' % (name, record['ttl'])
+    return '%s\tIN\t%s\t%s\n' % (name, type, data)
+
+
+def _quote(data):
+    return '"%s"' % data.replace('\\', '\\\\').replace('"', '\\"')
+
+
+def parse_zone(lines, origin=None):
+    """
+    Parse BIND zone file lines and yield domain record dicts suitable for
+    DomainRecords.create (keys type, name, data, priority, port, weight,
+    flags, tag and ttl)
+
+    Names are made relative to the origin ('@' for the origin itself) and
+    hostnames are returned without the trailing dot. $ORIGIN and $TTL
+    directives, comments, parenthesized continuations and blank owner names
+    are supported. $INCLUDE is not.
+
+    Parameters
+    ----------
+    lines: iterable of str
+        e.g., an open zone file
+    origin: str, optional
+        domain name, required unless the zone starts with $ORIGIN
+    """
+    if origin is not None:
+        origin = origin.rstrip('.')
+    owner = default_ttl = None
+    for lineno, line in _logical_lines(lines):
+        tokens = _tokenize(line)
+        if not tokens:
+            continue
+        if tokens[0][1] == '$ORIGIN':
+            origin = tokens[1][1].rstrip('.')
+            continue
+        if tokens[0][1] == '$TTL':
+            # values with units (e.g., 1h) are left to the API default
+            if len(tokens) > 1 and tokens[1][1].isdigit():
+                default_ttl = int(tokens[1][1])
+            continue
+        if tokens[0][1] == '$GENERATE':
+            continue
+        if tokens[0][1] == '$INCLUDE':
+            raise ZoneError('$INCLUDE is not supported', lineno)
+        if origin is None:
+            raise ZoneError('origin is unknown, pass origin or use $ORIGIN',
+                            lineno)
+
+        if line[0] in ' \t':
+            if owner is None:
+                raise ZoneError('record without owner name', lineno)
+        else:
+            owner = _relative(tokens.pop(0)[1], origin)
+
+        # optional TTL and class in either order
+        ttl = default_ttl
+        while tokens and not tokens[0][0] and (
+                tokens[0][1].isdigit() or tokens[0][1].upper() in CLASSES):
+            token = tokens.pop(0)[1]
+            if token.isdigit():
+                ttl = int(token)
+        if not tokens:
+            raise ZoneError('missing record type', lineno)
+        type = tokens.pop(0)[1].upper()
+        if type not in TYPES:
+            raise ZoneError('unsupported record type %s' % type, lineno)
+        yield _record(type, owner, [t[1] for t in tokens], origin, ttl,
+                      lineno)
+
+
+def _record(type, name, rdata, origin, ttl, lineno):
+    record = {'type': type, 'name': name, 'data': None, 'priority': None,
+              'port': None, 'weight': None, 'flags': None, 'tag': None,
+              'ttl': ttl}
+    try:
+        if type == 'MX':
+            record['priority'] = int(rdata[0])
+            record['data'] = _hostname(rdata[1], origin)
+        elif type == 'SRV':
+            record['priority'] = int(rdata[0])
+            record['weight'] = int(rdata[1])
+            record['port'] = int(rdata[2])
+            record['data'] = _hostname(rdata[3], origin)
+        elif type == 'TXT':
+            record['data'] = ''.join(rdata)
+        elif type == 'CAA':
+            record['flags'] = int(rdata[0])
+            record['tag'] = rdata[1]
+            record['data'] = rdata[2]
+        elif type in HOSTNAME_TYPES:
+            record['data'] = _hostname(rdata[0], origin)
+        else:
+            record['data'] = ' '.join(rdata)
+    except (IndexError, ValueError):
+        raise ZoneError('malformed %s record' % type, lineno)
+    return record
+
+
+def _logical_lines(lines):
+    """
+    Strip comments and join parenthesized continuations
+    """
+    buf, start, depth = [], None, 0
+    for lineno, line in enumerate(lines, 1):
+        line = _strip_comment(line.rstrip('\r\n'))
+        if start is None:
+            start = lineno
+        line, delta = _ungroup(line)
+        depth += delta
+        buf.append(line)
+        if depth <= 0:
+            joined = ' '.join(buf)
+            if joined.strip():
+                yield start, joined
+            buf, start, depth = [], None, 0
+    if buf:
+        raise ZoneError('unbalanced parentheses', start)
+
+
+def _ungroup(line):
+    """
+    Blank out grouping parentheses outside quoted strings
+
+    Returns
+    -------
+    (line, delta): delta is the change in nesting depth
+    """
+    quoted, delta, chars = False, 0, []
+    for i, c in enumerate(line):
+        if c == '"' and (i == 0 or line[i - 1] != '\\'):
+            quoted = not quoted
+        elif c in '()' and not quoted:
+            delta += 1 if c == '(' else -1
+            c = ' '
+        chars.append(c)
+    return ''.join(chars), delta
+
+
+def _strip_comment(line):
+    quoted = False
+    for i, c in enumerate(line):
+        if c == '"' and (i == 0 or line[i - 1] != '\\'):
+            quoted = not quoted
+        elif c == ';' and not quoted:
+            return line[:i]
+    return line
+
+
+def _tokenize(line):
+    """
+    Returns list of (quoted, value) tuples
+    """
+    tokens = []
+    for m in _TOKEN.finditer(line):
+        if m.group(1) is not None:
+            value = re.sub(r'\\(.)', r'\1', m.group(1))
+            tokens.append((True, value))
+        else:
+            tokens.append((False, m.group(2)))
+    return tokens
+
+
+def _relative(name, origin):
+    if name == '@':
+        return '@'
+    if not name.endswith('.'):
+        return name
+    name = name[:-1]
+    if name == origin:
+        return '@'
+    if name.endswith('.' + origin):
+        return name[:-len(origin) - 1]
+    return name
+
+
+def _hostname(name, origin):
+    if name == '@':
+        return origin
+    if name.endswith('.'):
+        return name[:-1]
+    return '%s.%s' % (name, origin)
+
+
+def _absolute(data):
+    if not data or data == '@' or data.endswith('.'):
+        return data
+    if '.' in data:
+        return data + '.'
+    # relative name such as a CNAME to another host in the zone
+    return data
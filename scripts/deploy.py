@@ -1,5 +1,6 @@
 """
-Lucky number 13: deploy a dev Flask app from a github repo in 13 lines
+Deploy a dev Flask app from a github repo. Steps run as a task graph,
+so DNS setup overlaps with provisioning the droplet
 
 one time setup needed:
 
@@ -13,17 +14,32 @@ Caveat emptor:
 """
 
 import poseidon as P
+from poseidon.dag import API, Graph
 client = P.connect()
-ssh_key_id = client.keys.list()[0]['id']
-droplet = client.droplets.create('example.changshe.io', 'sfo1', '512mb',
-                              'ubuntu-14-04-x64', ssh_keys=[ssh_key_id])
-domain = client.domains.create('example.changshe.io', droplet.ip_address)
-records = client.domains.records(domain['name'])
-records.create('A', data=droplet.ip_address)
-ssh = droplet.connect()
-ssh.apt('git python-pip')
-ssh.git(username='changhiskhan', repo='hello_world')
-ssh.chdir('hello_world')
-ssh.pip_r('requirements.txt')
-ssh.nohup('python app.py') # flask goes to ip:5000 by default, DNS takes a while
-print ssh.ps()
+name = 'example.changshe.io'
+g = Graph()
+g.add('key', lambda: client.keys.list()[0]['id'], resource=API)
+g.add('droplet', lambda key: client.droplets.create(
+    name, 'sfo1', '512mb', 'ubuntu-14-04-x64', ssh_keys=[key]),
+    deps=['key'], resource=API)
+# DNS only needs the IP, so it runs while the droplet is being set up
+g.add('domain', lambda d: client.domains.create(name, d.ip_address),
+      deps=['droplet'], resource=API)
+g.add('record', lambda domain, d: client.domains.records(domain['name'])
+      .create('A', data=d.ip_address), deps=['domain', 'droplet'],
+      resource=API)
+g.add('ssh', lambda d: d.connect(wait=True), # sshd may still be starting
+      deps=['droplet'])
+g.add('apt', lambda ssh: ssh.apt('git python-pip'), deps=['ssh'],
+      resource=lambda ssh: ssh.host)
+
+def app(ssh, _):
+    ssh.git(username='changhiskhan', repo='hello_world')
+    ssh.chdir('hello_world')
+    ssh.pip_r('requirements.txt')
+    ssh.nohup('python app.py') # flask goes to ip:5000 by default
+
+g.add('app', app, deps=['ssh', 'apt'], resource=lambda ssh, _: ssh.host)
+report = g.run()
+print report # per-task timings and the critical path
+print g['ssh'].value.ps()